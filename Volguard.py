@@ -12,25 +12,31 @@ import logging
 from logging.handlers import RotatingFileHandler
 import threading
 import multiprocessing
-from multiprocessing import Process, Queue
+from multiprocessing import Process, Queue, shared_memory, resource_tracker
 import traceback
 import concurrent.futures
 from datetime import datetime, timedelta, date
 from typing import Optional, Dict, List, Tuple, Any
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass, asdict, replace
 from enum import Enum
 from urllib.parse import quote
 import io
+import bisect
+import hashlib
 import queue
 import signal
 import atexit
 from contextlib import contextmanager
+from collections import deque
 
 import requests
 import pandas as pd
 import numpy as np
 import pytz
 from arch import arch_model
+from scipy.special import ndtr
+from scipy.optimize import least_squares
+from scipy.signal import lfilter
 import psutil
 
 import upstox_client
@@ -74,6 +80,7 @@ class ProductionConfig:
     MAX_LOSS_PER_TRADE = int(os.getenv("VG_MAX_LOSS_PER_TRADE", "50000"))
     MAX_CAPITAL_PER_TRADE = int(os.getenv("VG_MAX_CAPITAL_PER_TRADE", "300000"))
     MAX_TRADES_PER_DAY = int(os.getenv("VG_MAX_TRADES_PER_DAY", "3"))
+    MAX_CONCURRENT_TRADES = int(os.getenv("VG_MAX_CONCURRENT_TRADES", "1"))  # Open trades the risk supervisor will hold, one per expiry
     MAX_DRAWDOWN_PCT = float(os.getenv("VG_MAX_DRAWDOWN_PCT", "0.15"))
     MAX_CONTRACTS_PER_INSTRUMENT = 1800  # NSE limit per client
     PRICE_CHANGE_THRESHOLD = 0.10  # 10% price change = abort
@@ -83,6 +90,14 @@ class ProductionConfig:
     IRON_FLY_WING_DELTA_TARGET = 0.10
     IRON_FLY_ATM_TOLERANCE = 0.02
     
+    # FIXED builds the structure from the hard-coded deltas; RANKED scores every strike combination, keeping
+    # FIXED's vol/DTE iron fly wing width as the minimum wing
+    STRATEGY_SELECTION = os.getenv("VG_STRATEGY_SELECTION", "FIXED").upper()
+    CANDIDATE_SHORT_DELTA_MIN = 0.10
+    CANDIDATE_SHORT_DELTA_MAX = 0.30
+    CANDIDATE_SIDE_POOL = 200  # Best verticals per side crossed into condors
+    CANDIDATE_TOP_N = 5
+    
     GAMMA_DANGER_DTE = 1
     GEX_STICKY_RATIO = 0.03
     HIGH_VOL_IVP = 75.0
@@ -103,10 +118,22 @@ class ProductionConfig:
     STOP_LOSS_PCT = 1.0
     MAX_SHORT_DELTA = 0.20
     EXIT_DTE = 1
+    
+    # LOCAL prices live greeks with OptionPricer; VENDOR uses the option greek quote API, refreshed every GREEKS_VENDOR_REFRESH
+    GREEKS_SOURCE = os.getenv("VG_GREEKS_SOURCE", "LOCAL").upper()
+    GREEKS_VENDOR_REFRESH = 30  # Seconds between option greek quote calls (also LOCAL's fallback when spot has no price)
+    RISK_FREE_RATE = float(os.getenv("VG_RISK_FREE_RATE", "0.065"))
+    
+    SURFACE_REFIT_TOLERANCE = 0.25  # RMS drift (vol points) of live quotes from the cached smile before a refit
+    SURFACE_MAX_FIT_ERROR = 2.0  # RMS fit error (vol points) above which a smile is rejected
+    SURFACE_MIN_QUOTES = 5
+    SURFACE_MAX_MONEYNESS = 0.20  # |ln(K/F)| range of quotes used in the fit
     SLIPPAGE_TOLERANCE = 0.02
     PARTIAL_FILL_TOLERANCE = 0.95  # Increased from 0.90 for hedge reliability
     HEDGE_FILL_TOLERANCE = 0.98  # Stricter for hedges
     ORDER_TIMEOUT = 10
+    ORDER_STATUS_POLL = 0.2  # REST status polling while the portfolio stream is down
+    ORDER_STREAM_CHECK_INTERVAL = 2.0  # Stream silence on a live order before one REST status check
     MAX_BID_ASK_SPREAD = 0.05
     
     POLL_INTERVAL = 0.5  # Faster polling for better risk response
@@ -114,6 +141,9 @@ class ProductionConfig:
     MAX_API_RETRIES = 3
     DASHBOARD_REFRESH_RATE = 1.0
     PRICE_STALENESS_THRESHOLD = 5  # Seconds before price considered stale
+    # STREAM re-checks exits on every market data tick for the open legs; POLL fetches REST LTP every POLL_INTERVAL
+    RISK_PRICE_SOURCE = os.getenv("VG_RISK_PRICE_SOURCE", "STREAM").upper()
+    RISK_TICK_WAIT = 2.0  # Seconds the stream-driven risk loop waits for a tick before running its periodic checks
     
     DB_PATH = os.getenv("VG_DB_PATH", "/app/data/volguard.db")
     LOG_DIR = os.getenv("VG_LOG_DIR", "/app/logs")
@@ -130,11 +160,37 @@ class ProductionConfig:
     MAX_SLIPPAGE_EVENTS_PER_DAY = 5
     
     ANALYTICS_PROCESS_TIMEOUT = 300
+    FETCH_WORKERS = 8  # Analytics sources are fetched concurrently
+    HISTORY_FETCH_TIMEOUT = 60  # Seconds, per source
+    LTP_FETCH_TIMEOUT = 10
+    EXPIRY_FETCH_TIMEOUT = 15
+    CHAIN_FETCH_TIMEOUT = 30
+    PARTICIPANT_FETCH_TIMEOUT = 25
     DB_WRITER_QUEUE_MAX_SIZE = 10000
     HEARTBEAT_INTERVAL = 30  # Seconds
+    LATENCY_WINDOW = int(os.getenv("VG_LATENCY_WINDOW", "256"))  # Samples kept per timed stage
     WEBSOCKET_RECONNECT_DELAY = 5
     MAX_ZOMBIE_PROCESSES = 3
     
+    # Local market data history
+    CANDLE_STORE_DIR = os.getenv("VG_CANDLE_STORE_DIR", "/app/data/candles")
+    CANDLE_BACKFILL_DAYS = int(os.getenv("VG_CANDLE_BACKFILL_DAYS", "400"))
+    ANALYTICS_LOOKBACK_DAYS = 400
+    PARTICIPANT_CACHE_DIR = os.getenv("VG_PARTICIPANT_CACHE_DIR", "/app/data/participant_oi")
+    CHAIN_SNAPSHOTS_ENABLED = os.getenv("VG_CHAIN_SNAPSHOTS", "TRUE").upper() == "TRUE"
+    CHAIN_SNAPSHOT_DIR = os.getenv("VG_CHAIN_SNAPSHOT_DIR", "/app/data/chain_snapshots")
+    
+    # Backtest replay
+    BACKTEST_GARCH_REFIT_DAYS = 21  # Trading days between GARCH refits; params are filtered forward in between
+    BACKTEST_COST_PER_ORDER = 20.0  # Flat brokerage per leg per side
+    SWEEP_WORKERS = int(os.getenv("VG_SWEEP_WORKERS", "0"))  # 0 = one per CPU core
+    SWEEP_RESULTS_PATH = os.getenv("VG_SWEEP_RESULTS_PATH", "/app/data/sweep_results.jsonl")
+    
+    # GARCH warm start: reuse last fitted params, full refit once per interval
+    GARCH_STATE_PATH = os.getenv("VG_GARCH_STATE_PATH", "/app/data/garch_state.json")
+    GARCH_FULL_REFIT_INTERVAL = int(os.getenv("VG_GARCH_FULL_REFIT_INTERVAL", "86400"))  # Seconds
+    ROLLING_VOL_STATE_PATH = os.getenv("VG_ROLLING_VOL_STATE_PATH", "/app/data/rolling_vol.json")
+    
     # Emergency controls
     KILL_SWITCH_FILE = os.getenv("VG_KILL_SWITCH_FILE", "/app/data/KILL_SWITCH")
     POSITION_RECONCILE_INTERVAL = 300  # Reconcile every 5 minutes
@@ -530,6 +586,100 @@ class DatabaseWriter:
 
 db_writer = DatabaseWriter()
 
+# ==========================================
+# STAGE LATENCY
+# ==========================================
+class LatencyRecorder:
+    """Rolling per-stage latency samples (ms) with p50/p95/p99, persisted to the system_state 'stage_latency' entry"""
+    STATE_KEY = "stage_latency"
+    
+    def __init__(self, window: int = ProductionConfig.LATENCY_WINDOW):
+        self.window = window
+        self.samples: Dict[str, deque] = {}
+        self.counts: Dict[str, int] = {}
+        self.lock = threading.Lock()
+    
+    def record(self, stage: str, ms: float):
+        with self.lock:
+            if stage not in self.samples:
+                self.samples[stage] = deque(maxlen=self.window)
+                self.counts[stage] = 0
+            self.samples[stage].append(ms)
+            self.counts[stage] += 1
+    
+    @contextmanager
+    def stage(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, (time.perf_counter() - started) * 1000)
+    
+    def timed(self, name: str, fn, *args, **kwargs):
+        """fn(*args, **kwargs) as one stage; for work handed to a thread pool"""
+        with self.stage(name):
+            return fn(*args, **kwargs)
+    
+    def drain(self) -> Dict[str, List[float]]:
+        """Samples recorded since the last drain; the analytics worker ships these back with its result"""
+        with self.lock:
+            drained = {name: list(values) for name, values in self.samples.items() if values}
+            self.samples.clear()
+            self.counts.clear()
+        return drained
+    
+    def merge(self, samples: Dict[str, List[float]]):
+        for name, values in samples.items():
+            for ms in values:
+                self.record(name, ms)
+    
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        with self.lock:
+            window = {name: (np.array(values), self.counts[name]) for name, values in self.samples.items() if values}
+        stats = {}
+        for name, (values, count) in sorted(window.items()):
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            stats[name] = {
+                'count': count, 'p50': round(float(p50), 2), 'p95': round(float(p95), 2), 'p99': round(float(p99), 2),
+                'max': round(float(values.max()), 2), 'last': round(float(values[-1]), 2)
+            }
+        return stats
+    
+    def persist(self):
+        """Percentiles for readers plus the raw window, so restore() can carry the histograms across restarts"""
+        stages = self.summary()
+        with self.lock:
+            samples = {name: [round(ms, 2) for ms in values] for name, values in self.samples.items()}
+            counts = dict(self.counts)
+        db_writer.set_state(self.STATE_KEY, json.dumps({
+            'updated_at': datetime.now().isoformat(timespec='seconds'), 'window': self.window,
+            'stages': stages, 'samples': samples, 'counts': counts
+        }))
+    
+    @classmethod
+    def load(cls) -> Optional[Dict]:
+        raw = db_writer.get_state(cls.STATE_KEY)
+        if not raw:
+            return None
+        try:
+            return json.loads(raw)
+        except ValueError as e:
+            logger.warning(f"Discarding corrupt stage latency state: {e}")
+            return None
+    
+    def restore(self):
+        state = self.load()
+        if not state:
+            return
+        counts = state.get('counts', {})
+        with self.lock:
+            for name, values in state.get('samples', {}).items():
+                if name not in self.samples:
+                    self.samples[name] = deque(values, maxlen=self.window)
+                    self.counts[name] = int(counts.get(name, len(values)))
+
+latency_recorder = LatencyRecorder()
+
 # ==========================================
 # CIRCUIT BREAKER (ENHANCED)
 # ==========================================
@@ -866,6 +1016,38 @@ class VolMetrics:
     vol_regime: str
     is_fallback: bool
 
+@dataclass
+class PainCurve:
+    strikes: np.ndarray
+    call_pain: np.ndarray
+    put_pain: np.ndarray
+    
+    @property
+    def pain(self) -> np.ndarray:
+        return self.call_pain + self.put_pain
+    
+    @property
+    def max_pain(self) -> float:
+        return float(self.strikes[np.argmin(self.pain)]) if len(self.strikes) else 0
+    
+    @classmethod
+    def from_oi(cls, strikes, ce_oi, pe_oi) -> 'PainCurve':
+        """Writer payout at expiry for settlement at each strike, O(n log n) via cumulative OI sums"""
+        strikes = np.asarray(strikes, dtype=np.float64)
+        order = np.argsort(strikes, kind='stable')
+        k = strikes[order]
+        ce = np.nan_to_num(np.asarray(ce_oi, dtype=np.float64)[order])
+        pe = np.nan_to_num(np.asarray(pe_oi, dtype=np.float64)[order])
+        if len(k) == 0:
+            return cls(k, k.copy(), k.copy())
+        
+        # Calls at or below the settle strike pay s - K; puts above it pay K - s
+        ce_oi_cum, ce_value_cum = np.cumsum(ce), np.cumsum(ce * k)
+        pe_oi_cum, pe_value_cum = np.cumsum(pe), np.cumsum(pe * k)
+        call_pain = k * ce_oi_cum - ce_value_cum
+        put_pain = (pe_value_cum[-1] - pe_value_cum) - k * (pe_oi_cum[-1] - pe_oi_cum)
+        return cls(k, call_pain, put_pain)
+
 @dataclass
 class StructMetrics:
     net_gex: float
@@ -877,6 +1059,7 @@ class StructMetrics:
     skew_25d: float
     oi_regime: str
     lot_size: int
+    pain_curve: Optional[PainCurve] = None
 
 @dataclass
 class EdgeMetrics:
@@ -891,6 +1074,7 @@ class EdgeMetrics:
     term_spread: float
     term_regime: str
     primary_edge: str
+    iv_30d: float = 0.0  # Constant-maturity ATM IV off the vol surface
 
 @dataclass
 class ParticipantData:
@@ -941,206 +1125,1519 @@ class TradingMandate:
     suggested_structure: str
 
 # ==========================================
-# ANALYTICS ENGINE (UNCHANGED - BRAIN PART)
+# CANDLE STORE (LOCAL DAILY HISTORY)
 # ==========================================
-class AnalyticsEngine:
-    def __init__(self, result_queue: Queue):
-        self.result_queue = result_queue
+class CandleStore:
+    """Append-only on-disk daily candles: one raw column file per field, read back as memmaps"""
+    COLUMNS = ("open", "high", "low", "close", "volume", "oi")
     
-    def run(self, config: Dict):
+    def __init__(self, root: str = ProductionConfig.CANDLE_STORE_DIR):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self.lock = threading.Lock()
+    
+    def _dir(self, key: str) -> str:
+        safe = "".join(c if c.isalnum() else "_" for c in key)
+        path = os.path.join(self.root, safe)
+        os.makedirs(path, exist_ok=True)
+        return path
+    
+    def _length(self, path: str) -> int:
+        """Committed row count; column files may hold uncommitted bytes past it after a crash"""
         try:
-            api_client = upstox_client.ApiClient()
-            api_client.configuration.access_token = config['access_token']
-            
-            history_api = HistoryV3Api(api_client)
-            options_api = OptionsApi(api_client)
-            
-            to_date = date.today().strftime("%Y-%m-%d")
-            from_date = (date.today() - timedelta(days=400)).strftime("%Y-%m-%d")
-            
-            nifty_response = history_api.get_historical_candle_data(
-                instrument_key=ProductionConfig.NIFTY_KEY,
-                unit="days", interval=1, to_date=to_date, from_date=from_date
-            )
-            vix_response = history_api.get_historical_candle_data(
-                instrument_key=ProductionConfig.VIX_KEY,
-                unit="days", interval=1, to_date=to_date, from_date=from_date
-            )
-            
-            nifty_hist = self._parse_candle_response(nifty_response)
-            vix_hist = self._parse_candle_response(vix_response)
-            
-            market_api = upstox_client.MarketQuoteV3Api(api_client)
-            live_prices = market_api.get_ltp(
-                instrument_key=f"{ProductionConfig.NIFTY_KEY},{ProductionConfig.VIX_KEY}"
-            )
-            
-            weekly, monthly, next_weekly, lot_size = self._get_expiries(options_api)
-            
-            weekly_chain = self._get_option_chain(options_api, weekly) if weekly else pd.DataFrame()
-            monthly_chain = self._get_option_chain(options_api, monthly) if monthly else pd.DataFrame()
-            
-            participant_data, participant_yest, fii_net_change, data_date = self._fetch_participant_data()
-            
-            time_metrics = self.get_time_metrics(weekly, monthly, next_weekly)
-            vol_metrics = self.get_vol_metrics(nifty_hist, vix_hist, live_prices)
-            struct_metrics_weekly = self.get_struct_metrics(weekly_chain, vol_metrics.spot, lot_size)
-            struct_metrics_monthly = self.get_struct_metrics(monthly_chain, vol_metrics.spot, lot_size)
-            edge_metrics = self.get_edge_metrics(weekly_chain, monthly_chain, vol_metrics.spot, vol_metrics)
-            external_metrics = self.get_external_metrics(nifty_hist, participant_data, participant_yest, fii_net_change, data_date)
-            
-            result = {
-                'timestamp': datetime.now(),
-                'time_metrics': time_metrics,
-                'vol_metrics': vol_metrics,
-                'weekly_chain': weekly_chain,
-                'monthly_chain': monthly_chain,
-                'lot_size': lot_size,
-                'participant_data': participant_data,
-                'participant_yest': participant_yest,
-                'fii_net_change': fii_net_change,
-                'data_date': data_date,
-                'external_metrics': external_metrics,
-                'edge_metrics': edge_metrics,
-                'struct_metrics_weekly': struct_metrics_weekly,
-                'struct_metrics_monthly': struct_metrics_monthly
-            }
-            
-            self.result_queue.put(('success', result))
-            
-        except Exception as e:
-            logger.error(f"Analytics process error: {e}")
-            traceback.print_exc()
-            self.result_queue.put(('error', str(e)))
+            with open(os.path.join(path, "meta.json")) as f:
+                return int(json.load(f)['rows'])
+        except (FileNotFoundError, ValueError, KeyError):
+            return 0
     
-    def _parse_candle_response(self, response):
-        if response.status != 'success':
-            return pd.DataFrame()
-        
-        candles = response.data.candles if hasattr(response.data, 'candles') else []
+    def _commit(self, path: str, rows: int):
+        tmp = os.path.join(path, "meta.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump({'rows': rows, 'updated_at': datetime.now().isoformat()}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, os.path.join(path, "meta.json"))
+    
+    def _column(self, path: str, name: str, dtype, rows: int) -> np.ndarray:
+        if rows == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(os.path.join(path, f"{name}.bin"), dtype=dtype, mode='r', shape=(rows,))
+    
+    def arrays(self, key: str) -> Dict[str, np.ndarray]:
+        """Read-only memmap views of every column, timestamps as int64 UTC nanoseconds"""
+        with self.lock:
+            path = self._dir(key)
+            rows = self._length(path)
+            data = {'timestamp': self._column(path, "timestamp", np.int64, rows)}
+            for col in self.COLUMNS:
+                data[col] = self._column(path, col, np.float64, rows)
+            return data
+    
+    def last_date(self, key: str) -> Optional[date]:
+        ts = self.arrays(key)['timestamp']
+        if len(ts) == 0:
+            return None
+        return pd.Timestamp(int(ts[-1]), tz='UTC').tz_convert('Asia/Kolkata').date()
+    
+    def append(self, key: str, candles: List) -> int:
+        """Merge raw API candles [ts, o, h, l, c, v, oi]; newer bars overwrite stored ones. Returns rows added."""
         if not candles:
+            return 0
+        
+        new_ts = pd.to_datetime([c[0] for c in candles], utc=True).as_unit('ns').asi8
+        new_vals = np.asarray([c[1:7] for c in candles], dtype=np.float64)
+        order = np.argsort(new_ts, kind='stable')
+        new_ts, new_vals = new_ts[order], new_vals[order]
+        
+        with self.lock:
+            path = self._dir(key)
+            rows = self._length(path)
+            old_ts = np.asarray(self._column(path, "timestamp", np.int64, rows))
+            start = int(np.searchsorted(old_ts, new_ts[0], side='left'))
+            
+            # Rebuild only the overlapping tail; the files never shrink so live memmaps stay valid
+            tail_ts = np.concatenate([old_ts[start:], new_ts])
+            tail_vals = np.vstack([
+                np.column_stack([self._column(path, col, np.float64, rows)[start:] for col in self.COLUMNS]),
+                new_vals
+            ])
+            # Last occurrence of each timestamp wins (fresh data beats stored bars)
+            rev_unique = np.unique(tail_ts[::-1], return_index=True)[1]
+            keep = np.sort(len(tail_ts) - 1 - rev_unique)
+            tail_ts, tail_vals = tail_ts[keep], tail_vals[keep]
+            
+            self._write(path, "timestamp", tail_ts.astype(np.int64), start)
+            for i, col in enumerate(self.COLUMNS):
+                self._write(path, col, np.ascontiguousarray(tail_vals[:, i]), start)
+            
+            total = start + len(tail_ts)
+            self._commit(path, total)
+            return total - rows
+    
+    def _write(self, path: str, name: str, values: np.ndarray, start: int):
+        file_path = os.path.join(path, f"{name}.bin")
+        mode = "r+b" if os.path.exists(file_path) else "wb"
+        with open(file_path, mode) as f:
+            f.seek(start * values.itemsize)
+            f.write(values.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+    
+    def frame(self, key: str, start: Optional[date] = None) -> pd.DataFrame:
+        """DataFrame in the same shape as the REST candle parser (IST timestamp index, float columns)"""
+        data = self.arrays(key)
+        ts = data['timestamp']
+        if len(ts) == 0:
             return pd.DataFrame()
         
-        df = pd.DataFrame(candles, columns=["timestamp", "open", "high", "low", "close", "volume", "oi"])
-        df['timestamp'] = pd.to_datetime(df['timestamp'])
-        df.set_index('timestamp', inplace=True)
-        return df.astype(float).sort_index()
+        first = 0
+        if start is not None:
+            cutoff = pd.Timestamp(start, tz='Asia/Kolkata').tz_convert('UTC').as_unit('ns').value
+            first = int(np.searchsorted(ts, cutoff, side='left'))
+        
+        index = pd.DatetimeIndex(np.asarray(ts[first:]).view('datetime64[ns]'), name='timestamp')
+        index = index.tz_localize('UTC').tz_convert('Asia/Kolkata')
+        return pd.DataFrame({col: np.array(data[col][first:]) for col in self.COLUMNS}, index=index)
+
+# ==========================================
+# PARTICIPANT OI CACHE
+# ==========================================
+class ParticipantDataCache:
+    """Parsed NSE participant-wise OI per trading date; published files never change, so entries never expire"""
     
-    def _get_expiries(self, options_api: OptionsApi) -> Tuple[Optional[date], Optional[date], Optional[date], int]:
+    def __init__(self, root: str = ProductionConfig.PARTICIPANT_CACHE_DIR):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+    
+    def _path(self, day: date) -> str:
+        return os.path.join(self.root, f"{day.strftime('%Y-%m-%d')}.json")
+    
+    def get(self, day: date) -> Optional[Dict[str, ParticipantData]]:
         try:
-            response = options_api.get_option_contracts(instrument_key=ProductionConfig.NIFTY_KEY)
-            if response.status != 'success':
-                return None, None, None, 0
-            
-            data = response.data
-            if not data:
-                return None, None, None, 0
-            
-            lot_size = next((int(c.lot_size) for c in data if hasattr(c, 'lot_size')), 0)
-            expiry_dates = sorted(list(set([
-                datetime.strptime(c.expiry.split('T')[0], "%Y-%m-%d").date()
-                for c in data if hasattr(c, 'expiry') and c.expiry
-            ])))
-            
-            valid_dates = [d for d in expiry_dates if d >= date.today()]
-            if not valid_dates:
-                return None, None, None, lot_size
-            
-            weekly = valid_dates[0]
-            next_weekly = valid_dates[1] if len(valid_dates) > 1 else valid_dates[0]
-            
-            current_month = date.today().month
-            monthly_candidates = [d for d in valid_dates if d.month == (current_month + 1 if current_month < 12 else 1)]
-            if not monthly_candidates:
-                monthly_candidates = [d for d in valid_dates if d.month == current_month]
-            monthly = monthly_candidates[-1] if monthly_candidates else valid_dates[-1]
-            
-            return weekly, monthly, next_weekly, lot_size
+            with open(self._path(day)) as f:
+                raw = json.load(f)
+            if not all(raw.values()):
+                # Written by an older build that cached partial days: drop it so the day is fetched again
+                logger.warning(f"Discarding incomplete participant cache for {day}")
+                try:
+                    os.remove(self._path(day))
+                except OSError:
+                    pass
+                return None
+            return {p: ParticipantData(**fields) for p, fields in raw.items()}
+        except FileNotFoundError:
+            return None
+        except (ValueError, TypeError) as e:
+            logger.warning(f"Discarding corrupt participant cache for {day}: {e}")
+            return None
+    
+    def put(self, day: date, data: Dict[str, ParticipantData]):
+        """Complete days only (every participant parsed); the tmp file never outlives a failed write"""
+        path = self._path(day)
+        tmp = f"{path}.tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump({p: asdict(v) for p, v in data.items()}, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+    
+    def dates(self) -> List[date]:
+        days = []
+        for name in os.listdir(self.root):
+            if name.endswith(".json"):
+                try:
+                    days.append(datetime.strptime(name[:-5], "%Y-%m-%d").date())
+                except ValueError:
+                    continue
+        return sorted(days)
+
+# ==========================================
+# GARCH FORECASTER (WARM-STARTED)
+# ==========================================
+class GarchForecaster:
+    """GARCH(1,1) on daily returns: one fit per analysis, every horizon read from the same forecast"""
+    
+    def __init__(self, state_path: str = ProductionConfig.GARCH_STATE_PATH):
+        self.state_path = state_path
+        self.state = self._load_state()
+    
+    def _load_state(self) -> Dict:
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+            if len(state['params']) != 4:
+                return {}
+            return state
+        except (FileNotFoundError, ValueError, KeyError, TypeError):
+            return {}
+    
+    def _save_state(self):
+        tmp = f"{self.state_path}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.state_path) or ".", exist_ok=True)
+            with open(tmp, "w") as f:
+                json.dump(self.state, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.state_path)
+        except OSError as e:
+            logger.warning(f"GARCH state not saved: {e}")
+    
+    def _full_refit_due(self) -> bool:
+        if not self.state.get('params') or not self.state.get('last_full_fit'):
+            return True
+        try:
+            last = datetime.fromisoformat(self.state['last_full_fit'])
+        except (TypeError, ValueError):
+            return True
+        return (datetime.now() - last).total_seconds() >= ProductionConfig.GARCH_FULL_REFIT_INTERVAL
+    
+    @staticmethod
+    def _converged(result) -> bool:
+        params = result.params
+        persistence = params['alpha[1]'] + params['beta[1]']
+        return result.convergence_flag == 0 and bool(np.all(np.isfinite(params.values))) and persistence < 1
+    
+    def _fit(self, model):
+        now = datetime.now().isoformat()
+        if not self._full_refit_due():
+            result = model.fit(starting_values=np.asarray(self.state['params']), disp='off', show_warning=False)
+            if self._converged(result):
+                self.state.update(params=result.params.tolist(), updated_at=now)
+                self._save_state()
+                return result
+            logger.warning("GARCH warm start did not converge, refitting from default start")
+        
+        result = model.fit(disp='off', show_warning=False)
+        if self._converged(result):
+            self.state = {'params': result.params.tolist(), 'last_full_fit': now, 'updated_at': now}
+            self._save_state()
+        return result
+    
+    @classmethod
+    def fit_params(cls, returns: pd.Series) -> Optional[np.ndarray]:
+        """Cold fit that leaves the persisted warm-start state alone: [mu, omega, alpha, beta], or None"""
+        if len(returns) < 100:
+            return None
+        try:
+            result = arch_model(returns * 100, vol='Garch', p=1, q=1, dist='normal').fit(disp='off', show_warning=False)
         except Exception as e:
-            logger.error(f"Expiries fetch error: {e}")
-            return None, None, None, 0
+            logger.warning(f"GARCH fit failed: {e}")
+            return None
+        return result.params.values if cls._converged(result) else None
     
-    def _get_option_chain(self, options_api: OptionsApi, expiry_date: date) -> pd.DataFrame:
+    @staticmethod
+    def variance_path(returns: np.ndarray, params: np.ndarray, horizons: Tuple[int, ...] = (7, 28)) -> Dict[int, np.ndarray]:
+        """Annualised vol (%) per horizon from every forecast origin, params held fixed.
+        Same recursion and backcast as arch, so the last entry matches forecast() for these params."""
+        mu, omega, alpha, beta = params
+        eps2 = (np.asarray(returns, dtype=np.float64) * 100 - mu) ** 2
+        tau = min(75, len(eps2))
+        weights = 0.94 ** np.arange(tau)
+        backcast = (weights / weights.sum()) @ eps2[:tau]
+        
+        # next_var[t] = omega + alpha * eps2[t] + beta * next_var[t - 1], seeded with the in-sample sigma2[0]
+        sigma2_0 = omega + (alpha + beta) * backcast
+        next_var = lfilter([1.0], [1.0, -beta], omega + alpha * eps2, zi=[beta * sigma2_0])[0]
+        
+        persistence = alpha + beta
+        long_run = omega / (1 - persistence)
+        return {h: np.sqrt((long_run + persistence ** (h - 1) * (next_var - long_run)) * 252) for h in horizons}
+    
+    def forecast(self, returns: pd.Series, horizons: Tuple[int, ...] = (7, 28)) -> Dict[int, float]:
+        """Annualised vol (%) per horizon; 0 when history is too short or the fit fails"""
+        if len(returns) < 100:
+            return {h: 0 for h in horizons}
         try:
-            response = options_api.get_put_call_option_chain(
-                instrument_key=ProductionConfig.NIFTY_KEY,
-                expiry_date=expiry_date.strftime("%Y-%m-%d")
-            )
-            if response.status != 'success':
-                return pd.DataFrame()
-            
-            data = response.data
-            return pd.DataFrame([{
-                'strike': x.strike_price,
-                'ce_iv': x.call_options.option_greeks.iv,
-                'pe_iv': x.put_options.option_greeks.iv,
-                'ce_delta': x.call_options.option_greeks.delta,
-                'pe_delta': x.put_options.option_greeks.delta,
-                'ce_gamma': x.call_options.option_greeks.gamma,
-                'pe_gamma': x.put_options.option_greeks.gamma,
-                'ce_oi': x.call_options.market_data.oi,
-                'pe_oi': x.put_options.market_data.oi,
-                'ce_ltp': x.call_options.market_data.ltp,
-                'pe_ltp': x.put_options.market_data.ltp,
-                'ce_bid': getattr(x.call_options.market_data, 'bid_price', 0),
-                'ce_ask': getattr(x.call_options.market_data, 'ask_price', 0),
-                'pe_bid': getattr(x.put_options.market_data, 'bid_price', 0),
-                'pe_ask': getattr(x.put_options.market_data, 'ask_price', 0),
-                'ce_key': x.call_options.instrument_key,
-                'pe_key': x.put_options.instrument_key
-            } for x in data])
+            model = arch_model(returns * 100, vol='Garch', p=1, q=1, dist='normal')
+            result = self._fit(model)
+            variance = result.forecast(horizon=max(horizons), reindex=False).variance.values[-1]
+            return {h: np.sqrt(variance[h - 1]) * np.sqrt(252) for h in horizons}
         except Exception as e:
-            logger.error(f"Option chain fetch error: {e}")
-            return pd.DataFrame()
+            logger.warning(f"GARCH forecast failed: {e}")
+            return {h: 0 for h in horizons}
+
+# ==========================================
+# ROLLING VOLATILITY (STREAMING)
+# ==========================================
+class RollingWindow:
+    """Fixed-size sliding window with Welford running mean/variance; push and undo are O(1)"""
     
-    def _fetch_participant_data(self):
-        tz = pytz.timezone('Asia/Kolkata')
-        now = datetime.now(tz)
-        dates = []
-        candidate = now
-        if candidate.hour < 18:
-            candidate -= timedelta(days=1)
-        while len(dates) < 2:
-            if candidate.weekday() < 5:
-                dates.append(candidate)
-            candidate -= timedelta(days=1)
-        
-        today, yest = dates[0], dates[1]
+    def __init__(self, size: int):
+        self.size = size
+        self.buf = np.zeros(size, dtype=np.float64)
+        self.pos = 0
+        self.count = 0
+        self.total = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.undo_record = None
+    
+    def push(self, x: float):
+        self.undo_record = (self.pos, self.count, self.total, self.mean, self.m2, float(self.buf[self.pos]))
+        if self.count < self.size:
+            self.count += 1
+            delta = x - self.mean
+            self.mean += delta / self.count
+            self.m2 += delta * (x - self.mean)
+        else:
+            old = self.buf[self.pos]
+            new_mean = self.mean + (x - old) / self.size
+            self.m2 += (x - old) * (x - new_mean + old - self.mean)
+            self.mean = new_mean
+        self.buf[self.pos] = x
+        self.pos = (self.pos + 1) % self.size
+        self.total += 1
+        
+        if self.pos == 0:
+            # Re-anchor once per lap so rounding error cannot accumulate
+            self.mean = float(self.buf.mean())
+            self.m2 = float(((self.buf - self.mean) ** 2).sum())
+    
+    def undo(self):
+        """Revert the most recent push (one level deep)"""
+        pos, self.count, self.total, self.mean, self.m2, old = self.undo_record
+        self.buf[pos] = old
+        self.pos = pos
+        self.undo_record = None
+    
+    def std(self) -> float:
+        """Sample standard deviation (ddof=1, same as pandas rolling std)"""
+        if self.count < 2:
+            return 0.0
+        return float(np.sqrt(max(self.m2, 0.0) / (self.count - 1)))
+    
+    def checkpoint(self) -> tuple:
+        # An undo followed by a push touches at most these two slots
+        slots = {self.pos: float(self.buf[self.pos])}
+        if self.undo_record is not None:
+            slots[self.undo_record[0]] = float(self.buf[self.undo_record[0]])
+        return self.pos, self.count, self.total, self.mean, self.m2, self.undo_record, slots
+    
+    def rollback(self, checkpoint: tuple):
+        self.pos, self.count, self.total, self.mean, self.m2, self.undo_record, slots = checkpoint
+        for i, value in slots.items():
+            self.buf[i] = value
+    
+    def to_dict(self) -> Dict:
+        return {
+            'buf': self.buf.tolist(), 'pos': self.pos, 'count': self.count, 'total': self.total,
+            'mean': self.mean, 'm2': self.m2, 'undo': list(self.undo_record) if self.undo_record else None
+        }
+    
+    @classmethod
+    def from_dict(cls, size: int, raw: Dict) -> 'RollingWindow':
+        window = cls(size)
+        window.buf[:] = raw['buf']
+        window.pos, window.count, window.total = int(raw['pos']), int(raw['count']), int(raw['total'])
+        window.mean, window.m2 = float(raw['mean']), float(raw['m2'])
+        window.undo_record = tuple(raw['undo']) if raw['undo'] else None
+        return window
+
+class PercentileWindow:
+    """Last `size` values in arrival order plus a sorted copy; rank lookups are O(log n) bisects"""
+    
+    def __init__(self, size: int):
+        self.size = size
+        self.values = deque()
+        self.sorted = []
+        self.total = 0
+        self.undo_record = None
+    
+    def push(self, x: float):
+        evicted = self.values.popleft() if len(self.values) == self.size else None
+        if evicted is not None:
+            del self.sorted[bisect.bisect_left(self.sorted, evicted)]
+        self.values.append(x)
+        bisect.insort(self.sorted, x)
+        self.total += 1
+        self.undo_record = (x, evicted)
+    
+    def undo(self):
+        """Revert the most recent push (one level deep)"""
+        x, evicted = self.undo_record
+        self.values.pop()
+        del self.sorted[bisect.bisect_left(self.sorted, x)]
+        if evicted is not None:
+            self.values.appendleft(evicted)
+            bisect.insort(self.sorted, evicted)
+        self.total -= 1
+        self.undo_record = None
+    
+    def percentile(self, x: float) -> float:
+        """Percent of the window strictly below x; 0 until `size` values have been seen"""
+        if self.total < self.size:
+            return 0.0
+        return bisect.bisect_left(self.sorted, x) / len(self.sorted) * 100
+    
+    def checkpoint(self) -> tuple:
+        return deque(self.values), list(self.sorted), self.total, self.undo_record
+    
+    def rollback(self, checkpoint: tuple):
+        self.values, self.sorted, self.total, self.undo_record = checkpoint
+    
+    def to_dict(self) -> Dict:
+        return {'values': list(self.values), 'total': self.total, 'undo': list(self.undo_record) if self.undo_record else None}
+    
+    @classmethod
+    def from_dict(cls, size: int, raw: Dict) -> 'PercentileWindow':
+        window = cls(size)
+        window.values = deque(float(v) for v in raw['values'])
+        window.sorted = sorted(window.values)
+        window.total = int(raw['total'])
+        window.undo_record = tuple(raw['undo']) if raw['undo'] else None
+        return window
+
+class RollingVolEngine:
+    """Streaming state behind the history-derived VolMetrics fields (RV, Parkinson, ATR, MA20, vol-of-vol, IVP)"""
+    VERSION = 2
+    WINDOWS = {
+        'rv7': (RollingWindow, 7), 'rv28': (RollingWindow, 28), 'rv90': (RollingWindow, 90),
+        'park7': (RollingWindow, 7), 'park28': (RollingWindow, 28),
+        'ma20': (RollingWindow, 20), 'atr14': (RollingWindow, 14),
+        'vix_ret30': (RollingWindow, 30), 'vov60': (RollingWindow, 60),
+        'ivp30': (PercentileWindow, 30), 'ivp90': (PercentileWindow, 90), 'ivp252': (PercentileWindow, 252)
+    }
+    SERIES_WINDOWS = {
+        'nifty': ('rv7', 'rv28', 'rv90', 'park7', 'park28', 'ma20', 'atr14'),
+        'vix': ('vix_ret30', 'vov60', 'ivp30', 'ivp90', 'ivp252')
+    }
+    
+    def __init__(self, state_path: Optional[str] = ProductionConfig.ROLLING_VOL_STATE_PATH):
+        """state_path=None keeps the state in memory only (replays)"""
+        self.state_path = state_path
+        self.windows = {name: self._new_window(name) for name in self.WINDOWS}
+        self.series = {name: {'ts': None, 'bar': None, 'undo': None} for name in self.SERIES_WINDOWS}
+        self.dirty = False
+        self._load_state()
+    
+    @classmethod
+    def _new_window(cls, name: str):
+        window_cls, size = cls.WINDOWS[name]
+        return window_cls(size)
+    
+    def _reset_series(self, name: str):
+        for window in self.SERIES_WINDOWS[name]:
+            self.windows[window] = self._new_window(window)
+        self.series[name] = {'ts': None, 'bar': None, 'undo': None}
+        self.dirty = True
+    
+    def _push_nifty(self, bar: Tuple[float, float, float], prev: Optional[Tuple]) -> List[str]:
+        high, low, close = bar
+        w = self.windows
+        pushed = ['park7', 'park28', 'ma20', 'atr14']
+        if prev is not None:
+            prev_close = prev[2]
+            ret = np.log(close / prev_close)
+            for name in ('rv7', 'rv28', 'rv90'):
+                w[name].push(ret)
+            pushed += ['rv7', 'rv28', 'rv90']
+            true_range = max(high - low, abs(high - prev_close), abs(low - prev_close))
+        else:
+            true_range = high - low
+        
+        hl_sq = np.log(high / low) ** 2
+        w['park7'].push(hl_sq)
+        w['park28'].push(hl_sq)
+        w['ma20'].push(close)
+        w['atr14'].push(true_range)
+        return pushed
+    
+    def _push_vix(self, bar: Tuple[float], prev: Optional[Tuple]) -> List[str]:
+        w = self.windows
+        pushed = ['ivp30', 'ivp90', 'ivp252']
+        for name in pushed:
+            w[name].push(bar[0])
+        if prev is None:
+            return pushed
+        
+        w['vix_ret30'].push(np.log(bar[0] / prev[0]))
+        if w['vix_ret30'].total < 30:
+            return pushed + ['vix_ret30']
+        w['vov60'].push(w['vix_ret30'].std() * np.sqrt(252) * 100)
+        return pushed + ['vix_ret30', 'vov60']
+    
+    def _push(self, name: str, ts: int, bar: Tuple):
+        state = self.series[name]
+        push = self._push_nifty if name == 'nifty' else self._push_vix
+        pushed = push(bar, state['bar'])
+        state['undo'] = (state['ts'], state['bar'], pushed)
+        state['ts'], state['bar'] = ts, bar
+        self.dirty = True
+    
+    def _undo(self, name: str):
+        state = self.series[name]
+        ts, bar, pushed = state['undo']
+        for window in pushed:
+            self.windows[window].undo()
+        state.update(ts=ts, bar=bar, undo=None)
+        self.dirty = True
+    
+    def update(self, name: str, ts: int, bar: Tuple) -> bool:
+        """Apply one bar: a newer timestamp appends, the same timestamp revises the last bar.
+        Returns False when the bar cannot be applied incrementally (older bar, or revision with no undo)."""
+        state = self.series[name]
+        if state['ts'] is not None and ts <= state['ts']:
+            if ts < state['ts']:
+                return False
+            if bar == state['bar']:
+                return True
+            if state['undo'] is None:
+                return False
+            self._undo(name)
+        self._push(name, ts, bar)
+        return True
+    
+    def _sync_series(self, name: str, hist: pd.DataFrame, columns: Tuple[str, ...]):
+        if hist.empty:
+            if self.series[name]['ts'] is not None:
+                self._reset_series(name)
+            return
         
-        def fetch_oi_csv(date_obj):
-            date_str = date_obj.strftime('%d%m%Y')
-            url = f"https://archives.nseindia.com/content/nsccl/fao_participant_oi_{date_str}.csv"
-            try:
-                headers = {"User-Agent": "Mozilla/5.0"}
-                r = requests.get(url, headers=headers, timeout=10)
-                if r.status_code == 200:
-                    content = r.content.decode('utf-8')
-                    lines = content.splitlines()
-                    for idx, line in enumerate(lines[:20]):
-                        if "Future Index Long" in line:
-                            df = pd.read_csv(io.StringIO(content), skiprows=idx)
-                            df.columns = df.columns.str.strip()
-                            return df
-            except:
-                pass
-            return None
+        ts = hist.index.as_unit('ns').asi8
+        values = hist[list(columns)].to_numpy(dtype=np.float64)
+        state = self.series[name]
+        start = 0
+        if state['ts'] is not None:
+            p = int(np.searchsorted(ts, state['ts']))
+            if p < len(ts) and ts[p] == state['ts'] and self.update(name, int(ts[p]), tuple(values[p].tolist())):
+                start = p + 1
+            else:
+                logger.info(f"Rolling vol state for {name} does not line up with history - rebuilding")
+                self._reset_series(name)
         
-        df_today = fetch_oi_csv(today)
-        df_yest = fetch_oi_csv(yest)
+        for i in range(start, len(ts)):
+            self._push(name, int(ts[i]), tuple(values[i].tolist()))
+    
+    def sync(self, nifty_hist: pd.DataFrame, vix_hist: pd.DataFrame):
+        """Bring the state up to the last daily bar of each history, touching only new or revised bars"""
+        self._sync_series('nifty', nifty_hist, ('high', 'low', 'close'))
+        self._sync_series('vix', vix_hist, ('close',))
+        if self.dirty:
+            self._save_state()
+    
+    def metrics(self) -> Dict[str, float]:
+        w = self.windows
+        annualise = np.sqrt(252) * 100
+        const = 1.0 / (4.0 * np.log(2.0))
         
-        if df_today is None:
-            return None, None, 0.0, today.strftime('%d-%b-%Y')
+        def rv(name):
+            return w[name].std() * annualise if w[name].total >= w[name].size else 0
         
-        today_data = self._process_participant_data(df_today)
-        yest_data = self._process_participant_data(df_yest) if df_yest is not None else {}
+        def park(name):
+            return np.sqrt(w[name].mean * const) * annualise if w[name].total >= w[name].size else 0
         
-        fii_net_change = 0.0
-        if today_data.get('FII') and yest_data.get('FII'):
-            fii_net_change = today_data['FII'].fut_net - yest_data['FII'].fut_net
+        vov = rv('vix_ret30')
+        vov_window = w['vov60']
+        vov_mean = vov_window.mean if vov_window.total >= vov_window.size else 0
+        vov_std = vov_window.std() if vov_window.total >= vov_window.size else 0
         
-        return today_data, yest_data, fii_net_change, today.strftime('%d-%b-%Y')
+        return {
+            'rv7': rv('rv7'), 'rv28': rv('rv28'), 'rv90': rv('rv90'),
+            'park7': park('park7'), 'park28': park('park28'),
+            'ma20': w['ma20'].mean if w['ma20'].total >= 20 else 0,
+            'atr14': w['atr14'].mean if w['atr14'].total >= 14 else 0,
+            'vov': vov,
+            'vov_zscore': (vov - vov_mean) / vov_std if vov_std > 0 else 0
+        }
     
-    def _process_participant_data(self, df) -> Dict[str, ParticipantData]:
+    def ivp(self, vix: float) -> Dict[str, float]:
+        """IV percentile of `vix` against the last 30/90/252 daily VIX closes; cheap enough for every tick"""
+        return {
+            'ivp_30d': self.windows['ivp30'].percentile(vix),
+            'ivp_90d': self.windows['ivp90'].percentile(vix),
+            'ivp_1yr': self.windows['ivp252'].percentile(vix)
+        }
+    
+    def preview(self, high: float, low: float, close: float, vix_close: float,
+                day: Optional[date] = None) -> Dict[str, float]:
+        """Metrics as if an intraday bar for `day` (default today) were in the history; state is left untouched"""
+        ts = pd.Timestamp(day or date.today(), tz='Asia/Kolkata').as_unit('ns').value
+        checkpoints = {name: window.checkpoint() for name, window in self.windows.items()}
+        series = {name: dict(state) for name, state in self.series.items()}
+        dirty = self.dirty
+        try:
+            self.update('nifty', ts, (high, low, close))
+            self.update('vix', ts, (vix_close,))
+            metrics = self.metrics()
+            metrics.update(self.ivp(vix_close))
+            return metrics
+        finally:
+            for name, checkpoint in checkpoints.items():
+                self.windows[name].rollback(checkpoint)
+            self.series = series
+            self.dirty = dirty
+    
+    def _load_state(self):
+        if self.state_path is None:
+            return
+        try:
+            with open(self.state_path) as f:
+                raw = json.load(f)
+            if raw.get('version') != self.VERSION:
+                return
+            windows = {
+                name: window_cls.from_dict(size, raw['windows'][name])
+                for name, (window_cls, size) in self.WINDOWS.items()
+            }
+            series = {}
+            for name, state in raw['series'].items():
+                undo = state['undo']
+                series[name] = {
+                    'ts': state['ts'],
+                    'bar': tuple(state['bar']) if state['bar'] is not None else None,
+                    'undo': (undo[0], tuple(undo[1]) if undo[1] is not None else None, undo[2]) if undo else None
+                }
+            self.windows, self.series = windows, series
+        except FileNotFoundError:
+            return
+        except (ValueError, KeyError, TypeError, IndexError) as e:
+            logger.warning(f"Discarding rolling vol state: {e}")
+    
+    def _save_state(self):
+        if self.state_path is None:
+            self.dirty = False
+            return
+        payload = {
+            'version': self.VERSION,
+            'windows': {name: window.to_dict() for name, window in self.windows.items()},
+            'series': self.series,
+            'updated_at': datetime.now().isoformat()
+        }
+        tmp = f"{self.state_path}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.state_path) or ".", exist_ok=True)
+            with open(tmp, "w") as f:
+                json.dump(payload, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.state_path)
+            self.dirty = False
+        except OSError as e:
+            logger.warning(f"Rolling vol state not saved: {e}")
+
+# ==========================================
+# OPTION CHAIN (COLUMNAR)
+# ==========================================
+class OptionChain:
+    """Struct-of-arrays option chain: one typed numpy column per field, one row per strike"""
+    NUMERIC_COLUMNS = (
+        'strike', 'ce_iv', 'pe_iv', 'ce_delta', 'pe_delta', 'ce_gamma', 'pe_gamma',
+        'ce_oi', 'pe_oi', 'ce_ltp', 'pe_ltp', 'ce_bid', 'ce_ask', 'pe_bid', 'pe_ask'
+    )
+    KEY_COLUMNS = ('ce_key', 'pe_key')
+    COLUMNS = NUMERIC_COLUMNS + KEY_COLUMNS
+    
+    def __init__(self, columns: Dict[str, np.ndarray]):
+        self.columns = columns
+    
+    def __len__(self) -> int:
+        return len(self.columns['strike'])
+    
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.columns[name]
+    
+    @property
+    def empty(self) -> bool:
+        return len(self) == 0
+    
+    @classmethod
+    def allocate(cls, rows: int) -> 'OptionChain':
+        columns = {name: np.zeros(rows, dtype=np.float64) for name in cls.NUMERIC_COLUMNS}
+        columns.update({name: np.empty(rows, dtype=object) for name in cls.KEY_COLUMNS})
+        return cls(columns)
+    
+    @classmethod
+    def from_sdk(cls, data) -> 'OptionChain':
+        """Fill columns straight from get_put_call_option_chain response data (None greeks become NaN)"""
+        chain = cls.allocate(len(data))
+        (strike, ce_iv, pe_iv, ce_delta, pe_delta, ce_gamma, pe_gamma,
+         ce_oi, pe_oi, ce_ltp, pe_ltp, ce_bid, ce_ask, pe_bid, pe_ask) = (chain.columns[name] for name in cls.NUMERIC_COLUMNS)
+        ce_key, pe_key = chain.columns['ce_key'], chain.columns['pe_key']
+        
+        for i, x in enumerate(data):
+            ce, pe = x.call_options, x.put_options
+            ce_greeks, pe_greeks = ce.option_greeks, pe.option_greeks
+            ce_market, pe_market = ce.market_data, pe.market_data
+            
+            strike[i] = x.strike_price
+            ce_iv[i], pe_iv[i] = ce_greeks.iv, pe_greeks.iv
+            ce_delta[i], pe_delta[i] = ce_greeks.delta, pe_greeks.delta
+            ce_gamma[i], pe_gamma[i] = ce_greeks.gamma, pe_greeks.gamma
+            ce_oi[i], pe_oi[i] = ce_market.oi, pe_market.oi
+            ce_ltp[i], pe_ltp[i] = ce_market.ltp, pe_market.ltp
+            ce_bid[i], ce_ask[i] = getattr(ce_market, 'bid_price', 0), getattr(ce_market, 'ask_price', 0)
+            pe_bid[i], pe_ask[i] = getattr(pe_market, 'bid_price', 0), getattr(pe_market, 'ask_price', 0)
+            ce_key[i], pe_key[i] = ce.instrument_key, pe.instrument_key
+        return chain
+    
+    @classmethod
+    def from_json(cls, data: List[Dict]) -> 'OptionChain':
+        """Same as from_sdk for the raw REST payload (response.json()['data'])"""
+        chain = cls.allocate(len(data))
+        (strike, ce_iv, pe_iv, ce_delta, pe_delta, ce_gamma, pe_gamma,
+         ce_oi, pe_oi, ce_ltp, pe_ltp, ce_bid, ce_ask, pe_bid, pe_ask) = (chain.columns[name] for name in cls.NUMERIC_COLUMNS)
+        ce_key, pe_key = chain.columns['ce_key'], chain.columns['pe_key']
+        
+        for i, x in enumerate(data):
+            ce, pe = x['call_options'], x['put_options']
+            ce_greeks, pe_greeks = ce.get('option_greeks') or {}, pe.get('option_greeks') or {}
+            ce_market, pe_market = ce.get('market_data') or {}, pe.get('market_data') or {}
+            
+            strike[i] = x['strike_price']
+            ce_iv[i], pe_iv[i] = ce_greeks.get('iv'), pe_greeks.get('iv')
+            ce_delta[i], pe_delta[i] = ce_greeks.get('delta'), pe_greeks.get('delta')
+            ce_gamma[i], pe_gamma[i] = ce_greeks.get('gamma'), pe_greeks.get('gamma')
+            ce_oi[i], pe_oi[i] = ce_market.get('oi'), pe_market.get('oi')
+            ce_ltp[i], pe_ltp[i] = ce_market.get('ltp'), pe_market.get('ltp')
+            ce_bid[i], ce_ask[i] = ce_market.get('bid_price', 0), ce_market.get('ask_price', 0)
+            pe_bid[i], pe_ask[i] = pe_market.get('bid_price', 0), pe_market.get('ask_price', 0)
+            ce_key[i], pe_key[i] = ce.get('instrument_key'), pe.get('instrument_key')
+        return chain
+    
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> 'OptionChain':
+        chain = cls.allocate(len(df))
+        for name in cls.COLUMNS:
+            if name in df.columns:
+                chain.columns[name][:] = df[name].to_numpy()
+        return chain
+    
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray]) -> 'OptionChain':
+        """Wrap existing numeric column arrays (e.g. shared-memory views) without copying; key columns are converted
+        back to objects with None for a missing key, as from_json/from_frame produce"""
+        columns = {name: arrays[name] for name in cls.NUMERIC_COLUMNS}
+        for name in cls.KEY_COLUMNS:
+            columns[name] = np.array([key if key else None for key in arrays[name].tolist()], dtype=object)
+        return cls(columns)
+    
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        """Columns as flat buffers, instrument keys as fixed-width unicode"""
+        arrays = {name: self.columns[name] for name in self.NUMERIC_COLUMNS}
+        for name in self.KEY_COLUMNS:
+            arrays[name] = np.array(['' if key is None else key for key in self.columns[name]], dtype=str)
+        return arrays
+    
+    def to_frame(self) -> pd.DataFrame:
+        """DataFrame in the column layout the strategy/metrics code expects"""
+        if self.empty:
+            return pd.DataFrame()
+        return pd.DataFrame({name: self.columns[name] for name in self.COLUMNS})
+
+# ==========================================
+# CHAIN SNAPSHOT STORE
+# ==========================================
+class ChainSnapshotStore:
+    """Option chains per trading day and expiry for backtests: <day>/<expiry>.npz plus a meta.json; later snapshots of a day replace earlier ones"""
+    
+    def __init__(self, root: str = ProductionConfig.CHAIN_SNAPSHOT_DIR):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+    
+    def _dir(self, day: date) -> str:
+        return os.path.join(self.root, day.strftime('%Y-%m-%d'))
+    
+    @staticmethod
+    def _write_atomic(path: str, write):
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    
+    def put(self, taken_at: datetime, spot: float, vix: float, lot_size: int,
+            expiries: Dict[str, Optional[date]], chains: Dict[date, OptionChain]):
+        """Chains first, then the day's meta.json, which is what makes the snapshot visible"""
+        path = self._dir(taken_at.date())
+        os.makedirs(path, exist_ok=True)
+        
+        stored = []
+        for expiry, chain in chains.items():
+            if chain is None or chain.empty:
+                continue
+            name = expiry.strftime('%Y-%m-%d')
+            self._write_atomic(os.path.join(path, f"{name}.npz"), lambda f: np.savez(f, **chain.to_arrays()))
+            stored.append(name)
+        
+        meta = {
+            'taken_at': taken_at.isoformat(), 'spot': spot, 'vix': vix, 'lot_size': lot_size,
+            **{kind: expiry.strftime('%Y-%m-%d') if expiry else None for kind, expiry in expiries.items()},
+            'chains': stored
+        }
+        self._write_atomic(os.path.join(path, "meta.json"), lambda f: f.write(json.dumps(meta).encode()))
+    
+    def meta(self, day: date) -> Optional[Dict]:
+        try:
+            with open(os.path.join(self._dir(day), "meta.json")) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except ValueError as e:
+            logger.warning(f"Discarding corrupt chain snapshot meta for {day}: {e}")
+            return None
+    
+    def get(self, day: date, expiry: date) -> Optional[OptionChain]:
+        try:
+            with np.load(os.path.join(self._dir(day), f"{expiry.strftime('%Y-%m-%d')}.npz"), allow_pickle=False) as data:
+                return OptionChain.from_arrays({name: data[name] for name in data.files})
+        except FileNotFoundError:
+            return None
+        except (ValueError, KeyError, OSError) as e:
+            logger.warning(f"Discarding corrupt chain snapshot {day}/{expiry}: {e}")
+            return None
+    
+    def dates(self) -> List[date]:
+        days = []
+        for name in os.listdir(self.root):
+            if os.path.exists(os.path.join(self.root, name, "meta.json")):
+                try:
+                    days.append(datetime.strptime(name, "%Y-%m-%d").date())
+                except ValueError:
+                    continue
+        return sorted(days)
+
+# ==========================================
+# OPTION PRICING (BLACK-76)
+# ==========================================
+class OptionPricer:
+    """Vectorized Black-76 prices, greeks and implied vols in the vendor's units (IV in %, theta per day, vega per vol point)"""
+    MIN_VOL = 1e-4
+    MAX_VOL = 5.0
+    IV_TOLERANCE = 1e-6  # Premium error in rupees
+    IV_MAX_ITER = 50
+    
+    @staticmethod
+    def time_to_expiry(expiry: date, now: Optional[datetime] = None) -> float:
+        """Years to the expiry-day close, floored at one minute so expiry-day greeks stay finite"""
+        tz = pytz.timezone('Asia/Kolkata')
+        now = now or datetime.now(tz)
+        if now.tzinfo is None:
+            now = tz.localize(now)
+        close = tz.localize(datetime(expiry.year, expiry.month, expiry.day, *ProductionConfig.MARKET_CLOSE))
+        return max((close - now).total_seconds(), 60.0) / (365.0 * 86400)
+    
+    @staticmethod
+    def _inputs(spot, strike, t, is_call, *rest) -> List[np.ndarray]:
+        arrays = [np.asarray(x, dtype=np.float64) for x in (spot, strike, t, *rest)]
+        return np.broadcast_arrays(*arrays, np.asarray(is_call, dtype=bool))
+    
+    @staticmethod
+    def _d1_d2(forward: np.ndarray, strike: np.ndarray, t: np.ndarray, vol: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        sd = vol * np.sqrt(t)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            d1 = (np.log(forward / strike) + 0.5 * sd * sd) / sd
+        return d1, d1 - sd
+    
+    @classmethod
+    def price(cls, spot, strike, t, vol, is_call, rate: float = ProductionConfig.RISK_FREE_RATE) -> np.ndarray:
+        """Discounted premium on the forward implied by spot and rate; vol as a decimal"""
+        spot, strike, t, vol, is_call = cls._inputs(spot, strike, t, is_call, vol)
+        discount = np.exp(-rate * t)
+        forward = spot / discount
+        d1, d2 = cls._d1_d2(forward, strike, t, vol)
+        call = discount * (forward * ndtr(d1) - strike * ndtr(d2))
+        put = discount * (strike * ndtr(-d2) - forward * ndtr(-d1))
+        return np.where(is_call, call, put)
+    
+    @classmethod
+    def greeks(cls, spot, strike, t, vol, is_call, rate: float = ProductionConfig.RISK_FREE_RATE) -> Dict[str, np.ndarray]:
+        """iv, delta, gamma, theta and vega per unit of underlying; NaN wherever vol is NaN"""
+        spot, strike, t, vol, is_call = cls._inputs(spot, strike, t, is_call, vol)
+        discount = np.exp(-rate * t)
+        d1, d2 = cls._d1_d2(spot / discount, strike, t, vol)
+        pdf = np.exp(-0.5 * d1 * d1) / np.sqrt(2 * np.pi)
+        sqrt_t = np.sqrt(t)
+        decay = -spot * pdf * vol / (2 * sqrt_t)
+        carry = rate * strike * discount
+        theta = np.where(is_call, decay - carry * ndtr(d2), decay + carry * ndtr(-d2))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            gamma = pdf / (spot * vol * sqrt_t)
+        return {
+            'iv': vol * 100,
+            'delta': np.where(is_call, ndtr(d1), ndtr(d1) - 1),
+            'gamma': gamma,
+            'theta': theta / 365,
+            'vega': spot * pdf * sqrt_t / 100
+        }
+    
+    @classmethod
+    def implied_vol(cls, premium, spot, strike, t, is_call, rate: float = ProductionConfig.RISK_FREE_RATE) -> np.ndarray:
+        """Decimal vols solved by safeguarded Newton (bisection whenever a step leaves the bracket); NaN if no arbitrage-free vol exists"""
+        spot, strike, t, premium, is_call = cls._inputs(spot, strike, t, is_call, premium)
+        shape = spot.shape
+        spot, strike, t, premium, is_call = (x.ravel() for x in (spot, strike, t, premium, is_call))
+        discount = np.exp(-rate * t)
+        forward = spot / discount
+        intrinsic = discount * np.where(is_call, np.maximum(forward - strike, 0), np.maximum(strike - forward, 0))
+        ceiling = np.where(is_call, spot, strike * discount)
+        
+        with np.errstate(invalid='ignore'):
+            solvable = (spot > 0) & (strike > 0) & (t > 0) & (premium > intrinsic) & (premium < ceiling)
+        rows = np.flatnonzero(solvable)
+        out = np.full(len(spot), np.nan)
+        if not len(rows):
+            return out.reshape(shape)
+        
+        s, k, tt, target, call = spot[rows], strike[rows], t[rows], premium[rows], is_call[rows]
+        lo, hi = np.full(len(rows), cls.MIN_VOL), np.full(len(rows), cls.MAX_VOL)
+        # Manaster-Koehler start (Brenner-Subrahmanyam near the money) keeps Newton monotone from the first step
+        vol = np.maximum(np.sqrt(2 * np.abs(np.log(forward[rows] / k)) / tt), np.sqrt(2 * np.pi / tt) * target / s)
+        vol = np.clip(vol, cls.MIN_VOL, cls.MAX_VOL)
+        converged = np.zeros(len(rows), dtype=bool)
+        
+        for _ in range(cls.IV_MAX_ITER):
+            live = np.flatnonzero(~converged)
+            if not len(live):
+                break
+            diff = cls.price(s[live], k[live], tt[live], vol[live], call[live], rate) - target[live]
+            d1, _ = cls._d1_d2(s[live] / np.exp(-rate * tt[live]), k[live], tt[live], vol[live])
+            vega = s[live] * np.exp(-0.5 * d1 * d1) / np.sqrt(2 * np.pi) * np.sqrt(tt[live])
+            converged[live] = np.abs(diff) < cls.IV_TOLERANCE
+            
+            hi[live] = np.where(diff > 0, vol[live], hi[live])
+            lo[live] = np.where(diff < 0, vol[live], lo[live])
+            with np.errstate(divide='ignore', invalid='ignore'):
+                step = vol[live] - diff / vega
+            outside = ~np.isfinite(step) | (step <= lo[live]) | (step >= hi[live])
+            vol[live] = np.where(converged[live], vol[live], np.where(outside, 0.5 * (lo[live] + hi[live]), step))
+        
+        out[rows] = np.where(converged, vol, np.nan)
+        return out.reshape(shape)
+    
+    @classmethod
+    def chain_greeks(cls, chain: OptionChain, spot: float, t: float, rate: float = ProductionConfig.RISK_FREE_RATE) -> Dict[str, np.ndarray]:
+        """Greeks for both sides of a chain, solved from the mid (LTP when the book is one-sided), keyed like the chain columns"""
+        out = {}
+        for prefix, is_call in (('ce', True), ('pe', False)):
+            bid, ask, ltp = chain[f'{prefix}_bid'], chain[f'{prefix}_ask'], chain[f'{prefix}_ltp']
+            premium = np.where((bid > 0) & (ask > 0), 0.5 * (bid + ask), ltp)
+            vol = cls.implied_vol(premium, spot, chain['strike'], t, is_call, rate)
+            out.update({f'{prefix}_{name}': values for name, values in cls.greeks(spot, chain['strike'], t, vol, is_call, rate).items()})
+        return out
+    
+    @classmethod
+    def fill_missing_greeks(cls, chain, spot: float, expiry: date, now: Optional[datetime] = None) -> OptionChain:
+        """Chain with NaN vendor iv/delta/gamma replaced by local values; the input chain is not modified"""
+        if not isinstance(chain, OptionChain):
+            chain = OptionChain.from_frame(chain)
+        names = ('ce_iv', 'pe_iv', 'ce_delta', 'pe_delta', 'ce_gamma', 'pe_gamma')
+        if chain.empty or not any(np.isnan(chain[name]).any() for name in names):
+            return chain
+        
+        local = cls.chain_greeks(chain, spot, cls.time_to_expiry(expiry, now))
+        columns = dict(chain.columns)
+        for name in names:
+            columns[name] = np.where(np.isnan(chain[name]), local[name], chain[name])
+        return OptionChain(columns)
+
+# ==========================================
+# VOLATILITY SURFACE (SVI)
+# ==========================================
+@dataclass
+class SmileFit:
+    """Raw SVI smile for one expiry: total variance w(k) = a + b(rho(k - m) + sqrt((k - m)^2 + sigma^2)) with k = ln(K/F)"""
+    expiry: date
+    t: float
+    forward: float
+    params: Tuple[float, float, float, float, float]
+    rms: float  # Fit error at the last refit, in vol points
+    
+    @staticmethod
+    def total_variance(params, k) -> np.ndarray:
+        a, b, rho, m, sigma = params
+        x = np.asarray(k, dtype=np.float64) - m
+        return a + b * (rho * x + np.sqrt(x * x + sigma * sigma))
+    
+    def rescaled(self, t: float, forward: float) -> 'SmileFit':
+        """Same smile in vol terms at a new time and forward (a and b scale with total variance)"""
+        a, b, rho, m, sigma = self.params
+        ratio = t / self.t
+        return replace(self, t=t, forward=forward, params=(a * ratio, b * ratio, rho, m, sigma))
+    
+    def iv_at_moneyness(self, k) -> np.ndarray:
+        return np.sqrt(np.maximum(self.total_variance(self.params, k), 0.0) / self.t) * 100
+    
+    def iv(self, strike) -> np.ndarray:
+        """Smile IV (%) at strike(s)"""
+        return self.iv_at_moneyness(np.log(np.asarray(strike, dtype=np.float64) / self.forward))
+    
+    @property
+    def atm_iv(self) -> float:
+        return float(self.iv_at_moneyness(0.0))
+    
+    def strike_at_delta(self, delta: float) -> float:
+        """Strike whose smile-implied delta is `delta` (calls positive, puts negative), clamped to the fitted range"""
+        k = np.linspace(-ProductionConfig.SURFACE_MAX_MONEYNESS, ProductionConfig.SURFACE_MAX_MONEYNESS, 801)
+        sd = np.maximum(self.iv_at_moneyness(k) / 100, OptionPricer.MIN_VOL) * np.sqrt(self.t)
+        curve = ndtr((-k + 0.5 * sd * sd) / sd)
+        if delta < 0:
+            curve = curve - 1
+        # Call and put deltas both fall as the strike rises
+        return float(self.forward * np.exp(np.interp(delta, curve[::-1], k[::-1])))
+    
+    def iv_at_delta(self, delta: float) -> float:
+        return float(self.iv(self.strike_at_delta(delta)))
+    
+    @property
+    def skew_25d(self) -> float:
+        return self.iv_at_delta(-0.25) - self.iv_at_delta(0.25)
+
+class VolSurface:
+    """SVI smile per expiry, cached and refit (warm-started) only when live quotes drift beyond SURFACE_REFIT_TOLERANCE"""
+    LOWER = (0.0, 0.0, -0.999, -0.5, 1e-4)
+    UPPER = (np.inf, 2.0, 0.999, 0.5, 1.0)
+    
+    def __init__(self):
+        self.smiles: Dict[date, SmileFit] = {}
+        self.refits = 0
+    
+    @staticmethod
+    def _forward(chain: OptionChain, spot: float, t: float) -> float:
+        """Put-call parity forward from the three strikes nearest spot; spot carried at the risk-free rate if none are two-sided"""
+        growth = np.exp(ProductionConfig.RISK_FREE_RATE * t)
+        strike, ce, pe = chain['strike'], chain['ce_ltp'], chain['pe_ltp']
+        rows = np.flatnonzero((ce > 0) & (pe > 0))
+        if not len(rows):
+            return spot * growth
+        nearest = rows[np.argsort(np.abs(strike[rows] - spot), kind='stable')[:3]]
+        return float(np.median(strike[nearest] + growth * (ce[nearest] - pe[nearest])))
+    
+    @staticmethod
+    def _quotes(chain: OptionChain, forward: float) -> Tuple[np.ndarray, np.ndarray]:
+        """Log-moneyness and IV (%) of the out-of-the-money side at each strike"""
+        strike = chain['strike']
+        with np.errstate(divide='ignore', invalid='ignore'):
+            k = np.log(strike / forward)
+        otm_call = k >= 0
+        iv = np.where(otm_call, chain['ce_iv'], chain['pe_iv'])
+        ltp = np.where(otm_call, chain['ce_ltp'], chain['pe_ltp'])
+        keep = np.isfinite(k) & (np.abs(k) <= ProductionConfig.SURFACE_MAX_MONEYNESS) & np.isfinite(iv) & (iv > 0) & (ltp > 0)
+        return k[keep], iv[keep]
+    
+    def _fit(self, k: np.ndarray, iv: np.ndarray, t: float, start: Optional[Tuple]) -> Optional[Tuple[Tuple, float]]:
+        """Best of the warm start and a cold guess; None if neither fits within SURFACE_MAX_FIT_ERROR"""
+        w = (iv / 100) ** 2 * t
+        b0 = max((w.max() - w.min()) / max(np.abs(k).max(), 1e-3), 1e-5)
+        cold = (0.5 * w.min(), b0, -0.3, float(k[np.argmin(w)]), 0.05)
+        
+        def residuals(x):
+            return np.sqrt(np.maximum(SmileFit.total_variance(x, k), 0.0) / t) * 100 - iv
+        
+        def jacobian(x):
+            a, b, rho, m, sigma = x
+            root = np.sqrt((k - m) ** 2 + sigma ** 2)
+            dw = np.column_stack([np.ones_like(k), rho * (k - m) + root, b * (k - m), -b * (rho + (k - m) / root), b * sigma / root])
+            w_fit = SmileFit.total_variance(x, k)
+            with np.errstate(divide='ignore'):
+                scale = np.where(w_fit > 0, 50.0 / np.sqrt(np.maximum(w_fit, 0.0) * t), 0.0)
+            return dw * scale[:, None]
+        
+        best = None
+        for x0 in ([start] if start is not None else []) + [cold]:
+            x0 = np.clip(x0, self.LOWER, [w.max() * 4 if np.isinf(u) else u for u in self.UPPER])
+            try:
+                fit = least_squares(residuals, x0, jac=jacobian, bounds=(self.LOWER, self.UPPER), method='trf')
+            except ValueError:
+                continue
+            rms = float(np.sqrt(np.mean(fit.fun ** 2)))
+            if best is None or rms < best[1]:
+                best = (tuple(float(x) for x in fit.x), rms)
+            if rms <= ProductionConfig.SURFACE_REFIT_TOLERANCE:
+                break
+        
+        if best is None or best[1] > ProductionConfig.SURFACE_MAX_FIT_ERROR:
+            return None
+        return best
+    
+    def update(self, expiry: Optional[date], chain, spot: float, now: Optional[datetime] = None) -> Optional[SmileFit]:
+        """Smile for `expiry` from a fresh chain: the cached fit if it still prices the quotes, otherwise a refit"""
+        today = now.date() if now else date.today()
+        self.smiles = {e: smile for e, smile in self.smiles.items() if e >= today}
+        if expiry is None or spot <= 0 or chain is None or len(chain) == 0:
+            self.smiles.pop(expiry, None)
+            return None
+        
+        chain = OptionPricer.fill_missing_greeks(chain, spot, expiry, now)
+        t = OptionPricer.time_to_expiry(expiry, now)
+        forward = self._forward(chain, spot, t)
+        k, iv = self._quotes(chain, forward)
+        if len(k) < ProductionConfig.SURFACE_MIN_QUOTES:
+            logger.warning(f"Vol surface: {len(k)} usable quotes for {expiry} - smile skipped")
+            self.smiles.pop(expiry, None)
+            return None
+        
+        cached = self.smiles.get(expiry)
+        if cached is not None:
+            cached = cached.rescaled(t, forward)
+            drift = float(np.sqrt(np.mean((cached.iv_at_moneyness(k) - iv) ** 2)))
+            if drift <= ProductionConfig.SURFACE_REFIT_TOLERANCE:
+                self.smiles[expiry] = cached
+                return cached
+        
+        fit = self._fit(k, iv, t, cached.params if cached is not None else None)
+        if fit is None:
+            logger.warning(f"Vol surface: SVI fit rejected for {expiry}")
+            self.smiles.pop(expiry, None)
+            return None
+        
+        self.refits += 1
+        params, rms = fit
+        smile = SmileFit(expiry, t, forward, params, rms)
+        self.smiles[expiry] = smile
+        logger.debug(f"Vol surface refit {expiry}: ATM={smile.atm_iv:.2f}% RMS={rms:.3f} from {len(k)} quotes")
+        return smile
+    
+    def constant_maturity_iv(self, days: float, k: float = 0.0) -> float:
+        """IV (%) at log-moneyness k for a fixed horizon; total variance is linear in time between expiries, flat vol outside"""
+        smiles = sorted(self.smiles.values(), key=lambda smile: smile.t)
+        if not smiles:
+            return 0.0
+        
+        target = days / 365.0
+        if target <= smiles[0].t:
+            return float(smiles[0].iv_at_moneyness(k))
+        if target >= smiles[-1].t:
+            return float(smiles[-1].iv_at_moneyness(k))
+        
+        w = np.interp(target, [smile.t for smile in smiles], [float(smile.total_variance(smile.params, k)) for smile in smiles])
+        return float(np.sqrt(max(w, 0.0) / target) * 100)
+
+# ==========================================
+# ANALYTICS ENGINE (UNCHANGED - BRAIN PART)
+# ==========================================
+class AnalyticsEngine:
+    def __init__(self, result_queue: Optional[Queue] = None):
+        self.result_queue = result_queue
+        self.api_client = None
+        self.candle_store = None
+        self.participant_cache = None
+        self.snapshot_store = None
+        self.garch = GarchForecaster()
+        self.vol_surface = VolSurface()
+        self.rolling_vol = RollingVolEngine()
+        self.fetch_pool = None
+        # Own recorder: this engine runs in the worker process and ships its samples back with each result
+        self.latency = LatencyRecorder()
+    
+    def _get_api_client(self, access_token: str) -> upstox_client.ApiClient:
+        """Reuse one ApiClient (and its connection pool) across analysis runs"""
+        if self.api_client is None:
+            self.api_client = upstox_client.ApiClient()
+        self.api_client.configuration.access_token = access_token
+        return self.api_client
+    
+    def run(self, config: Dict):
+        self.result_queue.put(self.execute(config))
+    
+    def execute(self, config: Dict) -> Tuple[str, Any]:
+        try:
+            api_client = self._get_api_client(config['access_token'])
+            
+            history_api = HistoryV3Api(api_client)
+            options_api = OptionsApi(api_client)
+            market_api = upstox_client.MarketQuoteV3Api(api_client)
+            
+            # Independent sources go out together; only the chains wait for the expiry lookup
+            pool = self._get_fetch_pool()
+            self._get_candle_store()
+            oi_today, oi_yest = self._participant_dates()
+            started = time.monotonic()
+            
+            timed = self.latency.timed
+            nifty_future = pool.submit(timed, "fetch.nifty_history", self._get_history, history_api, ProductionConfig.NIFTY_KEY)
+            vix_future = pool.submit(timed, "fetch.vix_history", self._get_history, history_api, ProductionConfig.VIX_KEY)
+            ltp_future = pool.submit(
+                timed, "fetch.ltp", market_api.get_ltp,
+                instrument_key=f"{ProductionConfig.NIFTY_KEY},{ProductionConfig.VIX_KEY}",
+                _request_timeout=ProductionConfig.LTP_FETCH_TIMEOUT
+            )
+            expiries_future = pool.submit(timed, "fetch.expiries", self._get_expiries, options_api)
+            oi_today_future = pool.submit(timed, "fetch.participant_oi", self._get_participant_day, oi_today)
+            oi_yest_future = pool.submit(timed, "fetch.participant_oi", self._get_participant_day, oi_yest)
+            
+            weekly, monthly, next_weekly, lot_size = self._await_fetch(
+                expiries_future, started + ProductionConfig.EXPIRY_FETCH_TIMEOUT, "Expiries",
+                default=(None, None, None, 0)
+            )
+            
+            chains_started = time.monotonic()
+            weekly_future = pool.submit(timed, "fetch.chain", self._get_option_chain, options_api, weekly) if weekly else None
+            monthly_future = pool.submit(timed, "fetch.chain", self._get_option_chain, options_api, monthly) if monthly else None
+            # Next weekly only feeds the vol surface term structure
+            has_next_weekly = next_weekly is not None and next_weekly not in (weekly, monthly)
+            next_weekly_future = pool.submit(timed, "fetch.chain", self._get_option_chain, options_api, next_weekly) if has_next_weekly else None
+            
+            nifty_hist = self._await_fetch(nifty_future, started + ProductionConfig.HISTORY_FETCH_TIMEOUT, "Nifty history", required=True)
+            vix_hist = self._await_fetch(vix_future, started + ProductionConfig.HISTORY_FETCH_TIMEOUT, "VIX history", required=True)
+            live_prices = self._await_fetch(ltp_future, started + ProductionConfig.LTP_FETCH_TIMEOUT, "LTP", required=True)
+            
+            chain_deadline = chains_started + ProductionConfig.CHAIN_FETCH_TIMEOUT
+            weekly_chain = self._await_fetch(weekly_future, chain_deadline, "Weekly chain", default=pd.DataFrame()) if weekly_future else pd.DataFrame()
+            monthly_chain = self._await_fetch(monthly_future, chain_deadline, "Monthly chain", default=pd.DataFrame()) if monthly_future else pd.DataFrame()
+            next_weekly_chain = self._await_fetch(next_weekly_future, chain_deadline, "Next weekly chain", default=pd.DataFrame()) if next_weekly_future else pd.DataFrame()
+            
+            oi_deadline = started + ProductionConfig.PARTICIPANT_FETCH_TIMEOUT
+            today_data = self._await_fetch(oi_today_future, oi_deadline, "Participant OI (today)")
+            yest_data = self._await_fetch(oi_yest_future, oi_deadline, "Participant OI (prev)")
+            participant_data, participant_yest, fii_net_change, data_date = self._build_participant_data(oi_today, today_data, yest_data)
+            
+            self.latency.record("fetch.total", (time.monotonic() - started) * 1000)
+            
+            stage = self.latency.stage
+            time_metrics = self.get_time_metrics(weekly, monthly, next_weekly)
+            with stage("metrics.vol"):
+                vol_metrics = self.get_vol_metrics(nifty_hist, vix_hist, live_prices)
+            with stage("metrics.surface"):
+                weekly_smile = self.vol_surface.update(weekly, weekly_chain, vol_metrics.spot)
+                monthly_smile = self.vol_surface.update(monthly, monthly_chain, vol_metrics.spot)
+                if has_next_weekly:
+                    self.vol_surface.update(next_weekly, next_weekly_chain, vol_metrics.spot)
+            with stage("metrics.struct"):
+                struct_metrics_weekly = self.get_struct_metrics(weekly_chain, vol_metrics.spot, lot_size, weekly_smile)
+                struct_metrics_monthly = self.get_struct_metrics(monthly_chain, vol_metrics.spot, lot_size, monthly_smile)
+            with stage("metrics.edge"):
+                edge_metrics = self.get_edge_metrics(weekly_chain, monthly_chain, vol_metrics.spot, vol_metrics, weekly_smile, monthly_smile)
+            with stage("metrics.external"):
+                external_metrics = self.get_external_metrics(nifty_hist, participant_data, participant_yest, fii_net_change, data_date)
+            with stage("snapshot.chains"):
+                self._record_chain_snapshot(
+                    vol_metrics.spot, vol_metrics.vix, lot_size,
+                    {'weekly': weekly, 'monthly': monthly, 'next_weekly': next_weekly},
+                    {weekly: weekly_chain, monthly: monthly_chain, next_weekly: next_weekly_chain}
+                )
+            
+            result = {
+                'timestamp': datetime.now(),
+                'time_metrics': time_metrics,
+                'vol_metrics': vol_metrics,
+                'weekly_chain': weekly_chain,
+                'monthly_chain': monthly_chain,
+                'lot_size': lot_size,
+                'participant_data': participant_data,
+                'participant_yest': participant_yest,
+                'fii_net_change': fii_net_change,
+                'data_date': data_date,
+                'external_metrics': external_metrics,
+                'edge_metrics': edge_metrics,
+                'struct_metrics_weekly': struct_metrics_weekly,
+                'struct_metrics_monthly': struct_metrics_monthly,
+                'stage_latency': self.latency.drain()
+            }
+            
+            return 'success', result
+        
+        except Exception as e:
+            logger.error(f"Analytics process error: {e}")
+            traceback.print_exc()
+            return 'error', str(e)
+    
+    def _get_fetch_pool(self) -> concurrent.futures.ThreadPoolExecutor:
+        """Created on first use so the threads live in the process that runs the analysis"""
+        if self.fetch_pool is None:
+            self.fetch_pool = concurrent.futures.ThreadPoolExecutor(
+                max_workers=ProductionConfig.FETCH_WORKERS, thread_name_prefix="Analytics-Fetch"
+            )
+        return self.fetch_pool
+    
+    def _retire_fetch_pool(self):
+        pool, self.fetch_pool = self.fetch_pool, None
+        if pool is not None:
+            pool.shutdown(wait=False)
+    
+    def _await_fetch(self, future: concurrent.futures.Future, deadline: float, source: str,
+                     default: Any = None, required: bool = False) -> Any:
+        """Result of a fetch by its deadline; optional sources fall back to default, required ones raise"""
+        try:
+            return future.result(timeout=max(0.0, deadline - time.monotonic()))
+        except concurrent.futures.TimeoutError:
+            if not future.cancel():
+                # Already running and cannot be stopped: leave its thread behind and give later cycles a full pool
+                self._retire_fetch_pool()
+            if required:
+                raise TimeoutError(f"{source} fetch timed out")
+            logger.warning(f"{source} fetch timed out - continuing without it")
+        except Exception as e:
+            if required:
+                raise
+            logger.error(f"{source} fetch error: {e}")
+        return default
+    
+    def _get_snapshot_store(self) -> Optional[ChainSnapshotStore]:
+        if self.snapshot_store is None:
+            try:
+                self.snapshot_store = ChainSnapshotStore()
+            except OSError as e:
+                logger.error(f"Chain snapshot store unavailable: {e}")
+        return self.snapshot_store
+    
+    def _record_chain_snapshot(self, spot: float, vix: float, lot_size: int,
+                               expiries: Dict[str, Optional[date]], chains: Dict[Optional[date], pd.DataFrame]):
+        """Keep this cycle's chains for backtests; market hours only, so evening and weekend runs don't pose as sessions"""
+        if not ProductionConfig.CHAIN_SNAPSHOTS_ENABLED:
+            return
+        now = datetime.now(pytz.timezone('Asia/Kolkata'))
+        if now.weekday() >= 5 or not (ProductionConfig.MARKET_OPEN <= (now.hour, now.minute) <= ProductionConfig.MARKET_CLOSE):
+            return
+        store = self._get_snapshot_store()
+        if store is None:
+            return
+        try:
+            store.put(now, spot, vix, lot_size, expiries, {
+                expiry: OptionChain.from_frame(chain) for expiry, chain in chains.items() if expiry and not chain.empty
+            })
+        except OSError as e:
+            logger.warning(f"Chain snapshot not saved: {e}")
+    
+    def _get_candle_store(self) -> Optional[CandleStore]:
+        if self.candle_store is None:
+            try:
+                self.candle_store = CandleStore()
+            except OSError as e:
+                logger.error(f"Candle store unavailable: {e}")
+        return self.candle_store
+    
+    def _get_history(self, history_api: HistoryV3Api, key: str) -> pd.DataFrame:
+        """Daily candles from the local store, fetching only bars newer than the last stored one"""
+        today = date.today()
+        lookback_start = today - timedelta(days=ProductionConfig.ANALYTICS_LOOKBACK_DAYS)
+        store = self._get_candle_store()
+        
+        if store is not None:
+            try:
+                # Re-fetch the last stored day as well; it may have been captured intraday
+                last = store.last_date(key)
+                from_day = last if last else today - timedelta(days=ProductionConfig.CANDLE_BACKFILL_DAYS)
+                response = history_api.get_historical_candle_data(
+                    instrument_key=key, unit="days", interval=1,
+                    to_date=today.strftime("%Y-%m-%d"), from_date=from_day.strftime("%Y-%m-%d"),
+                    _request_timeout=ProductionConfig.HISTORY_FETCH_TIMEOUT
+                )
+                if response.status == 'success':
+                    candles = response.data.candles if hasattr(response.data, 'candles') else []
+                    added = store.append(key, candles or [])
+                    logger.debug(f"Candle store {key}: +{added} bars since {from_day}")
+                else:
+                    logger.warning(f"History refresh failed for {key} - using stored candles")
+                return store.frame(key, start=lookback_start)
+            except OSError as e:
+                logger.error(f"Candle store error for {key}: {e} - falling back to full download")
+        
+        response = history_api.get_historical_candle_data(
+            instrument_key=key, unit="days", interval=1,
+            to_date=today.strftime("%Y-%m-%d"), from_date=lookback_start.strftime("%Y-%m-%d"),
+            _request_timeout=ProductionConfig.HISTORY_FETCH_TIMEOUT
+        )
+        return self._parse_candle_response(response)
+    
+    def _parse_candle_response(self, response):
+        if response.status != 'success':
+            return pd.DataFrame()
+        
+        candles = response.data.candles if hasattr(response.data, 'candles') else []
+        if not candles:
+            return pd.DataFrame()
+        
+        df = pd.DataFrame(candles, columns=["timestamp", "open", "high", "low", "close", "volume", "oi"])
+        df['timestamp'] = pd.to_datetime(df['timestamp'])
+        df.set_index('timestamp', inplace=True)
+        return df.astype(float).sort_index()
+    
+    def _get_expiries(self, options_api: OptionsApi) -> Tuple[Optional[date], Optional[date], Optional[date], int]:
+        try:
+            response = options_api.get_option_contracts(
+                instrument_key=ProductionConfig.NIFTY_KEY, _request_timeout=ProductionConfig.EXPIRY_FETCH_TIMEOUT
+            )
+            if response.status != 'success':
+                return None, None, None, 0
+            
+            data = response.data
+            if not data:
+                return None, None, None, 0
+            
+            lot_size = next((int(c.lot_size) for c in data if hasattr(c, 'lot_size')), 0)
+            expiry_dates = sorted(list(set([
+                datetime.strptime(c.expiry.split('T')[0], "%Y-%m-%d").date()
+                for c in data if hasattr(c, 'expiry') and c.expiry
+            ])))
+            
+            valid_dates = [d for d in expiry_dates if d >= date.today()]
+            if not valid_dates:
+                return None, None, None, lot_size
+            
+            weekly = valid_dates[0]
+            next_weekly = valid_dates[1] if len(valid_dates) > 1 else valid_dates[0]
+            
+            current_month = date.today().month
+            monthly_candidates = [d for d in valid_dates if d.month == (current_month + 1 if current_month < 12 else 1)]
+            if not monthly_candidates:
+                monthly_candidates = [d for d in valid_dates if d.month == current_month]
+            monthly = monthly_candidates[-1] if monthly_candidates else valid_dates[-1]
+            
+            return weekly, monthly, next_weekly, lot_size
+        except Exception as e:
+            logger.error(f"Expiries fetch error: {e}")
+            return None, None, None, 0
+    
+    def _get_option_chain(self, options_api: OptionsApi, expiry_date: date) -> pd.DataFrame:
+        try:
+            response = options_api.get_put_call_option_chain(
+                instrument_key=ProductionConfig.NIFTY_KEY,
+                expiry_date=expiry_date.strftime("%Y-%m-%d"),
+                _request_timeout=ProductionConfig.CHAIN_FETCH_TIMEOUT
+            )
+            if response.status != 'success':
+                return pd.DataFrame()
+            
+            return OptionChain.from_sdk(response.data).to_frame()
+        except Exception as e:
+            logger.error(f"Option chain fetch error: {e}")
+            return pd.DataFrame()
+    
+    def _participant_dates(self) -> Tuple[datetime, datetime]:
+        """Latest two weekdays with a published NSE participant OI file (files land after 18:00 IST)"""
+        tz = pytz.timezone('Asia/Kolkata')
+        now = datetime.now(tz)
+        dates = []
+        candidate = now
+        if candidate.hour < 18:
+            candidate -= timedelta(days=1)
+        while len(dates) < 2:
+            if candidate.weekday() < 5:
+                dates.append(candidate)
+            candidate -= timedelta(days=1)
+        
+        return dates[0], dates[1]
+    
+    def _fetch_oi_csv(self, date_obj) -> Optional[pd.DataFrame]:
+        date_str = date_obj.strftime('%d%m%Y')
+        url = f"https://archives.nseindia.com/content/nsccl/fao_participant_oi_{date_str}.csv"
+        try:
+            headers = {"User-Agent": "Mozilla/5.0"}
+            r = requests.get(url, headers=headers, timeout=10)
+            if r.status_code == 200:
+                content = r.content.decode('utf-8')
+                lines = content.splitlines()
+                for idx, line in enumerate(lines[:20]):
+                    if "Future Index Long" in line:
+                        df = pd.read_csv(io.StringIO(content), skiprows=idx)
+                        df.columns = df.columns.str.strip()
+                        return df
+        except:
+            pass
+        return None
+    
+    def _get_participant_cache(self) -> Optional[ParticipantDataCache]:
+        if self.participant_cache is None:
+            try:
+                self.participant_cache = ParticipantDataCache()
+            except OSError as e:
+                logger.error(f"Participant cache unavailable: {e}")
+        return self.participant_cache
+    
+    def _get_participant_day(self, day) -> Optional[Dict[str, ParticipantData]]:
+        """Parsed participant OI for one trading date, from disk when seen before; None if NSE has no file"""
+        cache = self._get_participant_cache()
+        if cache is not None:
+            cached = cache.get(day)
+            if cached is not None:
+                return cached
+        
+        df = self._fetch_oi_csv(day)
+        if df is None:
+            return None
+        
+        data = self._process_participant_data(df)
+        # A truncated or malformed file stays uncached so a later cycle or backfill fetches the day again
+        if not all(data.values()):
+            logger.warning(f"Participant OI for {day:%d-%b-%Y} incomplete ({', '.join(p for p, v in data.items() if v is None)}) - not cached")
+        elif cache is not None:
+            try:
+                cache.put(day, data)
+            except (OSError, TypeError, ValueError) as e:
+                logger.warning(f"Participant cache write failed for {day:%d-%b-%Y}: {e}")
+        return data
+    
+    def backfill_participant_data(self, days: int) -> int:
+        """Fill the participant cache for the last `days` calendar days; returns dates newly stored"""
+        cache = self._get_participant_cache()
+        if cache is None:
+            return 0
+        
+        latest, _ = self._participant_dates()
+        have = set(cache.dates())
+        stored = 0
+        for offset in range(days):
+            day = (latest - timedelta(days=offset)).date()
+            if day.weekday() >= 5 or (day in have and cache.get(day) is not None):
+                continue
+            self._get_participant_day(day)
+            if cache.get(day) is not None:
+                stored += 1
+            time.sleep(0.5)  # Stay polite to archives.nseindia.com
+        return stored
+    
+    def _build_participant_data(self, today, today_data, yest_data):
+        if today_data is None:
+            return None, None, 0.0, today.strftime('%d-%b-%Y')
+        
+        yest_data = yest_data if yest_data is not None else {}
+        
+        fii_net_change = 0.0
+        if today_data.get('FII') and yest_data.get('FII'):
+            fii_net_change = today_data['FII'].fut_net - yest_data['FII'].fut_net
+        
+        return today_data, yest_data, fii_net_change, today.strftime('%d-%b-%Y')
+    
+    def _process_participant_data(self, df) -> Dict[str, ParticipantData]:
         data = {}
         for p in ["FII", "DII", "Client", "Pro"]:
             try:
@@ -1161,8 +2658,8 @@ class AnalyticsEngine:
                 data[p] = None
         return data
     
-    def get_time_metrics(self, weekly, monthly, next_weekly) -> TimeMetrics:
-        today = date.today()
+    def get_time_metrics(self, weekly, monthly, next_weekly, today: Optional[date] = None) -> TimeMetrics:
+        today = today or date.today()
         dte_w = (weekly - today).days if weekly else 0
         dte_m = (monthly - today).days if monthly else 0
         dte_nw = (next_weekly - today).days if next_weekly else 0
@@ -1174,9 +2671,13 @@ class AnalyticsEngine:
             dte_nw
         )
     
+    @staticmethod
+    def classify_vol_regime(vov_zscore: float, ivp_1yr: float) -> str:
+        return "EXPLODING" if vov_zscore > ProductionConfig.VOV_CRASH_ZSCORE else \
+               "RICH" if ivp_1yr > ProductionConfig.HIGH_VOL_IVP else \
+               "CHEAP" if ivp_1yr < ProductionConfig.LOW_VOL_IVP else "FAIR"
+    
     def get_vol_metrics(self, nifty_hist, vix_hist, live_prices) -> VolMetrics:
-        is_fallback = False
-        
         nifty_live = vix_live = 0
         if hasattr(live_prices, 'data'):
             data = live_prices.data
@@ -1184,66 +2685,39 @@ class AnalyticsEngine:
                 nifty_live = data[ProductionConfig.NIFTY_KEY].last_price
             if ProductionConfig.VIX_KEY in data:
                 vix_live = data[ProductionConfig.VIX_KEY].last_price
+        return self.vol_metrics_from(nifty_hist, vix_hist, nifty_live, vix_live)
+    
+    def vol_metrics_from(self, nifty_hist, vix_hist, nifty_live: float, vix_live: float) -> VolMetrics:
+        """VolMetrics from daily history plus live spot/VIX (0 when unavailable: falls back to the last close)"""
+        is_fallback = False
         
-        spot = nifty_live if nifty_live > 0 else (nifty_hist.iloc[-1]['close'] if not nifty_hist.empty else 0)
-        vix = vix_live if vix_live > 0 else (vix_hist.iloc[-1]['close'] if not vix_hist.empty else 0)
-        
-        if nifty_live <= 0 or vix_live <= 0:
-            is_fallback = True
-        
-        returns = np.log(nifty_hist['close'] / nifty_hist['close'].shift(1)).dropna()
-        rv7 = returns.rolling(7).std().iloc[-1] * np.sqrt(252) * 100 if len(returns) >= 7 else 0
-        rv28 = returns.rolling(28).std().iloc[-1] * np.sqrt(252) * 100 if len(returns) >= 28 else 0
-        rv90 = returns.rolling(90).std().iloc[-1] * np.sqrt(252) * 100 if len(returns) >= 90 else 0
-        
-        def fit_garch(horizon):
-            try:
-                if len(returns) < 100:
-                    return 0
-                model = arch_model(returns * 100, vol='Garch', p=1, q=1, dist='normal')
-                result = model.fit(disp='off', show_warning=False)
-                forecast = result.forecast(horizon=horizon, reindex=False)
-                return np.sqrt(forecast.variance.values[-1, -1]) * np.sqrt(252)
-            except:
-                return 0
-        
-        garch7 = fit_garch(7) or rv7
-        garch28 = fit_garch(28) or rv28
-        
-        const = 1.0 / (4.0 * np.log(2.0))
-        park7 = np.sqrt((np.log(nifty_hist['high'] / nifty_hist['low']) ** 2).tail(7).mean() * const) * np.sqrt(252) * 100 if len(nifty_hist) >= 7 else 0
-        park28 = np.sqrt((np.log(nifty_hist['high'] / nifty_hist['low']) ** 2).tail(28).mean() * const) * np.sqrt(252) * 100 if len(nifty_hist) >= 28 else 0
+        spot = nifty_live if nifty_live > 0 else (nifty_hist.iloc[-1]['close'] if not nifty_hist.empty else 0)
+        vix = vix_live if vix_live > 0 else (vix_hist.iloc[-1]['close'] if not vix_hist.empty else 0)
         
-        vix_returns = np.log(vix_hist['close'] / vix_hist['close'].shift(1)).dropna()
-        vov = vix_returns.rolling(30).std().iloc[-1] * np.sqrt(252) * 100 if len(vix_returns) >= 30 else 0
+        if nifty_live <= 0 or vix_live <= 0:
+            is_fallback = True
         
-        vov_rolling = vix_returns.rolling(30).std() * np.sqrt(252) * 100 if len(vix_returns) >= 30 else pd.Series()
-        vov_mean = vov_rolling.rolling(60).mean().iloc[-1] if len(vov_rolling) >= 60 else 0
-        vov_std = vov_rolling.rolling(60).std().iloc[-1] if len(vov_rolling) >= 60 else 0
-        vov_zscore = (vov - vov_mean) / vov_std if vov_std > 0 else 0
+        returns = np.log(nifty_hist['close'] / nifty_hist['close'].shift(1)).dropna()
+        self.rolling_vol.sync(nifty_hist, vix_hist)
+        rolling = self.rolling_vol.metrics()
+        rv7, rv28, rv90 = rolling['rv7'], rolling['rv28'], rolling['rv90']
         
-        def calc_ivp(window):
-            if len(vix_hist) < window:
-                return 0.0
-            history = vix_hist['close'].tail(window)
-            return (history < vix).mean() * 100
+        with self.latency.stage("metrics.garch"):
+            garch = self.garch.forecast(returns, (7, 28))
+        garch7 = garch[7] or rv7
+        garch28 = garch[28] or rv28
         
-        ivp_30d, ivp_90d, ivp_1yr = calc_ivp(30), calc_ivp(90), calc_ivp(252)
+        park7, park28 = rolling['park7'], rolling['park28']
+        vov, vov_zscore = rolling['vov'], rolling['vov_zscore']
         
-        ma20 = nifty_hist['close'].rolling(20).mean().iloc[-1] if len(nifty_hist) >= 20 else 0
+        ivp = self.rolling_vol.ivp(vix)
+        ivp_30d, ivp_90d, ivp_1yr = ivp['ivp_30d'], ivp['ivp_90d'], ivp['ivp_1yr']
         
-        true_range = pd.concat([
-            nifty_hist['high'] - nifty_hist['low'],
-            (nifty_hist['high'] - nifty_hist['close'].shift(1)).abs(),
-            (nifty_hist['low'] - nifty_hist['close'].shift(1)).abs()
-        ], axis=1).max(axis=1)
-        atr14 = true_range.rolling(14).mean().iloc[-1] if len(true_range) >= 14 else 0
+        ma20, atr14 = rolling['ma20'], rolling['atr14']
         
         trend_strength = abs(spot - ma20) / atr14 if atr14 > 0 else 0
         
-        vol_regime = "EXPLODING" if vov_zscore > ProductionConfig.VOV_CRASH_ZSCORE else \
-                    "RICH" if ivp_1yr > ProductionConfig.HIGH_VOL_IVP else \
-                    "CHEAP" if ivp_1yr < ProductionConfig.LOW_VOL_IVP else "FAIR"
+        vol_regime = self.classify_vol_regime(vov_zscore, ivp_1yr)
         
         return VolMetrics(
             spot, vix, rv7, rv28, rv90, garch7, garch28,
@@ -1252,7 +2726,7 @@ class AnalyticsEngine:
             ma20, atr14, trend_strength, vol_regime, is_fallback
         )
     
-    def get_struct_metrics(self, chain, spot, lot_size) -> StructMetrics:
+    def get_struct_metrics(self, chain, spot, lot_size, smile: Optional[SmileFit] = None) -> StructMetrics:
         if chain.empty or spot == 0:
             return StructMetrics(0, 0, 0, "NEUTRAL", 0, 0, 0, "NEUTRAL", lot_size)
         
@@ -1267,18 +2741,16 @@ class AnalyticsEngine:
         
         pcr = chain['pe_oi'].sum() / chain['ce_oi'].sum() if chain['ce_oi'].sum() > 0 else 1.0
         
-        strikes = chain['strike'].values
-        losses = [
-            np.sum(np.maximum(0, s - strikes) * chain['ce_oi'].values) + \
-            np.sum(np.maximum(0, strikes - s) * chain['pe_oi'].values)
-            for s in strikes
-        ]
-        max_pain = strikes[np.argmin(losses)] if losses else 0
+        pain_curve = PainCurve.from_oi(chain['strike'].values, chain['ce_oi'].values, chain['pe_oi'].values)
+        max_pain = pain_curve.max_pain
         
         try:
-            ce_25d_idx = (chain['ce_delta'].abs() - 0.25).abs().argsort()[:1]
-            pe_25d_idx = (chain['pe_delta'].abs() - 0.25).abs().argsort()[:1]
-            skew_25d = chain.iloc[pe_25d_idx]['pe_iv'].values[0] - chain.iloc[ce_25d_idx]['ce_iv'].values[0]
+            if smile is not None:
+                skew_25d = smile.skew_25d
+            else:
+                ce_25d_idx = (chain['ce_delta'].abs() - 0.25).abs().argsort()[:1]
+                pe_25d_idx = (chain['pe_delta'].abs() - 0.25).abs().argsort()[:1]
+                skew_25d = chain.iloc[pe_25d_idx]['pe_iv'].values[0] - chain.iloc[ce_25d_idx]['ce_iv'].values[0]
         except:
             skew_25d = 0
         
@@ -1286,19 +2758,22 @@ class AnalyticsEngine:
         
         return StructMetrics(
             net_gex, gex_ratio, total_oi_value, gex_regime,
-            pcr, max_pain, skew_25d, oi_regime, lot_size
+            pcr, max_pain, skew_25d, oi_regime, lot_size, pain_curve
         )
     
-    def get_edge_metrics(self, weekly_chain, monthly_chain, spot, vol: VolMetrics) -> EdgeMetrics:
-        def get_atm_iv(chain):
+    def get_edge_metrics(self, weekly_chain, monthly_chain, spot, vol: VolMetrics,
+                         weekly_smile: Optional[SmileFit] = None, monthly_smile: Optional[SmileFit] = None) -> EdgeMetrics:
+        def get_atm_iv(chain, smile):
+            if smile is not None:
+                return smile.atm_iv
             if chain.empty or spot == 0:
                 return 0
             atm_idx = (chain['strike'] - spot).abs().argsort()[:1]
             row = chain.iloc[atm_idx].iloc[0]
             return (row['ce_iv'] + row['pe_iv']) / 2
         
-        iv_weekly = get_atm_iv(weekly_chain)
-        iv_monthly = get_atm_iv(monthly_chain)
+        iv_weekly = get_atm_iv(weekly_chain, weekly_smile)
+        iv_monthly = get_atm_iv(monthly_chain, monthly_smile)
         
         vrp_rv_weekly = iv_weekly - vol.rv7
         vrp_garch_weekly = iv_weekly - vol.garch7
@@ -1320,7 +2795,8 @@ class AnalyticsEngine:
         return EdgeMetrics(
             iv_weekly, vrp_rv_weekly, vrp_garch_weekly, vrp_park_weekly,
             iv_monthly, vrp_rv_monthly, vrp_garch_monthly, vrp_park_monthly,
-            term_spread, term_regime, primary_edge
+            term_spread, term_regime, primary_edge,
+            self.vol_surface.constant_maturity_iv(30)
         )
     
     def get_external_metrics(self, nifty_hist, participant_data, participant_yest, fii_net_change, data_date) -> ExternalMetrics:
@@ -1513,6 +2989,363 @@ class RegimeEngine:
             expiry_type, expiry_date, dte, regime_name, strategy,
             allocation, max_lots, risk_per_lot, score, rationale, warnings, suggested
         )
+    
+    @staticmethod
+    def observation(vol: VolMetrics, struct: StructMetrics, edge: EdgeMetrics, external: ExternalMetrics, time: TimeMetrics, expiry_type: str, dte: int = 0) -> Dict[str, Any]:
+        """One row of the columnar input taken by the batch scorers"""
+        weekly = expiry_type == "WEEKLY"
+        return {
+            'expiry_type': expiry_type,
+            'dte': dte,
+            'vrp_garch': edge.vrp_garch_weekly if weekly else edge.vrp_garch_monthly,
+            'vrp_park': edge.vrp_park_weekly if weekly else edge.vrp_park_monthly,
+            'vrp_rv': edge.vrp_rv_weekly if weekly else edge.vrp_rv_monthly,
+            'term_regime': edge.term_regime,
+            'term_spread': edge.term_spread,
+            'vov_zscore': vol.vov_zscore,
+            'ivp_1yr': vol.ivp_1yr,
+            'gex_regime': struct.gex_regime,
+            'pcr': struct.pcr,
+            'skew_25d': struct.skew_25d,
+            'fast_vol': external.fast_vol,
+            'flow_regime': external.flow_regime,
+            'has_fii': bool(external.fii),
+            'dte_weekly': time.dte_weekly,
+            'is_gamma_week': time.is_gamma_week,
+            'is_gamma_month': time.is_gamma_month
+        }
+    
+    def calculate_scores_batch(self, obs) -> pd.DataFrame:
+        """calculate_scores over columnar observations (a DataFrame or dict of arrays, see observation()); identical results row for row"""
+        col = {name: np.asarray(obs[name]) for name in (
+            'expiry_type', 'vrp_garch', 'vrp_park', 'vrp_rv', 'term_regime', 'term_spread', 'vov_zscore', 'ivp_1yr',
+            'gex_regime', 'pcr', 'skew_25d', 'fast_vol', 'flow_regime', 'dte_weekly', 'is_gamma_week', 'is_gamma_month'
+        )}
+        weekly, monthly = col['expiry_type'] == "WEEKLY", col['expiry_type'] == "MONTHLY"
+        
+        weighted_vrp = (col['vrp_garch'].astype(np.float64) * 0.70) + (col['vrp_park'] * 0.15) + (col['vrp_rv'] * 0.15)
+        edge_score = 5.0 + np.select(
+            [weighted_vrp > 4.0, weighted_vrp > 2.0, weighted_vrp > 1.0, weighted_vrp < 0], [3.0, 2.0, 1.0, -3.0], 0.0
+        )
+        edge_score = edge_score + np.select(
+            [(col['term_regime'] == "BACKWARDATION") & (col['term_spread'] < -2.0), col['term_regime'] == "CONTANGO"], [1.0, 0.5], 0.0
+        )
+        edge_score = np.clip(edge_score, 0, 10)
+        
+        vov = col['vov_zscore']
+        vol_score = np.select(
+            [vov > ProductionConfig.VOV_CRASH_ZSCORE, vov > ProductionConfig.VOV_WARNING_ZSCORE, vov < 1.5], [0.0, 5.0 - 3.0, 5.0 + 1.5], 5.0
+        )
+        vol_score = vol_score + np.select(
+            [col['ivp_1yr'] > ProductionConfig.HIGH_VOL_IVP, col['ivp_1yr'] < ProductionConfig.LOW_VOL_IVP], [0.5, -2.5], 1.0
+        )
+        vol_score = np.clip(vol_score, 0, 10)
+        
+        pcr = col['pcr']
+        struct_score = 5.0 + np.select(
+            [col['gex_regime'] == "STICKY", col['gex_regime'] == "SLIPPERY"],
+            [np.where(weekly & (col['dte_weekly'] <= 1), 2.5, 1.0), -1.0], 0.0
+        )
+        struct_score = struct_score + np.select([(pcr > 0.9) & (pcr < 1.1), (pcr > 1.3) | (pcr < 0.7)], [1.0, -0.5], 0.0)
+        struct_score = struct_score - np.where(np.abs(col['skew_25d']) > 3.0, 0.5, 0.0)
+        struct_score = np.clip(struct_score, 0, 10)
+        
+        risk_score = 10.0 - np.where(col['fast_vol'].astype(bool), 2.0, 0.0)
+        risk_score = risk_score + np.select([col['flow_regime'] == "STRONG_SHORT", col['flow_regime'] == "STRONG_LONG"], [-3.0, 1.0], 0.0)
+        risk_score = risk_score + np.select(
+            [weekly & col['is_gamma_week'].astype(bool), monthly & col['is_gamma_month'].astype(bool)], [-2.0, -2.5], 0.0
+        )
+        risk_score = np.clip(risk_score, 0, 10)
+        
+        composite = (
+            vol_score * ProductionConfig.WEIGHT_VOL +
+            struct_score * ProductionConfig.WEIGHT_STRUCT +
+            edge_score * ProductionConfig.WEIGHT_EDGE +
+            risk_score * ProductionConfig.WEIGHT_RISK
+        )
+        confidence = np.select([composite >= 8.0, composite >= 6.5, composite >= 4.0], ["VERY_HIGH", "HIGH", "MODERATE"], "LOW")
+        
+        return pd.DataFrame({
+            'vol_score': vol_score, 'struct_score': struct_score, 'edge_score': edge_score, 'risk_score': risk_score,
+            'composite': composite, 'confidence': confidence
+        }, index=getattr(obs, 'index', None))
+    
+    def generate_mandates_batch(self, obs, scores: pd.DataFrame) -> pd.DataFrame:
+        """generate_mandate over the same observations and their batch scores; rationale and warning text are scalar-path only"""
+        composite = scores['composite'].to_numpy()
+        dte = np.asarray(obs['dte'])
+        vov = np.asarray(obs['vov_zscore'])
+        weekly = np.asarray(obs['expiry_type']) == "WEEKLY"
+        
+        rungs = [
+            (composite >= 7.5) & (dte > 2), (composite >= 7.5) & (dte <= 2),
+            (composite >= 6.0) & (dte > 1), (composite >= 6.0) & (dte <= 1),
+            composite >= 4.0
+        ]
+        regime_name = np.select(rungs, ["AGGRESSIVE_SHORT", "AGGRESSIVE_SHORT_GAMMA", "MODERATE_SHORT", "MODERATE_SHORT_GAMMA", "DEFENSIVE"], "CASH")
+        strategy = np.select(rungs, ["AGGRESSIVE_SHORT", "AGGRESSIVE_SHORT", "MODERATE_SHORT", "MODERATE_SHORT", "DEFENSIVE"], "CASH")
+        suggested = np.select(rungs, ["IRON_CONDOR", "IRON_FLY", "IRON_CONDOR", "IRON_FLY", "CREDIT_SPREAD"], "NONE")
+        allocation = np.select(rungs, [60.0, 50.0, 40.0, 35.0, 20.0], 0.0)
+        
+        allocation = np.where(vov > ProductionConfig.VOV_WARNING_ZSCORE, allocation * 0.7, allocation)
+        fii_dumping = (np.asarray(obs['flow_regime']) == "STRONG_SHORT") & np.asarray(obs['has_fii']).astype(bool)
+        allocation = np.where(fii_dumping, np.minimum(allocation, 30.0), allocation)
+        allocation = np.where((dte <= ProductionConfig.GAMMA_DANGER_DTE) & weekly, allocation * 0.6, allocation)
+        
+        deployable = ProductionConfig.BASE_CAPITAL * (allocation / 100.0)
+        risk_per_lot = np.where(strategy != "DEFENSIVE", float(ProductionConfig.MARGIN_SELL_BASE), ProductionConfig.MARGIN_SELL_BASE * 0.6)
+        max_lots = np.trunc(deployable / risk_per_lot).astype(np.int64)
+        
+        return pd.DataFrame({
+            'regime_name': regime_name, 'strategy_type': strategy, 'suggested_structure': suggested,
+            'allocation_pct': allocation, 'max_lots': max_lots, 'risk_per_lot': risk_per_lot
+        }, index=scores.index)
+
+# ==========================================
+# CHAIN INDEX (LEG SELECTION)
+# ==========================================
+class ChainIndex:
+    """One chain prepared for leg searches: strike-sorted columns, per-side |delta| order and tradability masks"""
+    
+    def __init__(self, chain):
+        strikes = np.asarray(chain['strike'], dtype=np.float64)
+        order = np.argsort(strikes, kind='stable')
+        self.strikes = strikes[order]
+        self.liquidity = np.asarray(chain['ce_oi'], dtype=np.float64)[order] + np.asarray(chain['pe_oi'], dtype=np.float64)[order]
+        self.sides = {type_: self._side(chain, type_.lower(), order) for type_ in ('CE', 'PE')}
+    
+    @staticmethod
+    def _side(chain, prefix: str, order: np.ndarray) -> Dict[str, np.ndarray]:
+        col = lambda name: np.asarray(chain[f'{prefix}_{name}'], dtype=np.float64)[order]
+        ltp, bid, ask, oi, delta = col('ltp'), col('bid'), col('ask'), col('oi'), col('delta')
+        with np.errstate(divide='ignore', invalid='ignore'):
+            spread = np.where(ltp > 0, (ask - bid) / ltp, 1.0)
+        
+        # Masks are written as "not rejected" so NaN quotes pass exactly as they did in the row loops
+        priced = ~((ltp <= 0) | (ask <= 0))
+        abs_delta = np.abs(delta)
+        delta_order = np.argsort(abs_delta, kind='stable')
+        return {
+            'key': np.asarray(chain[f'{prefix}_key'])[order],
+            'ltp': ltp, 'bid': bid, 'ask': ask, 'oi': oi, 'delta': delta, 'spread': spread,
+            'priced': priced,
+            'tight': ~(spread > ProductionConfig.MAX_BID_ASK_SPREAD),
+            'liquid': priced & ~(oi < 100),
+            'delta_order': delta_order,
+            'abs_delta_sorted': abs_delta[delta_order],
+            'finite_deltas': int(np.isfinite(abs_delta).sum())
+        }
+    
+    def strike_range(self, low: float, high: float) -> Tuple[int, int]:
+        """Row bounds [lo, hi) covering strikes in [low, high], padded by one row for float edges"""
+        lo = max(int(np.searchsorted(self.strikes, low, side='left')) - 1, 0)
+        hi = min(int(np.searchsorted(self.strikes, high, side='right')) + 1, len(self.strikes))
+        return lo, hi
+    
+    def find_strike(self, strike: float) -> Optional[int]:
+        row = int(np.searchsorted(self.strikes, strike, side='left'))
+        return row if row < len(self.strikes) and self.strikes[row] == strike else None
+    
+    def nearest_strikes(self, target: float, count: int) -> np.ndarray:
+        """Rows of the `count` strikes closest to target, nearest first (ties to the lower strike)"""
+        pos = int(np.searchsorted(self.strikes, target))
+        lo, hi = max(pos - count, 0), min(pos + count, len(self.strikes))
+        rows = np.arange(lo, hi)
+        diff = np.abs(self.strikes[rows] - target)
+        return rows[np.argsort(diff, kind='stable')[:count]]
+    
+    def by_delta(self, type_: str, target: float):
+        """Rows ordered by ||delta| - target|, ties to the lower strike, walked outwards from a binary search.
+        Equal |delta| values are taken as a whole run; NaN deltas come last."""
+        side = self.sides[type_]
+        finite = side['finite_deltas']
+        sorted_abs, delta_order = side['abs_delta_sorted'][:finite], side['delta_order']
+        right = int(np.searchsorted(sorted_abs, target, side='left'))
+        left = right - 1
+        while left >= 0 or right < finite:
+            left_gap = target - sorted_abs[left] if left >= 0 else np.inf
+            right_gap = sorted_abs[right] - target if right < finite else np.inf
+            run = []
+            if left_gap <= right_gap:
+                start = int(np.searchsorted(sorted_abs, sorted_abs[left], side='left'))
+                run.extend(delta_order[start:left + 1])
+                left = start - 1
+            if right_gap <= left_gap:
+                end = int(np.searchsorted(sorted_abs, sorted_abs[right], side='right'))
+                run.extend(delta_order[right:end])
+                right = end
+            yield from sorted(run)
+        yield from delta_order[finite:]
+    
+    def leg(self, type_: str, row: int) -> Dict:
+        side = self.sides[type_]
+        return {
+            'key': None if side['key'][row] is None else str(side['key'][row]),
+            'strike': float(self.strikes[row]),
+            'ltp': float(side['ltp'][row]),
+            'delta': float(side['delta'][row]),
+            'type': type_,
+            'bid': float(side['bid'][row]),
+            'ask': float(side['ask'][row])
+        }
+
+# ==========================================
+# STRATEGY CANDIDATES (VECTORIZED)
+# ==========================================
+class CandidateEngine:
+    """All feasible strike combinations for a structure, scored as arrays and ranked under the trade limits"""
+    LEG_COLUMNS = (
+        ('short_call', 'CE', 'SELL', 'CORE'), ('short_put', 'PE', 'SELL', 'CORE'),
+        ('long_call', 'CE', 'BUY', 'HEDGE'), ('long_put', 'PE', 'BUY', 'HEDGE')
+    )
+    
+    def __init__(self, index: ChainIndex):
+        self.index = index
+        delta = index.sides['CE']['delta']
+        finite = np.isfinite(delta)
+        self.curve_strikes, self.curve_delta = index.strikes[finite], delta[finite]
+    
+    def _prob_above(self, price: np.ndarray) -> np.ndarray:
+        """P(spot at expiry > price), read off the call delta curve"""
+        price = np.asarray(price, dtype=np.float64)
+        if len(self.curve_strikes) < 2:
+            return np.full(price.shape, np.nan)
+        prob = np.clip(np.interp(price, self.curve_strikes, self.curve_delta), 0.0, 1.0)
+        return np.where(price == -np.inf, 1.0, np.where(price == np.inf, 0.0, prob))
+    
+    def _short_rows(self, type_: str) -> np.ndarray:
+        side = self.index.sides[type_]
+        abs_delta = np.abs(side['delta'])
+        ok = side['priced'] & side['tight'] & \
+             (abs_delta >= ProductionConfig.CANDIDATE_SHORT_DELTA_MIN) & (abs_delta <= ProductionConfig.CANDIDATE_SHORT_DELTA_MAX)
+        return np.flatnonzero(ok)
+    
+    def _long_rows(self, type_: str) -> np.ndarray:
+        side = self.index.sides[type_]
+        return np.flatnonzero(side['liquid'] & side['tight'])
+    
+    def verticals(self, type_: str) -> Dict[str, np.ndarray]:
+        """Every credit spread on one side: a short strike and a further-OTM long strike"""
+        side, strikes = self.index.sides[type_], self.index.strikes
+        short, long_ = np.meshgrid(self._short_rows(type_), self._long_rows(type_), indexing='ij')
+        short, long_ = short.ravel(), long_.ravel()
+        width = strikes[long_] - strikes[short] if type_ == 'CE' else strikes[short] - strikes[long_]
+        credit = side['ltp'][short] - side['ltp'][long_]
+        keep = (width > 0) & (credit > 0) & (credit < width)
+        short, long_, width, credit = short[keep], long_[keep], width[keep], credit[keep]
+        return {
+            'short': short, 'long': long_, 'width': width, 'credit': credit,
+            'liquidity': np.minimum(side['oi'][short], side['oi'][long_])
+        }
+    
+    def _candidates(self, n: int, **columns) -> Dict[str, np.ndarray]:
+        unused = np.full(n, -1, dtype=np.int64)
+        rows = {name: columns.pop(name, unused) for name, _, _, _ in self.LEG_COLUMNS}
+        return {**rows, **columns}
+    
+    def credit_spread(self) -> Dict[str, np.ndarray]:
+        v = self.verticals('PE')
+        n = len(v['short'])
+        return self._candidates(
+            n, short_put=v['short'], long_put=v['long'], credit=v['credit'],
+            max_loss=v['width'] - v['credit'], liquidity=v['liquidity'],
+            breakeven_low=self.index.strikes[v['short']] - v['credit'], breakeven_high=np.full(n, np.inf)
+        )
+    
+    def _best_verticals(self, type_: str) -> Dict[str, np.ndarray]:
+        """Top CANDIDATE_SIDE_POOL verticals of one side by their own score, to keep the condor cross product small"""
+        v = self.verticals(type_)
+        strikes = self.index.strikes[v['short']]
+        if type_ == 'CE':
+            pop = 1.0 - self._prob_above(strikes + v['credit'])
+        else:
+            pop = self._prob_above(strikes - v['credit'])
+        max_loss = v['width'] - v['credit']
+        score = np.nan_to_num((pop * v['credit'] - (1 - pop) * max_loss) / max_loss, nan=-np.inf)
+        top = np.argsort(-score, kind='stable')[:ProductionConfig.CANDIDATE_SIDE_POOL]
+        return {name: values[top] for name, values in v.items()}
+    
+    def iron_condor(self) -> Dict[str, np.ndarray]:
+        puts, calls = self._best_verticals('PE'), self._best_verticals('CE')
+        strikes = self.index.strikes
+        p, c = np.meshgrid(np.arange(len(puts['short'])), np.arange(len(calls['short'])), indexing='ij')
+        p, c = p.ravel(), c.ravel()
+        
+        short_put, short_call = puts['short'][p], calls['short'][c]
+        credit = puts['credit'][p] + calls['credit'][c]
+        max_loss = np.maximum(puts['width'][p], calls['width'][c]) - credit
+        keep = (strikes[short_put] < strikes[short_call]) & (max_loss > 0)
+        p, c, credit, max_loss = p[keep], c[keep], credit[keep], max_loss[keep]
+        return self._candidates(
+            len(p), short_call=calls['short'][c], long_call=calls['long'][c],
+            short_put=puts['short'][p], long_put=puts['long'][p], credit=credit, max_loss=max_loss,
+            liquidity=np.minimum(puts['liquidity'][p], calls['liquidity'][c]),
+            breakeven_low=strikes[puts['short'][p]] - credit, breakeven_high=strikes[calls['short'][c]] + credit
+        )
+    
+    def iron_fly(self, spot: float, min_width: Optional[float] = None) -> Dict[str, np.ndarray]:
+        """Wings between min_width (the FIXED vol/DTE wing width when given) and IRON_FLY_MAX_WING_WIDTH"""
+        index, strikes = self.index, self.index.strikes
+        min_width = max(min_width or 0, ProductionConfig.IRON_FLY_MIN_WING_WIDTH)
+        max_width = ProductionConfig.IRON_FLY_MAX_WING_WIDTH
+        ce, pe = index.sides['CE'], index.sides['PE']
+        lo, hi = index.strike_range(spot * (1 - ProductionConfig.IRON_FLY_ATM_TOLERANCE), spot * (1 + ProductionConfig.IRON_FLY_ATM_TOLERANCE))
+        atm = np.arange(lo, hi)
+        atm = atm[(np.abs(strikes[atm] - spot) / spot <= ProductionConfig.IRON_FLY_ATM_TOLERANCE) & ce['priced'][atm] & pe['priced'][atm]]
+        
+        call_wings, put_wings = self._long_rows('CE'), self._long_rows('PE')
+        if len(atm):
+            low, high = strikes[atm[0]], strikes[atm[-1]]
+            call_wings = call_wings[(strikes[call_wings] >= low + min_width) & (strikes[call_wings] <= high + max_width)]
+            put_wings = put_wings[(strikes[put_wings] >= low - max_width) & (strikes[put_wings] <= high - min_width)]
+        
+        a, cw, pw = np.meshgrid(atm, call_wings, put_wings, indexing='ij')
+        a, cw, pw = a.ravel(), cw.ravel(), pw.ravel()
+        call_width, put_width = strikes[cw] - strikes[a], strikes[a] - strikes[pw]
+        credit = ce['ltp'][a] + pe['ltp'][a] - ce['ltp'][cw] - pe['ltp'][pw]
+        max_loss = np.maximum(call_width, put_width) - credit
+        keep = (call_width >= min_width) & (call_width <= max_width) & (put_width >= min_width) & (put_width <= max_width) & \
+               (credit > 0) & (max_loss > 0)
+        a, cw, pw, credit, max_loss = a[keep], cw[keep], pw[keep], credit[keep], max_loss[keep]
+        return self._candidates(
+            len(a), short_call=a, short_put=a, long_call=cw, long_put=pw, credit=credit, max_loss=max_loss,
+            liquidity=np.minimum.reduce([ce['oi'][a], pe['oi'][a], ce['oi'][cw], pe['oi'][pw]]),
+            breakeven_low=strikes[a] - credit, breakeven_high=strikes[a] + credit
+        )
+    
+    def rank(self, structure: str, qty: int, spot: float, top_n: int = ProductionConfig.CANDIDATE_TOP_N,
+             min_wing_width: Optional[float] = None) -> pd.DataFrame:
+        """Top candidates by delta-implied expected value per unit of risk, within MAX_LOSS_PER_TRADE for `qty`"""
+        builders = {
+            'IRON_FLY': lambda: self.iron_fly(spot, min_wing_width),
+            'IRON_CONDOR': self.iron_condor,
+            'CREDIT_SPREAD': self.credit_spread
+        }
+        if structure not in builders or qty <= 0:
+            return pd.DataFrame()
+        
+        c = builders[structure]()
+        c['credit_to_risk'] = c['credit'] / c['max_loss']
+        c['pop'] = self._prob_above(c['breakeven_low']) - self._prob_above(c['breakeven_high'])
+        c['score'] = (c['pop'] * c['credit'] - (1 - c['pop']) * c['max_loss']) / c['max_loss']
+        
+        allowed = np.flatnonzero(c['max_loss'] * qty <= ProductionConfig.MAX_LOSS_PER_TRADE)
+        order = np.lexsort((-c['liquidity'][allowed], -np.nan_to_num(c['score'][allowed], nan=-np.inf)))
+        top = allowed[order[:top_n]]
+        
+        ranked = pd.DataFrame({name: values[top] for name, values in c.items()})
+        for name, _, _, _ in self.LEG_COLUMNS:
+            ranked[f'{name}_strike'] = np.where(ranked[name] >= 0, self.index.strikes[np.maximum(ranked[name], 0)], np.nan)
+        ranked['structure'] = structure
+        return ranked
+    
+    def legs(self, candidate: pd.Series, qty: int) -> List[Dict]:
+        legs = []
+        for name, type_, side, role in self.LEG_COLUMNS:
+            row = int(candidate[name])
+            if row >= 0:
+                legs.append({**self.index.leg(type_, row), 'side': side, 'role': role, 'qty': qty, 'structure': candidate['structure']})
+        return legs
 
 # ==========================================
 # STRATEGY FACTORY (PRODUCTION HARDENED)
@@ -1536,127 +3369,93 @@ class StrategyFactory:
         
         return min(max(base_width, ProductionConfig.IRON_FLY_MIN_WING_WIDTH), ProductionConfig.IRON_FLY_MAX_WING_WIDTH)
     
-    def _find_atm_strike(self, df: pd.DataFrame, spot: float) -> Optional[float]:
-        df = df.copy()
-        df['atm_diff'] = (df['strike'] - spot).abs()
-        df['atm_pct'] = df['atm_diff'] / spot
-        
-        atm_candidates = df[df['atm_pct'] <= ProductionConfig.IRON_FLY_ATM_TOLERANCE]
+    def _find_atm_strike(self, index: 'ChainIndex', spot: float) -> Optional[float]:
+        lo, hi = index.strike_range(spot * (1 - ProductionConfig.IRON_FLY_ATM_TOLERANCE), spot * (1 + ProductionConfig.IRON_FLY_ATM_TOLERANCE))
+        rows = np.arange(lo, hi)
+        rows = rows[np.abs(index.strikes[rows] - spot) / spot <= ProductionConfig.IRON_FLY_ATM_TOLERANCE]
         
-        if atm_candidates.empty:
+        if len(rows) == 0:
             logger.warning(f"No ATM strikes within {ProductionConfig.IRON_FLY_ATM_TOLERANCE*100}% tolerance")
             return None
         
-        atm_candidates['liquidity_score'] = atm_candidates['ce_oi'] + atm_candidates['pe_oi']
-        best_atm = atm_candidates.nlargest(1, 'liquidity_score').iloc[0]
-        
-        return best_atm['strike']
+        liquidity = np.nan_to_num(index.liquidity[rows], nan=-np.inf)
+        return float(index.strikes[rows[np.argmax(liquidity)]])
     
-    def _find_wing_by_width(self, df: pd.DataFrame, atm_strike: float, type_: str, wing_width: int) -> Optional[Dict]:
+    def _find_wing_by_width(self, index: 'ChainIndex', atm_strike: float, type_: str, wing_width: int) -> Optional[Dict]:
         target_strike = atm_strike + wing_width if type_ == 'CE' else atm_strike - wing_width
+        side = index.sides[type_]
         
-        df = df.copy()
-        df['wing_diff'] = (df['strike'] - target_strike).abs()
-        candidates = df.nsmallest(3, 'wing_diff')
-        
-        for _, row in candidates.iterrows():
-            bid = row[f'{type_.lower()}_bid']
-            ask = row[f'{type_.lower()}_ask']
-            ltp = row[f'{type_.lower()}_ltp']
-            oi = row[f'{type_.lower()}_oi']
-            
-            if ltp <= 0 or ask <= 0 or oi < 100:
+        for row in index.nearest_strikes(target_strike, 3):
+            if not side['liquid'][row]:
                 continue
             
-            spread = (ask - bid) / ltp if ltp > 0 else 1.0
-            if spread > ProductionConfig.MAX_BID_ASK_SPREAD:
-                logger.warning(f"Skipping {type_} wing {row['strike']}: Spread {spread*100:.1f}%")
+            if not side['tight'][row]:
+                logger.warning(f"Skipping {type_} wing {index.strikes[row]}: Spread {side['spread'][row]*100:.1f}%")
                 continue
             
-            return {
-                'key': row[f'{type_.lower()}_key'],
-                'strike': row['strike'],
-                'ltp': ltp,
-                'delta': row[f'{type_.lower()}_delta'],
-                'type': type_,
-                'oi': oi,
-                'bid': bid,
-                'ask': ask
-            }
+            return {**index.leg(type_, row), 'oi': float(side['oi'][row])}
         
         return None
     
-    def _find_atm_leg(self, df: pd.DataFrame, atm_strike: float, type_: str) -> Optional[Dict]:
-        atm_row = df[df['strike'] == atm_strike]
+    def _find_atm_leg(self, index: 'ChainIndex', atm_strike: float, type_: str) -> Optional[Dict]:
+        row = index.find_strike(atm_strike)
         
-        if atm_row.empty:
+        if row is None:
             return None
         
-        row = atm_row.iloc[0]
-        bid = row[f'{type_.lower()}_bid']
-        ask = row[f'{type_.lower()}_ask']
-        ltp = row[f'{type_.lower()}_ltp']
-        
-        if ltp <= 0 or ask <= 0:
+        side = index.sides[type_]
+        if not side['priced'][row]:
             logger.error(f"ATM {type_} {atm_strike} has no valid price")
             return None
         
-        spread = (ask - bid) / ltp
+        spread = side['spread'][row]
         if spread > ProductionConfig.MAX_BID_ASK_SPREAD * 1.5:
             logger.warning(f"ATM {type_} {atm_strike}: Wide spread {spread*100:.1f}%")
         
-        return {
-            'key': row[f'{type_.lower()}_key'],
-            'strike': row['strike'],
-            'ltp': ltp,
-            'delta': row[f'{type_.lower()}_delta'],
-            'type': type_,
-            'bid': bid,
-            'ask': ask
-        }
+        return index.leg(type_, row)
     
-    def _find_leg_by_delta(self, df: pd.DataFrame, type_: str, target_delta: float) -> Optional[Dict]:
-        target = abs(target_delta)
-        col_delta = f"{type_.lower()}_delta"
-        df = df.copy()
-        df['delta_diff'] = (df[col_delta].abs() - target).abs()
-        candidates = df.sort_values('delta_diff')
+    def _find_leg_by_delta(self, index: 'ChainIndex', type_: str, target_delta: float) -> Optional[Dict]:
+        side = index.sides[type_]
+        tradable = side['priced'] & side['tight']
         
-        for _, row in candidates.iterrows():
-            bid = row[f'{type_.lower()}_bid']
-            ask = row[f'{type_.lower()}_ask']
-            ltp = row[f'{type_.lower()}_ltp']
-            
-            if ltp <= 0 or ask <= 0:
-                continue
-            
-            spread = (ask - bid) / ltp
-            if spread > ProductionConfig.MAX_BID_ASK_SPREAD:
-                continue
-            
-            return {
-                'key': row[f'{type_.lower()}_key'],
-                'strike': row['strike'],
-                'ltp': ltp,
-                'delta': row[col_delta],
-                'type': type_,
-                'bid': bid,
-                'ask': ask
-            }
+        for row in index.by_delta(type_, abs(target_delta)):
+            if tradable[row]:
+                return index.leg(type_, row)
         
         return None
     
-    def generate(self, mandate: TradingMandate, chain: pd.DataFrame, lot_size: int, vol_metrics: VolMetrics, spot: float) -> List[Dict]:
+    def _best_candidate_legs(self, index: ChainIndex, mandate: TradingMandate, qty: int, vol_metrics: VolMetrics, spot: float) -> List[Dict]:
+        engine = CandidateEngine(index)
+        # Same vol/DTE wing rule as FIXED, as a floor: the ranker may still pick wider wings up to the maximum
+        wing_width = self._calculate_wing_width(vol_metrics, mandate.dte, spot)
+        ranked = engine.rank(mandate.suggested_structure, qty, spot, min_wing_width=wing_width)
+        if ranked.empty:
+            logger.error(f"No feasible {mandate.suggested_structure} candidates within limits")
+            return []
+        
+        for i, c in enumerate(ranked.itertuples(), 1):
+            logger.info(
+                f"#{i} {c.structure}: SC={c.short_call_strike} LC={c.long_call_strike} SP={c.short_put_strike} LP={c.long_put_strike} | "
+                f"Credit={c.credit:.2f} MaxLoss={c.max_loss:.2f} C/R={c.credit_to_risk:.2f} POP={c.pop:.0%} Score={c.score:.3f}"
+            )
+        return engine.legs(ranked.iloc[0], qty)
+    
+    def generate(self, mandate: TradingMandate, chain, lot_size: int, vol_metrics: VolMetrics, spot: float,
+                 now: Optional[datetime] = None) -> List[Dict]:
         if mandate.max_lots == 0 or chain.empty:
             return []
         
+        index = ChainIndex(OptionPricer.fill_missing_greeks(chain, spot, mandate.expiry_date, now))
         qty = mandate.max_lots * lot_size
         legs = []
         
-        if mandate.suggested_structure == "IRON_FLY":
+        if ProductionConfig.STRATEGY_SELECTION == "RANKED":
+            legs = self._best_candidate_legs(index, mandate, qty, vol_metrics, spot)
+        
+        elif mandate.suggested_structure == "IRON_FLY":
             logger.info(f"🦅 Constructing Iron Fly | DTE={mandate.dte} | Spot={spot:.2f}")
             
-            atm_strike = self._find_atm_strike(chain, spot)
+            atm_strike = self._find_atm_strike(index, spot)
             if not atm_strike:
                 logger.error("Iron Fly construction failed: No valid ATM strike")
                 return []
@@ -1664,10 +3463,10 @@ class StrategyFactory:
             wing_width = self._calculate_wing_width(vol_metrics, mandate.dte, spot)
             logger.info(f"ATM Strike: {atm_strike} | Wing Width: {wing_width}")
             
-            atm_call = self._find_atm_leg(chain, atm_strike, 'CE')
-            atm_put = self._find_atm_leg(chain, atm_strike, 'PE')
-            wing_call = self._find_wing_by_width(chain, atm_strike, 'CE', wing_width)
-            wing_put = self._find_wing_by_width(chain, atm_strike, 'PE', wing_width)
+            atm_call = self._find_atm_leg(index, atm_strike, 'CE')
+            atm_put = self._find_atm_leg(index, atm_strike, 'PE')
+            wing_call = self._find_wing_by_width(index, atm_strike, 'CE', wing_width)
+            wing_put = self._find_wing_by_width(index, atm_strike, 'PE', wing_width)
             
             if not all([atm_call, atm_put, wing_call, wing_put]):
                 logger.error("Iron Fly incomplete: Missing liquid strikes")
@@ -1690,10 +3489,10 @@ class StrategyFactory:
         elif mandate.suggested_structure == "IRON_CONDOR":
             logger.info(f"🦅 Constructing Iron Condor | DTE={mandate.dte}")
             
-            call_short = self._find_leg_by_delta(chain, 'CE', 0.20)
-            put_short = self._find_leg_by_delta(chain, 'PE', 0.20)
-            call_long = self._find_leg_by_delta(chain, 'CE', 0.05)
-            put_long = self._find_leg_by_delta(chain, 'PE', 0.05)
+            call_short = self._find_leg_by_delta(index, 'CE', 0.20)
+            put_short = self._find_leg_by_delta(index, 'PE', 0.20)
+            call_long = self._find_leg_by_delta(index, 'CE', 0.05)
+            put_long = self._find_leg_by_delta(index, 'PE', 0.05)
             
             if not all([call_short, put_short, call_long, put_long]):
                 logger.error("Iron Condor incomplete")
@@ -1709,8 +3508,8 @@ class StrategyFactory:
         elif mandate.suggested_structure == "CREDIT_SPREAD":
             logger.info(f"📊 Constructing Credit Spread (Bearish Bias)")
             
-            put_short = self._find_leg_by_delta(chain, 'PE', 0.25)
-            put_long = self._find_leg_by_delta(chain, 'PE', 0.10)
+            put_short = self._find_leg_by_delta(index, 'PE', 0.25)
+            put_long = self._find_leg_by_delta(index, 'PE', 0.10)
             
             if not all([put_short, put_long]):
                 logger.error("Credit Spread incomplete")
@@ -1735,9 +3534,13 @@ class StrategyFactory:
 # EXECUTION ENGINE (PRODUCTION HARDENED)
 # ==========================================
 class ExecutionEngine:
+    _shared: Dict[int, 'ExecutionEngine'] = {}
+    _shared_lock = threading.Lock()
+    
     def __init__(self, api_client: upstox_client.ApiClient):
         self.api_client = api_client
         self.order_updates = {}
+        self.order_events: Dict[str, threading.Event] = {}
         self.update_lock = threading.Lock()
         self.price_cache = {}
         self.price_cache_lock = threading.Lock()
@@ -1749,6 +3552,15 @@ class ExecutionEngine:
         else:
             logger.info("📄 Dry run mode - skipping WebSocket setup")
     
+    @classmethod
+    def shared(cls, api_client: upstox_client.ApiClient) -> 'ExecutionEngine':
+        """One engine (and one portfolio stream) per API client, reused by every entry and exit in the process"""
+        with cls._shared_lock:
+            engine = cls._shared.get(id(api_client))
+            if engine is None or engine.api_client is not api_client:
+                engine = cls._shared[id(api_client)] = cls(api_client)
+            return engine
+    
     def _setup_portfolio_stream(self):
         """Setup PortfolioDataStreamer for order updates"""
         try:
@@ -1761,12 +3573,15 @@ class ExecutionEngine:
             
             def on_message(message):
                 with self.update_lock:
-                    if 'order_updates' in message:
-                        for update in message['order_updates']:
-                            order_id = update.get('order_id')
-                            if order_id:
-                                self.order_updates[order_id] = update
-                                logger.debug(f"WebSocket order update: {order_id} -> {update.get('status')}")
+                    for update in self._order_updates_in(message):
+                        order_id = update.get('order_id')
+                        if order_id:
+                            self.order_updates[order_id] = update
+                            # Only orders someone is waiting on; wait_for_order reads order_updates after registering
+                            event = self.order_events.get(order_id)
+                            if event is not None:
+                                event.set()
+                            logger.debug(f"WebSocket order update: {order_id} -> {update.get('status')}")
             
             def on_open():
                 self.websocket_connected = True
@@ -1774,10 +3589,13 @@ class ExecutionEngine:
             
             def on_error(error):
                 self.websocket_connected = False
+                self._wake_order_waiters()
                 logger.error(f"Portfolio Stream Error: {error}")
             
-            def on_close():
+            def on_close(*args):
+                # The SDK passes (close_status_code, close_msg)
                 self.websocket_connected = False
+                self._wake_order_waiters()
                 logger.warning("Portfolio Stream Closed")
             
             self.portfolio_streamer.on("message", on_message)
@@ -1792,6 +3610,35 @@ class ExecutionEngine:
             logger.error(f"Failed to setup portfolio stream: {e}")
             self.websocket_connected = False
     
+    @staticmethod
+    def _order_updates_in(message) -> List[Dict]:
+        """Order updates in a portfolio stream message: a batch under 'order_updates' or a single update_type='order' payload"""
+        if isinstance(message, (str, bytes)):
+            try:
+                message = json.loads(message)
+            except ValueError:
+                return []
+        if not isinstance(message, dict):
+            return []
+        if 'order_updates' in message:
+            return message['order_updates'] or []
+        if message.get('update_type') == 'order':
+            return [message]
+        return []
+    
+    def _order_event(self, order_id: str) -> threading.Event:
+        """Registered by wait_for_order and set on every stream update for the order; caller holds update_lock"""
+        event = self.order_events.get(order_id)
+        if event is None:
+            event = self.order_events[order_id] = threading.Event()
+        return event
+    
+    def _wake_order_waiters(self):
+        """Stream went down: wake every waiter so it switches to REST polling now"""
+        with self.update_lock:
+            for event in self.order_events.values():
+                event.set()
+    
     def check_margin_requirement(self, legs: List[Dict]) -> float:
         """Check margin with retry logic"""
         for attempt in range(ProductionConfig.MAX_API_RETRIES):
@@ -1910,17 +3757,21 @@ class ExecutionEngine:
         if ProductionConfig.DRY_RUN_MODE:
             return paper_engine.get_order_status(order_id)
         
-        # Try WebSocket cache first (zero latency)
+        # Try WebSocket cache first (zero latency), REST if the stream hasn't reported the order yet
+        return self._stream_order_status(order_id) or self._rest_order_status(order_id)
+    
+    def _stream_order_status(self, order_id: str) -> Optional[Dict]:
         with self.update_lock:
-            if order_id in self.order_updates:
-                update = self.order_updates[order_id]
-                return {
-                    'status': update.get('status', '').lower(),
-                    'avg_price': float(update.get('average_price', 0)),
-                    'filled_qty': int(update.get('filled_quantity', 0))
-                }
-        
-        # Fallback to REST API if WebSocket hasn't updated yet
+            update = self.order_updates.get(order_id)
+        if update is None:
+            return None
+        return {
+            'status': (update.get('status') or '').lower(),
+            'avg_price': float(update.get('average_price') or 0),
+            'filled_qty': int(update.get('filled_quantity') or 0)
+        }
+    
+    def _rest_order_status(self, order_id: str) -> Optional[Dict]:
         try:
             order_api = OrderApi(self.api_client)
             response = order_api.get_order_details(order_id=order_id)
@@ -1938,6 +3789,46 @@ class ExecutionEngine:
             logger.error(f"Order status check failed: {e}")
             return None
     
+    def wait_for_order(self, order_id: str, timeout: float) -> Optional[Dict]:
+        """Block until the order completes, is rejected or cancelled, or the timeout passes (then the last known status).
+        Woken by portfolio stream pushes; REST is polled only while the stream is down, plus one check after
+        ORDER_STREAM_CHECK_INTERVAL of silence in case a push was missed."""
+        deadline = time.monotonic() + timeout
+        with self.update_lock:
+            event = self._order_event(order_id)
+        status = last_status = None
+        
+        try:
+            while True:
+                event.clear()
+                if ProductionConfig.DRY_RUN_MODE:
+                    status = paper_engine.get_order_status(order_id)
+                elif self.websocket_connected:
+                    status = self._stream_order_status(order_id) or status
+                else:
+                    status = self._rest_order_status(order_id) or status
+                
+                if status and status['status'] != last_status:
+                    logger.debug(f"Order {order_id}: {status['status']}")
+                    last_status = status['status']
+                if status and status['status'] in ('complete', 'rejected', 'cancelled'):
+                    return status
+                
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return status
+                
+                if ProductionConfig.DRY_RUN_MODE or not self.websocket_connected:
+                    time.sleep(min(ProductionConfig.ORDER_STATUS_POLL, remaining))
+                elif not event.wait(min(ProductionConfig.ORDER_STREAM_CHECK_INTERVAL, remaining)):
+                    status = self._rest_order_status(order_id) or status
+                    if status and status['status'] in ('complete', 'rejected', 'cancelled'):
+                        logger.warning(f"Order {order_id} {status['status']} without a stream update - REST fallback")
+                        return status
+        finally:
+            with self.update_lock:
+                self.order_events.pop(order_id, None)
+    
     def cancel_order(self, order_id: str) -> bool:
         """Cancel order with retry (or paper cancel)"""
         # DRY RUN MODE
@@ -2096,25 +3987,15 @@ class ExecutionEngine:
         
         logger.info(f"PLACING {leg['side']} {leg['strike']} {leg['type']} @ {limit_price} (Role: {leg['role']})")
         
-        order_id = self.place_order(leg['key'], leg['qty'], leg['side'], "LIMIT", limit_price)
+        with latency_recorder.stage("order.place"):
+            order_id = self.place_order(leg['key'], leg['qty'], leg['side'], "LIMIT", limit_price)
         if not order_id:
             return None
         
         start = time.time()
-        last_status = None
+        status = self.wait_for_order(order_id, ProductionConfig.ORDER_TIMEOUT)
         
-        while (time.time() - start) < ProductionConfig.ORDER_TIMEOUT:
-            status = self.get_order_status(order_id)
-            
-            if not status:
-                time.sleep(0.2)
-                continue
-            
-            # Log status changes
-            if status['status'] != last_status:
-                logger.debug(f"Order {order_id}: {status['status']}")
-                last_status = status['status']
-            
+        if status:
             if status['status'] == 'complete':
                 # Apply stricter fill tolerance for hedges
                 fill_threshold = ProductionConfig.HEDGE_FILL_TOLERANCE if leg['role'] == 'HEDGE' else ProductionConfig.PARTIAL_FILL_TOLERANCE
@@ -2136,6 +4017,7 @@ class ExecutionEngine:
                 leg['entry_price'] = actual_price
                 leg['filled_qty'] = status['filled_qty']
                 leg['slippage'] = slippage
+                latency_recorder.record("order.fill", (time.time() - start) * 1000)
                 
                 db_writer.log_order(order_id, leg['key'], leg['side'], leg['qty'], limit_price, "FILLED", 
                                    filled_qty=status['filled_qty'], avg_price=actual_price)
@@ -2147,8 +4029,6 @@ class ExecutionEngine:
                 logger.error(f"ORDER DEAD: {status['status']}")
                 db_writer.log_order(order_id, leg['key'], leg['side'], leg['qty'], limit_price, status['status'].upper())
                 return None
-            
-            time.sleep(0.2)
         
         # Timeout - attempt cancellation
         logger.warning(f"TIMEOUT on {order_id}. Attempting cancel...")
@@ -2166,15 +4046,13 @@ class ExecutionEngine:
         db_writer.log_order(order_id, leg['key'], leg['side'], leg['qty'], limit_price, "TIMEOUT")
         return None
     
-    def execute_strategy(self, legs: List[Dict]) -> List[Dict]:
-        """Execute strategy with production-grade validation"""
-        
+    @staticmethod
+    def pretrade_violation(legs: List[Dict]) -> Optional[str]:
+        """Position size and max-loss limits every entry must pass (shared with the backtest replay); None when clear"""
         # Validate total position size
         total_qty = sum(l['qty'] for l in legs)
         if total_qty > ProductionConfig.MAX_CONTRACTS_PER_INSTRUMENT:
-            logger.critical(f"Position size {total_qty} exceeds limit {ProductionConfig.MAX_CONTRACTS_PER_INSTRUMENT}")
-            telegram.send(f"Position size violation: {total_qty} contracts", "ERROR")
-            return []
+            return f"Position size {total_qty} exceeds limit {ProductionConfig.MAX_CONTRACTS_PER_INSTRUMENT}"
         
         # Validate max loss per trade
         if len(legs) >= 4:  # Spread strategy
@@ -2184,14 +4062,23 @@ class ExecutionEngine:
             max_loss = (max_spread_width - premium) * legs[0]['qty']
             
             if max_loss > ProductionConfig.MAX_LOSS_PER_TRADE:
-                logger.critical(f"Max loss ₹{max_loss:,.0f} exceeds limit ₹{ProductionConfig.MAX_LOSS_PER_TRADE:,.0f}")
-                telegram.send(f"Max loss violation: ₹{max_loss:,.0f}", "ERROR")
-                return []
+                return f"Max loss ₹{max_loss:,.0f} exceeds limit ₹{ProductionConfig.MAX_LOSS_PER_TRADE:,.0f}"
+        return None
+    
+    def execute_strategy(self, legs: List[Dict]) -> List[Dict]:
+        """Execute strategy with production-grade validation"""
+        
+        violation = self.pretrade_violation(legs)
+        if violation:
+            logger.critical(violation)
+            telegram.send(f"Pre-trade limit violation: {violation}", "ERROR")
+            return []
         
         # Pre-flight checks (skip margin check in dry run)
         if not ProductionConfig.DRY_RUN_MODE:
-            required_margin = self.check_margin_requirement(legs)
-            available_funds = self.get_funds()
+            with latency_recorder.stage("execution.margin_check"):
+                required_margin = self.check_margin_requirement(legs)
+                available_funds = self.get_funds()
             
             # Apply margin buffer
             usable_funds = available_funds * (1 - ProductionConfig.MARGIN_BUFFER)
@@ -2203,7 +4090,8 @@ class ExecutionEngine:
             
             # Brokerage impact check
             projected_premium = sum(l['ltp'] * l['qty'] for l in legs if l['side'] == 'SELL')
-            brokerage_cost = self.get_brokerage_impact(legs)
+            with latency_recorder.stage("execution.brokerage_check"):
+                brokerage_cost = self.get_brokerage_impact(legs)
             
             if projected_premium > 0 and (projected_premium - brokerage_cost) < (projected_premium * 0.05):
                 logger.critical(f"BROKERAGE TOO HIGH: Cost=₹{brokerage_cost:.2f}, Premium=₹{projected_premium:.2f}")
@@ -2298,72 +4186,547 @@ class ExecutionEngine:
         
         return executed
     
-    def _flatten_legs(self, legs: List[Dict]):
-        """Emergency flatten with production-grade retry logic"""
-        if not legs:
+    def _flatten_legs(self, legs: List[Dict]):
+        """Emergency flatten with production-grade retry logic"""
+        if not legs:
+            return
+        
+        logger.critical(f"🚨 EMERGENCY FLATTEN: {len(legs)} legs")
+        telegram.send(f"Emergency flattening {len(legs)} legs", "CRITICAL")
+        
+        for leg in legs:
+            if leg.get('filled_qty', 0) <= 0:
+                continue
+            
+            exit_side = 'SELL' if leg['side'] == 'BUY' else 'BUY'
+            
+            # Try multiple strategies for exit
+            success = False
+            
+            # Strategy 1: Market order (fastest)
+            for attempt in range(2):
+                try:
+                    oid = self.place_order(leg['key'], leg['filled_qty'], exit_side, "MARKET", 0.0)
+                    if oid:
+                        time.sleep(1)
+                        status = self.get_order_status(oid)
+                        if status and status['status'] == 'complete':
+                            logger.info(f"✅ Market exit: {leg['key']}")
+                            success = True
+                            break
+                except Exception as e:
+                    logger.error(f"Market exit failed: {e}")
+            
+            if success:
+                continue
+            
+            # Strategy 2: Aggressive limit order
+            for attempt in range(3):
+                try:
+                    exit_price = leg.get('current_ltp', leg['entry_price'])
+                    # Aggressive pricing
+                    exit_price = exit_price * 1.10 if exit_side == 'BUY' else exit_price * 0.90
+                    
+                    oid = self.place_order(leg['key'], leg['filled_qty'], exit_side, "LIMIT", round(exit_price, 1))
+                    if oid:
+                        time.sleep(2)
+                        status = self.get_order_status(oid)
+                        if status and status['status'] == 'complete':
+                            logger.info(f"✅ Limit exit: {leg['key']}")
+                            success = True
+                            break
+                        elif status and status['status'] != 'complete':
+                            self.cancel_order(oid)
+                except Exception as e:
+                    logger.error(f"Limit exit attempt {attempt+1} failed: {e}")
+                
+                time.sleep(1)
+            
+            if not success:
+                msg = f"❌ CRITICAL: FAILED TO CLOSE {leg['key']} - MANUAL INTERVENTION REQUIRED"
+                logger.critical(msg)
+                telegram.send(msg, "CRITICAL")
+                db_writer.log_risk_event("FAILED_EXIT", "CRITICAL", f"Could not close {leg['key']}", "MANUAL_ACTION_REQUIRED")
+
+# ==========================================
+# MARKET DATA BUS (SHARED WEBSOCKET)
+# ==========================================
+@dataclass
+class LiveQuote:
+    last_price: float
+    received_at: float
+
+
+class MarketDataConsumer:
+    """One consumer's side of the bus: a conflating queue (latest quote per instrument since the last drain) and
+    the latest quote per subscribed instrument. on_update runs on the socket thread after every delivery (with {}
+    when the socket drops), so it must stay cheap."""
+    
+    def __init__(self, bus: 'MarketDataBus', name: str, on_update=None):
+        self.bus = bus
+        self.name = name
+        self.on_update = on_update
+        self.keys: List[str] = []
+        self.quotes: Dict[str, LiveQuote] = {}
+        self.pending: Dict[str, LiveQuote] = {}
+        self.lock = threading.Lock()
+    
+    @property
+    def connected(self) -> bool:
+        return self.bus.connected
+    
+    def subscribe(self, keys: List[str]):
+        self.bus._subscribe(self, keys)
+    
+    def unsubscribe(self, keys: List[str]):
+        self.bus._unsubscribe(self, keys)
+    
+    def close(self):
+        self.bus._unregister(self)
+    
+    def drain(self) -> Dict[str, LiveQuote]:
+        """Quotes that arrived since the previous drain (latest per instrument)"""
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        return pending
+    
+    def snapshot(self) -> Dict[str, LiveQuote]:
+        with self.lock:
+            return dict(self.quotes)
+    
+    def _deliver(self, quotes: Dict[str, LiveQuote]):
+        """Socket thread: overwrite rather than append, so a slow consumer only ever skips to the latest price"""
+        with self.lock:
+            self.quotes.update(quotes)
+            self.pending.update(quotes)
+        if self.on_update:
+            self.on_update(quotes)
+    
+    def _forget(self, keys: List[str]):
+        with self.lock:
+            for key in keys:
+                self.quotes.pop(key, None)
+                self.pending.pop(key, None)
+
+
+class MarketDataBus:
+    """One MarketDataStreamerV3 connection (ltpc mode) shared by every consumer in the process.
+    Instrument subscriptions are ref-counted across consumers: sent on the first reference, dropped on the last,
+    and the socket is closed when nothing is subscribed. Each tick is fanned out only to the consumers holding
+    that instrument, through their own conflating queue; consumer callbacks run on the socket thread."""
+    
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.api_client = None
+        self.streamer = None
+        self.connected = False
+        self.refs: Dict[str, int] = {}
+        self.consumers: Dict[str, MarketDataConsumer] = {}
+        self.routes: Dict[str, Tuple[MarketDataConsumer, ...]] = {}
+    
+    def consumer(self, name: str, api_client: upstox_client.ApiClient, on_update=None) -> MarketDataConsumer:
+        """Register a named consumer (risk, dashboard, paper, ...); the first one supplies the API client"""
+        with self.lock:
+            if name in self.consumers:
+                raise ValueError(f"Market data consumer '{name}' is already registered")
+            if self.api_client is None:
+                self.api_client = api_client
+            consumer = self.consumers[name] = MarketDataConsumer(self, name, on_update)
+            return consumer
+    
+    def _subscribe(self, consumer: MarketDataConsumer, keys: List[str]):
+        with self.lock:
+            new = [k for k in dict.fromkeys(keys) if k not in consumer.keys]
+            if not new:
+                return
+            consumer.keys = consumer.keys + new
+            first = []
+            for key in new:
+                self.refs[key] = self.refs.get(key, 0) + 1
+                if self.refs[key] == 1:
+                    first.append(key)
+            self._reroute()
+            if self.streamer is None:
+                # Also retries a connection that failed to start
+                self._connect(list(self.refs))
+                return
+            if not first:
+                return
+            try:
+                if self.connected:
+                    self.streamer.subscribe(first, "ltpc")
+                else:
+                    self.streamer.subscriptions["ltpc"].update(first)
+            except Exception as e:
+                logger.error(f"Market data subscribe failed for {first}: {e}")
+    
+    def _unsubscribe(self, consumer: MarketDataConsumer, keys: List[str]):
+        with self.lock:
+            gone = [k for k in dict.fromkeys(keys) if k in consumer.keys]
+            if not gone:
+                return
+            consumer.keys = [k for k in consumer.keys if k not in gone]
+            consumer._forget(gone)
+            last = []
+            for key in gone:
+                self.refs[key] -= 1
+                if not self.refs[key]:
+                    del self.refs[key]
+                    last.append(key)
+            self._reroute()
+            if not self.refs:
+                self._disconnect()
+                return
+            if last and self.streamer is not None:
+                try:
+                    if self.connected:
+                        self.streamer.unsubscribe(last)
+                    else:
+                        self.streamer.subscriptions["ltpc"].difference_update(last)
+                except Exception as e:
+                    logger.error(f"Market data unsubscribe failed for {last}: {e}")
+    
+    def _unregister(self, consumer: MarketDataConsumer):
+        with self.lock:
+            self._unsubscribe(consumer, consumer.keys)
+            self.consumers.pop(consumer.name, None)
+    
+    def _reroute(self):
+        """Rebuild the key -> consumers map; replaced whole so the socket thread reads it without the lock"""
+        routes: Dict[str, List[MarketDataConsumer]] = {}
+        for consumer in self.consumers.values():
+            for key in consumer.keys:
+                routes.setdefault(key, []).append(consumer)
+        self.routes = {key: tuple(consumers) for key, consumers in routes.items()}
+    
+    def _connect(self, keys: List[str]):
+        try:
+            # Handlers are bound to this streamer so a late event from a replaced one cannot touch the current state
+            self.streamer = streamer = upstox_client.MarketDataStreamerV3(self.api_client, keys, "ltpc")
+            streamer.on("message", lambda message: self._on_message(streamer, message))
+            streamer.on("open", lambda *args: self._on_open(streamer))
+            streamer.on("error", lambda error: self._on_error(streamer, error))
+            streamer.on("close", lambda *args: self._on_close(streamer))
+            streamer.auto_reconnect(True, ProductionConfig.WEBSOCKET_RECONNECT_DELAY, 10)
+            
+            threading.Thread(target=streamer.connect, daemon=True, name="Market-WS").start()
+        except Exception as e:
+            logger.error(f"Failed to start market data stream: {e}")
+            self.streamer = None
+    
+    def _disconnect(self):
+        streamer, self.streamer = self.streamer, None
+        self.connected = False
+        if streamer is None:
+            return
+        try:
+            streamer.disconnect()
+        except Exception as e:
+            logger.debug(f"Market data stream disconnect: {e}")
+        logger.info("Market Data Stream closed - no subscriptions left")
+    
+    @staticmethod
+    def ltps_in(message) -> Dict[str, float]:
+        """LTP per instrument in a decoded feed message: ltpc mode, or the ltpc inside a full market/index feed"""
+        feeds = message.get('feeds') if isinstance(message, dict) else None
+        ltps = {}
+        for key, feed in (feeds or {}).items():
+            ltpc = feed.get('ltpc')
+            if ltpc is None:
+                full = feed.get('fullFeed') or {}
+                ltpc = (full.get('marketFF') or full.get('indexFF') or {}).get('ltpc')
+            if ltpc and ltpc.get('ltp'):
+                ltps[key] = float(ltpc['ltp'])
+        return ltps
+    
+    def _on_message(self, streamer, message):
+        if streamer is not self.streamer:
             return
-        
-        logger.critical(f"🚨 EMERGENCY FLATTEN: {len(legs)} legs")
-        telegram.send(f"Emergency flattening {len(legs)} legs", "CRITICAL")
-        
-        for leg in legs:
-            if leg.get('filled_qty', 0) <= 0:
+        ltps = self.ltps_in(message)
+        if not ltps:
+            return
+        received_at = time.time()
+        routes = self.routes
+        batches: Dict[MarketDataConsumer, Dict[str, LiveQuote]] = {}
+        for key, ltp in ltps.items():
+            consumers = routes.get(key)
+            if not consumers:
                 continue
+            quote = LiveQuote(ltp, received_at)
+            for consumer in consumers:
+                batches.setdefault(consumer, {})[key] = quote
+        for consumer, quotes in batches.items():
+            try:
+                consumer._deliver(quotes)
+            except Exception as e:
+                logger.error(f"Market data consumer '{consumer.name}' failed: {e}")
+    
+    def _wake_consumers(self):
+        for consumer in list(self.consumers.values()):
+            if consumer.on_update:
+                consumer.on_update({})
+    
+    def _on_open(self, streamer):
+        if streamer is not self.streamer:
+            return
+        self.connected = True
+        logger.info(f"✅ Market Data Stream Connected ({len(self.refs)} instruments, {len(self.consumers)} consumers)")
+    
+    def _on_error(self, streamer, error):
+        if streamer is not self.streamer:
+            return
+        self.connected = False
+        logger.error(f"Market Data Stream Error: {error}")
+        self._wake_consumers()
+    
+    def _on_close(self, streamer):
+        if streamer is not self.streamer:
+            return
+        self.connected = False
+        logger.warning("Market Data Stream Closed")
+        self._wake_consumers()
+
+market_data_bus = MarketDataBus()
+
+# ==========================================
+# POSITION BOOK (COLUMNAR)
+# ==========================================
+class PositionBook:
+    """Open legs of every monitored trade as aligned arrays, indexed by instrument key.
+    mark() writes a batch of LTPs; leg and trade P&L and the exit rules are then whole-array expressions,
+    so a tick costs the same however many legs and trades are held."""
+    
+    EXIT_REASONS = np.array([None, "STOP_LOSS_MAX_RISK", "STOP_LOSS_PREMIUM", "TARGET_PROFIT"], dtype=object)
+    
+    def __init__(self):
+        self.keys: List[str] = []
+        self.rows: Dict[str, np.ndarray] = {}
+        self.qty = np.empty(0)
+        self.sign = np.empty(0)
+        self.entry = np.empty(0)
+        self.last = np.empty(0)
+        self.strike = np.empty(0)
+        self.is_call = np.empty(0, dtype=bool)
+        self.trade = np.empty(0, dtype=np.intp)
+        
+        self.trade_ids: List[str] = []
+        self.expiries: List[Optional[date]] = []
+        self.net_premium = np.empty(0)
+        self.max_loss = np.empty(0)
+    
+    def __len__(self) -> int:
+        return len(self.trade_ids)
+    
+    def add(self, trade_id: str, legs: List[Dict], net_premium: float, max_spread_loss: float, expiry: Optional[date] = None):
+        """Append a trade's filled legs; last price starts at entry until the first mark"""
+        if trade_id in self.trade_ids:
+            raise ValueError(f"Trade {trade_id} is already in the book")
+        entry = np.array([l['entry_price'] for l in legs], dtype=np.float64)
+        self.keys = self.keys + [l['key'] for l in legs]
+        self.qty = np.concatenate([self.qty, [l['filled_qty'] for l in legs]])
+        self.sign = np.concatenate([self.sign, [-1.0 if l['side'] == 'SELL' else 1.0 for l in legs]])
+        self.entry = np.concatenate([self.entry, entry])
+        self.last = np.concatenate([self.last, entry])
+        self.strike = np.concatenate([self.strike, [l['strike'] for l in legs]])
+        self.is_call = np.concatenate([self.is_call, [l['type'] == 'CE' for l in legs]])
+        self.trade = np.concatenate([self.trade, np.full(len(legs), len(self.trade_ids), dtype=np.intp)])
+        
+        self.trade_ids = self.trade_ids + [trade_id]
+        self.expiries = self.expiries + [expiry]
+        self.net_premium = np.append(self.net_premium, net_premium)
+        self.max_loss = np.append(self.max_loss, max_spread_loss)
+        self._reindex()
+    
+    def remove(self, trade_id: str):
+        code = self.trade_ids.index(trade_id)
+        keep = self.trade != code
+        self.keys = [k for k, kept in zip(self.keys, keep) if kept]
+        for name in ('qty', 'sign', 'entry', 'last', 'strike', 'is_call'):
+            setattr(self, name, getattr(self, name)[keep])
+        self.trade = self.trade[keep]
+        self.trade[self.trade > code] -= 1
+        
+        self.trade_ids = self.trade_ids[:code] + self.trade_ids[code + 1:]
+        self.expiries = self.expiries[:code] + self.expiries[code + 1:]
+        self.net_premium = np.delete(self.net_premium, code)
+        self.max_loss = np.delete(self.max_loss, code)
+        self._reindex()
+    
+    def _reindex(self):
+        rows: Dict[str, List[int]] = {}
+        for i, key in enumerate(self.keys):
+            rows.setdefault(key, []).append(i)
+        self.rows = {key: np.array(idx, dtype=np.intp) for key, idx in rows.items()}
+    
+    def legs_of(self, trade_id: str) -> np.ndarray:
+        """Row indices of a trade's legs, in the order they were added"""
+        return np.flatnonzero(self.trade == self.trade_ids.index(trade_id))
+    
+    def mark(self, prices):
+        """Write LTPs from a key -> price mapping (floats, or objects with last_price); unknown keys are ignored"""
+        for key, quote in prices.items():
+            rows = self.rows.get(key)
+            if rows is None:
+                continue
+            price = getattr(quote, 'last_price', quote)
+            if price:
+                self.last[rows] = price
+    
+    def leg_pnl(self) -> np.ndarray:
+        return self.sign * (self.last - self.entry) * self.qty
+    
+    def trade_pnl(self) -> np.ndarray:
+        return np.bincount(self.trade, weights=self.leg_pnl(), minlength=len(self.trade_ids))
+    
+    @staticmethod
+    def exit_codes(pnl: np.ndarray, net_premium: np.ndarray, max_loss: np.ndarray) -> np.ndarray:
+        """Index into EXIT_REASONS of the first P&L rule each trade breaches, in monitor order (0 keeps holding)"""
+        credit = net_premium > 0
+        return np.select(
+            [(max_loss > 0) & (pnl < -(max_loss * 0.80)),
+             credit & (pnl < -(net_premium * ProductionConfig.STOP_LOSS_PCT)),
+             credit & (pnl >= net_premium * ProductionConfig.TARGET_PROFIT_PCT)],
+            [1, 2, 3], default=0
+        )
+    
+    def exits(self, trade_pnl: Optional[np.ndarray] = None) -> Dict[str, str]:
+        """trade_id -> exit reason for every trade that breached a rule"""
+        pnl = self.trade_pnl() if trade_pnl is None else trade_pnl
+        codes = self.exit_codes(pnl, self.net_premium, self.max_loss)
+        return {self.trade_ids[i]: self.EXIT_REASONS[codes[i]] for i in np.flatnonzero(codes)}
+    
+    def snapshot(self) -> 'PositionBook':
+        """Copy for another thread to read while this one keeps marking (add/remove replace arrays, mark writes last in place)"""
+        book = PositionBook.__new__(PositionBook)
+        book.__dict__.update(self.__dict__)
+        book.last = self.last.copy()
+        return book
+    
+    def stamp(self, trade_id: str, legs: List[Dict]):
+        """Copy the book's last prices back onto the trade's leg dicts as current_ltp (exit pricing reads it)"""
+        for leg, ltp in zip(legs, self.last[self.legs_of(trade_id)]):
+            leg['current_ltp'] = float(ltp)
+
+# ==========================================
+# PORTFOLIO GREEKS (DASHBOARD SNAPSHOTS)
+# ==========================================
+class GreeksAggregator:
+    """Net greeks and P&L of every open trade, published to live_portfolio on its own timer.
+    The risk thread only hands over a PositionBook snapshot; pricing, vendor calls and the DB write happen here."""
+    
+    GREEKS = ('delta', 'theta', 'gamma', 'vega')
+    
+    def __init__(self, api_client: upstox_client.ApiClient):
+        self.api_client = api_client
+        self.lock = threading.Lock()
+        self.latest = None
+        self.vendor: Dict[str, np.ndarray] = {}
+        self.vendor_requested = set()
+        self.vendor_at = 0.0
+    
+    def start(self) -> threading.Event:
+        """Start a publisher thread; setting the returned event stops it"""
+        stop_event = threading.Event()
+        threading.Thread(target=self._run, args=(stop_event,), daemon=True, name="Greeks").start()
+        return stop_event
+    
+    def update(self, book: 'PositionBook', spot: Optional[float]):
+        """Latest state from the risk thread (a snapshot it no longer writes to); only the newest is published"""
+        with self.lock:
+            self.latest = (book, spot)
+    
+    def _run(self, stop_event: threading.Event):
+        while not stop_event.wait(ProductionConfig.DASHBOARD_REFRESH_RATE):
+            with self.lock:
+                latest, self.latest = self.latest, None
+            if latest is not None:
+                self.publish(*latest)
+    
+    def local_greeks(self, book: 'PositionBook', spot: Optional[float]) -> Optional[Dict[str, np.ndarray]]:
+        """Per-leg greeks priced from the live leg and spot LTPs; None when spot has no price yet"""
+        if not spot:
+            return None
+        
+        t = np.array([OptionPricer.time_to_expiry(expiry or date.today()) for expiry in book.expiries])[book.trade]
+        vol = OptionPricer.implied_vol(book.last, spot, book.strike, t, book.is_call)
+        greeks = OptionPricer.greeks(spot, book.strike, t, vol, book.is_call)
+        return {name: np.nan_to_num(values) for name, values in greeks.items()}
+    
+    def vendor_greeks(self, keys: List[str]) -> Optional[Dict[str, np.ndarray]]:
+        """Per-leg option greek quotes, requested every GREEKS_VENDOR_REFRESH (or for a new instrument);
+        the last good quote is kept when a refresh fails"""
+        if time.time() - self.vendor_at >= ProductionConfig.GREEKS_VENDOR_REFRESH or not self.vendor_requested.issuperset(keys):
+            self.vendor_at = time.time()
+            unique = list(dict.fromkeys(keys))
+            self.vendor_requested = set(unique)
             
-            exit_side = 'SELL' if leg['side'] == 'BUY' else 'BUY'
-            
-            # Try multiple strategies for exit
-            success = False
-            
-            # Strategy 1: Market order (fastest)
-            for attempt in range(2):
-                try:
-                    oid = self.place_order(leg['key'], leg['filled_qty'], exit_side, "MARKET", 0.0)
-                    if oid:
-                        time.sleep(1)
-                        status = self.get_order_status(oid)
-                        if status and status['status'] == 'complete':
-                            logger.info(f"✅ Market exit: {leg['key']}")
-                            success = True
-                            break
-                except Exception as e:
-                    logger.error(f"Market exit failed: {e}")
+            market_api = upstox_client.MarketQuoteV3Api(self.api_client)
+            greek_response = market_api.get_market_quote_option_greek(instrument_key=','.join(unique))
             
-            if success:
-                continue
+            if greek_response.status == 'success':
+                for key in unique:
+                    greek_data = greek_response.data.get(key)
+                    if greek_data and hasattr(greek_data, 'delta'):
+                        self.vendor[key] = np.array([getattr(greek_data, name, 0) or 0 for name in self.GREEKS], dtype=np.float64)
+        
+        if not any(key in self.vendor for key in keys):
+            return None
+        rows = np.array([self.vendor.get(key, np.zeros(len(self.GREEKS))) for key in keys])
+        return {name: rows[:, i] for i, name in enumerate(self.GREEKS)}
+    
+    @staticmethod
+    def _summary(pnl: float, net_premium: float, max_loss: float, net: Dict[str, float], dte: int) -> Dict:
+        return {
+            "pnl": round(pnl, 2),
+            "pnl_pct": round((pnl / net_premium * 100) if net_premium > 0 else 0, 1),
+            "net_delta": round(net['delta'], 2),
+            "net_theta": round(net['theta'], 2),
+            "net_gamma": round(net['gamma'], 5),
+            "net_vega": round(net['vega'], 2),
+            "net_premium": round(net_premium, 2),
+            "max_loss": round(max_loss, 2),
+            "dte": dte
+        }
+    
+    def publish(self, book: 'PositionBook', spot: Optional[float]):
+        """Update system state with live Greeks and P&L: portfolio totals at the top level, one entry per trade under 'trades'"""
+        try:
+            if not len(book):
+                return
+            greeks = None
+            if ProductionConfig.GREEKS_SOURCE == "LOCAL":
+                greeks = self.local_greeks(book, spot)
+            if greeks is None:
+                greeks = self.vendor_greeks(book.keys)
+            if greeks is None:
+                return
             
-            # Strategy 2: Aggressive limit order
-            for attempt in range(3):
-                try:
-                    exit_price = leg.get('current_ltp', leg['entry_price'])
-                    # Aggressive pricing
-                    exit_price = exit_price * 1.10 if exit_side == 'BUY' else exit_price * 0.90
-                    
-                    oid = self.place_order(leg['key'], leg['filled_qty'], exit_side, "LIMIT", round(exit_price, 1))
-                    if oid:
-                        time.sleep(2)
-                        status = self.get_order_status(oid)
-                        if status and status['status'] == 'complete':
-                            logger.info(f"✅ Limit exit: {leg['key']}")
-                            success = True
-                            break
-                        elif status and status['status'] != 'complete':
-                            self.cancel_order(oid)
-                except Exception as e:
-                    logger.error(f"Limit exit attempt {attempt+1} failed: {e}")
-                
-                time.sleep(1)
+            exposure = book.sign * book.qty
+            net = {name: np.bincount(book.trade, weights=greeks[name] * exposure, minlength=len(book)) for name in self.GREEKS}
+            pnl = book.trade_pnl()
+            dte = [(expiry - date.today()).days if expiry else 0 for expiry in book.expiries]
+            trades = [
+                {"trade_id": trade_id, **self._summary(float(pnl[i]), float(book.net_premium[i]), float(book.max_loss[i]),
+                                                      {name: float(values[i]) for name, values in net.items()}, dte[i])}
+                for i, trade_id in enumerate(book.trade_ids)
+            ]
             
-            if not success:
-                msg = f"❌ CRITICAL: FAILED TO CLOSE {leg['key']} - MANUAL INTERVENTION REQUIRED"
-                logger.critical(msg)
-                telegram.send(msg, "CRITICAL")
-                db_writer.log_risk_event("FAILED_EXIT", "CRITICAL", f"Could not close {leg['key']}", "MANUAL_ACTION_REQUIRED")
+            db_writer.set_state("live_portfolio", json.dumps({
+                "trade_id": ",".join(book.trade_ids),
+                **self._summary(float(pnl.sum()), float(book.net_premium.sum()), float(book.max_loss.sum()),
+                                {name: float(values.sum()) for name, values in net.items()}, min(dte)),
+                "trades": trades,
+                "updated_at": datetime.now().strftime("%H:%M:%S")
+            }))
+        except Exception as e:
+            logger.error(f"Dashboard update error: {e}")
 
 # ==========================================
 # RISK MANAGER (PRODUCTION HARDENED)
 # ==========================================
 class RiskManager:
+    """One open trade: its legs, limits and GTTs, and its exit sequence. RiskSupervisor does the monitoring."""
+    
     def __init__(self, api_client: upstox_client.ApiClient, legs: List[Dict], expiry_date: date, trade_id: str, gtt_ids: List[str] = None):
         self.api_client = api_client
         self.legs = legs
@@ -2371,14 +4734,18 @@ class RiskManager:
         self.trade_id = trade_id
         self.gtt_ids = gtt_ids or []
         self.running = True
-        self.last_price_update = time.time()
         
         # Calculate net premium and risk
         credit = sum(l['entry_price'] * l['filled_qty'] for l in legs if l['side'] == 'SELL')
         debit = sum(l['entry_price'] * l['filled_qty'] for l in legs if l['side'] == 'BUY')
         self.net_premium = credit - debit
+        self.max_spread_loss = self.max_spread_loss_for(legs, self.net_premium)
         
-        # Calculate max risk based on structure
+        logger.info(f"Risk Manager Init: Trade={trade_id} | Premium=₹{self.net_premium:.2f} | Max Loss=₹{self.max_spread_loss:.2f} | GTTs={len(self.gtt_ids)}")
+    
+    @staticmethod
+    def max_spread_loss_for(legs: List[Dict], net_premium: float) -> float:
+        """Max risk based on structure (shared with the backtest replay)"""
         structure = legs[0].get('structure', 'UNKNOWN')
         if structure == 'IRON_FLY':
             call_strikes = sorted([l['strike'] for l in legs if l['type'] == 'CE'])
@@ -2387,9 +4754,8 @@ class RiskManager:
                 call_width = (call_strikes[-1] - call_strikes[0])
                 put_width = (put_strikes[-1] - put_strikes[0])
                 max_spread = max(call_width, put_width)
-                self.max_spread_loss = (max_spread - self.net_premium) * legs[0]['filled_qty']
-            else:
-                self.max_spread_loss = self.net_premium * 3
+                return (max_spread - net_premium) * legs[0]['filled_qty']
+            return net_premium * 3
         elif structure == 'IRON_CONDOR':
             # Calculate max loss for condor
             call_legs = [l for l in legs if l['type'] == 'CE']
@@ -2399,185 +4765,18 @@ class RiskManager:
             put_width = max([l['strike'] for l in put_legs]) - min([l['strike'] for l in put_legs]) if put_legs else 0
             
             max_spread = max(call_width, put_width)
-            self.max_spread_loss = (max_spread - self.net_premium) * legs[0]['filled_qty'] if max_spread > 0 else self.net_premium * 2
-        else:
-            self.max_spread_loss = self.net_premium * 2
-        
-        logger.info(f"Risk Manager Init: Trade={trade_id} | Premium=₹{self.net_premium:.2f} | Max Loss=₹{self.max_spread_loss:.2f} | GTTs={len(self.gtt_ids)}")
-    
-    def monitor(self):
-        """Production-hardened monitoring loop"""
-        market_api = upstox_client.MarketQuoteV3Api(self.api_client)
-        consecutive_errors = 0
-        max_consecutive_errors = 10
-        
-        logger.info(f"🔍 Risk monitoring started for {self.trade_id}")
-        
-        while self.running:
-            try:
-                # DTE exit check
-                days_to_expiry = (self.expiry - date.today()).days
-                if days_to_expiry <= ProductionConfig.EXIT_DTE:
-                    logger.info(f"DTE exit trigger: {days_to_expiry} days remaining")
-                    self.flatten_all("DTE_EXIT")
-                    return
-                
-                # Get live prices with retry
-                keys = [l['key'] for l in self.legs]
-                price_response = None
-                
-                for attempt in range(3):
-                    try:
-                        price_response = market_api.get_ltp(instrument_key=','.join(keys))
-                        if price_response and price_response.status == 'success':
-                            break
-                    except Exception as e:
-                        logger.warning(f"Price fetch attempt {attempt+1} failed: {e}")
-                        time.sleep(0.5)
-                
-                if not price_response or price_response.status != 'success':
-                    consecutive_errors += 1
-                    if consecutive_errors >= max_consecutive_errors:
-                        logger.critical(f"Price feed failed {consecutive_errors} times - flattening for safety")
-                        self.flatten_all("PRICE_FEED_FAILURE")
-                        return
-                    time.sleep(ProductionConfig.POLL_INTERVAL)
-                    continue
-                
-                # Reset error counter on success
-                consecutive_errors = 0
-                prices = price_response.data
-                self.last_price_update = time.time()
-                
-                # Check for stale prices
-                if time.time() - self.last_price_update > ProductionConfig.PRICE_STALENESS_THRESHOLD:
-                    logger.warning("Price data is stale")
-                
-                # Calculate P&L
-                current_pnl = self._calculate_pnl(prices)
-                
-                # Update leg prices
-                for leg in self.legs:
-                    if leg['key'] in prices:
-                        price_data = prices[leg['key']]
-                        leg['current_ltp'] = getattr(price_data, 'last_price', leg['entry_price'])
-                
-                # Risk checks
-                if self.max_spread_loss > 0 and current_pnl < -(self.max_spread_loss * 0.80):
-                    logger.critical(f"Max risk breached: P&L={current_pnl:.2f}, Limit={self.max_spread_loss:.2f}")
-                    self.flatten_all("STOP_LOSS_MAX_RISK")
-                    return
-                
-                if self.net_premium > 0 and current_pnl < -(self.net_premium * ProductionConfig.STOP_LOSS_PCT):
-                    logger.critical(f"Stop loss hit: P&L={current_pnl:.2f}, Threshold={self.net_premium * ProductionConfig.STOP_LOSS_PCT:.2f}")
-                    self.flatten_all("STOP_LOSS_PREMIUM")
-                    return
-                
-                if self.net_premium > 0 and current_pnl >= (self.net_premium * ProductionConfig.TARGET_PROFIT_PCT):
-                    logger.info(f"Target profit reached: P&L={current_pnl:.2f}, Target={self.net_premium * ProductionConfig.TARGET_PROFIT_PCT:.2f}")
-                    self.flatten_all("TARGET_PROFIT")
-                    return
-                
-                # Update dashboard
-                self._update_dashboard_state(current_pnl)
-                
-                time.sleep(ProductionConfig.POLL_INTERVAL)
-                
-            except KeyboardInterrupt:
-                logger.info("Risk monitor interrupted by user")
-                self.running = False
-                return
-                
-            except Exception as e:
-                logger.error(f"Risk monitor error: {e}")
-                traceback.print_exc()
-                consecutive_errors += 1
-                if consecutive_errors >= max_consecutive_errors:
-                    logger.critical("Too many errors in risk monitor - emergency exit")
-                    self.flatten_all("MONITOR_ERROR")
-                    return
-                time.sleep(5)
+            return (max_spread - net_premium) * legs[0]['filled_qty'] if max_spread > 0 else net_premium * 2
+        return net_premium * 2
     
-    def _calculate_pnl(self, prices) -> float:
-        """Calculate current P&L with structure-aware logic"""
-        structure = self.legs[0].get('structure', 'UNKNOWN')
-        
-        if structure == 'IRON_FLY':
-            # For Iron Fly: net spread P&L
-            atm_calls = [l for l in self.legs if l['side'] == 'SELL' and l['type'] == 'CE']
-            atm_puts = [l for l in self.legs if l['side'] == 'SELL' and l['type'] == 'PE']
-            wings = [l for l in self.legs if l['side'] == 'BUY']
-            
-            pnl = 0.0
-            
-            for call in atm_calls:
-                ltp = getattr(prices.get(call['key']), 'last_price', call['entry_price'])
-                pnl += (call['entry_price'] - ltp) * call['filled_qty']
-            
-            for put in atm_puts:
-                ltp = getattr(prices.get(put['key']), 'last_price', put['entry_price'])
-                pnl += (put['entry_price'] - ltp) * put['filled_qty']
-            
-            for wing in wings:
-                ltp = getattr(prices.get(wing['key']), 'last_price', wing['entry_price'])
-                pnl += (ltp - wing['entry_price']) * wing['filled_qty']
-            
-            return pnl
-        
-        else:
-            # For other structures: aggregate leg P&L
-            pnl = 0.0
-            for leg in self.legs:
-                ltp = getattr(prices.get(leg['key']), 'last_price', leg['entry_price'])
-                leg_pnl = (leg['entry_price'] - ltp) * leg['filled_qty'] if leg['side'] == 'SELL' else (ltp - leg['entry_price']) * leg['filled_qty']
-                pnl += leg_pnl
-            return pnl
-    
-    def _update_dashboard_state(self, current_pnl: float):
-        """Update system state with live Greeks and P&L"""
-        try:
-            market_api = upstox_client.MarketQuoteV3Api(self.api_client)
-            keys = [l['key'] for l in self.legs]
-            
-            greek_response = market_api.get_market_quote_option_greek(instrument_key=','.join(keys))
-            
-            if greek_response.status != 'success':
-                return
-            
-            greeks = greek_response.data
-            
-            p_delta = p_theta = p_gamma = p_vega = 0.0
-            
-            for leg in self.legs:
-                direction = -1 if leg['side'] == 'SELL' else 1
-                
-                greek_data = greeks.get(leg['key'])
-                if greek_data and hasattr(greek_data, 'delta'):
-                    p_delta += (greek_data.delta * leg['filled_qty'] * direction)
-                    p_theta += (getattr(greek_data, 'theta', 0) * leg['filled_qty'] * direction)
-                    p_gamma += (getattr(greek_data, 'gamma', 0) * leg['filled_qty'] * direction)
-                    p_vega += (getattr(greek_data, 'vega', 0) * leg['filled_qty'] * direction)
-            
-            pnl_pct = (current_pnl / self.net_premium * 100) if self.net_premium > 0 else 0
-            
-            db_writer.set_state("live_portfolio", json.dumps({
-                "trade_id": self.trade_id,
-                "pnl": round(current_pnl, 2),
-                "pnl_pct": round(pnl_pct, 1),
-                "net_delta": round(p_delta, 2),
-                "net_theta": round(p_theta, 2),
-                "net_gamma": round(p_gamma, 5),
-                "net_vega": round(p_vega, 2),
-                "net_premium": round(self.net_premium, 2),
-                "max_loss": round(self.max_spread_loss, 2),
-                "dte": (self.expiry - date.today()).days,
-                "updated_at": datetime.now().strftime("%H:%M:%S")
-            }))
-        except Exception as e:
-            logger.error(f"Dashboard update error: {e}")
+    @staticmethod
+    def exit_reason(pnl: float, net_premium: float, max_spread_loss: float) -> Optional[str]:
+        """P&L exit rule that fires first, in monitor order; None to keep holding (PositionBook.exit_codes for one trade)"""
+        code = PositionBook.exit_codes(np.array([pnl]), np.array([net_premium]), np.array([max_spread_loss]))[0]
+        return PositionBook.EXIT_REASONS[code]
     
-    def flatten_all(self, reason="SIGNAL"):
-        """Production-hardened exit sequence"""
+    def flatten_all(self, reason="SIGNAL", atomic: bool = True, mark_pnl: Optional[float] = None) -> float:
+        """Production-hardened exit sequence; returns the final P&L.
+        With atomic=False (other trades still open) the legs are closed one by one and the final P&L is mark_pnl."""
         logger.critical(f"🚨 FLATTEN TRIGGERED: {reason}")
         telegram.send(f"🚨 Position Exit: {reason}", "CRITICAL")
         
@@ -2599,10 +4798,10 @@ class RiskManager:
             logger.info(f"Cancelled {gtt_cancelled_count}/{len(self.gtt_ids)} GTTs")
         
         # Step 2: Attempt atomic exit
-        executor = ExecutionEngine(self.api_client)
+        executor = ExecutionEngine.shared(self.api_client)
         atomic_success = False
         
-        for attempt in range(2):
+        for attempt in range(2 if atomic else 0):
             logger.info(f"Atomic exit attempt {attempt+1}...")
             if executor.exit_all_positions(tag="VG30"):
                 atomic_success = True
@@ -2611,16 +4810,23 @@ class RiskManager:
             time.sleep(2)
         
         # Step 3: Fallback to leg-by-leg if atomic failed
-        if not atomic_success:
+        if not atomic:
+            logger.info(f"Other trades open - closing {self.trade_id} leg by leg")
+            executor._flatten_legs(self.legs)
+        elif not atomic_success:
             logger.critical("Atomic exit failed - falling back to leg-by-leg")
             telegram.send("Atomic exit failed - manual closure initiated", "CRITICAL")
             executor._flatten_legs(self.legs)
         
-        # Step 4: Calculate final P&L
-        final_pnl = self._get_final_pnl()
+        # Step 4: Calculate final P&L (broker positions only describe this trade when nothing else is open)
+        if atomic or mark_pnl is None:
+            final_pnl = self._get_final_pnl(fallback=mark_pnl or 0.0)
+        else:
+            final_pnl = mark_pnl
         
         # Step 5: Update database
         db_writer.update_trade_exit(self.trade_id, reason, final_pnl)
+        db_writer.update_daily_stats(pnl=final_pnl, largest_win=max(final_pnl, 0.0), largest_loss=min(final_pnl, 0.0))
         db_writer.log_risk_event("POSITION_EXIT", "INFO", reason, f"P&L: ₹{final_pnl:.2f}")
         
         # Step 6: Record result with circuit breaker
@@ -2637,27 +4843,323 @@ class RiskManager:
         
         self.running = False
         logger.info(f"Risk monitor shutdown complete for {self.trade_id}")
+        return final_pnl
     
-    def _get_final_pnl(self) -> float:
-        """Get final P&L from positions"""
+    def _get_final_pnl(self, fallback: float = 0.0) -> float:
+        """Final P&L from the day's broker positions in this trade's instruments only (the day's other trades are
+        already realized); fallback, the last marked P&L, when positions cannot be read"""
         try:
             portfolio_api = PortfolioApi(self.api_client)
             response = portfolio_api.get_positions()
             
-            if response.status != 'success' or not response.data:
-                logger.warning("Could not fetch final positions - using last known P&L")
-                return 0.0
+            if response.status != 'success' or not response.data:
+                logger.warning("Could not fetch final positions - using last known P&L")
+                return fallback
+            
+            keys = {leg['key'] for leg in self.legs}
+            total_pnl = 0.0
+            for position in response.data:
+                if getattr(position, 'instrument_token', None) in keys and hasattr(position, 'pnl'):
+                    total_pnl += float(position.pnl)
+            
+            return total_pnl
+            
+        except Exception as e:
+            logger.error(f"Error getting final P&L: {e}")
+            return fallback
+
+# ==========================================
+# RISK SUPERVISOR (ALL OPEN TRADES)
+# ==========================================
+class RiskSupervisor:
+    """Monitors every open trade from one thread on the "risk" market data bus consumer.
+    Each pass marks the shared PositionBook once and applies the per-trade exit rules and the portfolio daily
+    loss limit to all trades together; a trade that breaches leaves the book and is flattened on its own."""
+    
+    def __init__(self, api_client: upstox_client.ApiClient):
+        self.api_client = api_client
+        self.trades: Dict[str, RiskManager] = {}
+        self.book = PositionBook()
+        self.greeks = GreeksAggregator(api_client)
+        self.lock = threading.RLock()
+        self.ticked = threading.Event()
+        self.feed: Optional[MarketDataConsumer] = None
+        self.running = False
+        self.spot = None
+        self.last_price_update = 0.0
+        self.last_handoff = 0.0
+        self.realized = self._realized_today()
+        self.realized_day = date.today()
+        self.flattening = 0
+    
+    @property
+    def open_trades(self) -> int:
+        return len(self.trades)
+    
+    @staticmethod
+    def _realized_today() -> float:
+        """P&L of trades already closed today, so a restart does not reset the portfolio loss limit"""
+        stats = db_writer.get_daily_stats()
+        return float(stats['total_pnl'] or 0.0) if stats else 0.0
+    
+    def open_expiries(self) -> set:
+        with self.lock:
+            return {trade.expiry for trade in self.trades.values()}
+    
+    def add(self, trade: RiskManager):
+        """Start monitoring a filled trade; the monitor thread is started on the first one"""
+        with self.lock:
+            self.trades[trade.trade_id] = trade
+            self.book.add(trade.trade_id, trade.legs, trade.net_premium, trade.max_spread_loss, trade.expiry)
+            self._resubscribe()
+            if not self.running:
+                self.running = True
+                threading.Thread(target=self._run, daemon=True, name="Risk-Supervisor").start()
+        self.ticked.set()
+        logger.info(f"🔍 Risk monitoring started for {trade.trade_id} ({len(self.trades)} open trade(s))")
+    
+    def flatten_all(self, reason: str = "SIGNAL"):
+        """Flatten every open trade in the calling thread (shutdown path)"""
+        with self.lock:
+            trade_ids = list(self.trades)
+        for trade_id in trade_ids:
+            self._close(trade_id, reason, wait=True)
+    
+    def _price_keys(self) -> List[str]:
+        """Every instrument in the book, plus spot when greeks are priced locally; caller holds the lock"""
+        keys = list(self.book.rows)
+        if keys and ProductionConfig.GREEKS_SOURCE == "LOCAL":
+            keys.append(ProductionConfig.NIFTY_KEY)
+        return keys
+    
+    def _resubscribe(self):
+        """Keep the bus subscription equal to the book (empty once flat, which lets the bus close the socket); caller holds the lock"""
+        if ProductionConfig.RISK_PRICE_SOURCE != "STREAM":
+            return
+        if self.feed is None:
+            self.feed = market_data_bus.consumer("risk", self.api_client, on_update=lambda quotes: self.ticked.set())
+        keys = self._price_keys()
+        self.feed.unsubscribe([k for k in self.feed.keys if k not in keys])
+        self.feed.subscribe(keys)
+    
+    def _keep_running(self) -> bool:
+        """False once no trade is left; the decision is taken under the lock so add() never races a retiring thread"""
+        with self.lock:
+            if not self.trades:
+                self.running = False
+            return self.running
+    
+    def _fetch_ltp(self, market_api, keys: List[str]):
+        """REST LTPs with retry; None when every attempt failed"""
+        for attempt in range(3):
+            try:
+                price_response = market_api.get_ltp(instrument_key=','.join(keys))
+                if price_response and price_response.status == 'success':
+                    return price_response.data
+            except Exception as e:
+                logger.warning(f"Price fetch attempt {attempt+1} failed: {e}")
+                time.sleep(0.5)
+        return None
+    
+    def _dte_exits(self):
+        with self.lock:
+            due = [(trade_id, (trade.expiry - date.today()).days) for trade_id, trade in self.trades.items()
+                   if (trade.expiry - date.today()).days <= ProductionConfig.EXIT_DTE]
+        for trade_id, days_to_expiry in due:
+            logger.info(f"DTE exit trigger for {trade_id}: {days_to_expiry} days remaining")
+            self._close(trade_id, "DTE_EXIT")
+    
+    def _evaluate(self, prices, started: float):
+        """Mark the book and apply every trade's exit rules plus the portfolio loss limit in one pass"""
+        with self.lock:
+            self.book.mark(prices)
+            spot = prices.get(ProductionConfig.NIFTY_KEY)
+            if spot is not None:
+                self.spot = getattr(spot, 'last_price', self.spot)
+            self.last_price_update = started
+            
+            pnl = self.book.trade_pnl()
+            exits = self.book.exits(pnl)
+            if date.today() != self.realized_day:
+                self.realized, self.realized_day = self._realized_today(), date.today()
+            portfolio_pnl = self.realized + float(pnl.sum())
+            # Same boundary as circuit_breaker.check_daily_loss_limit
+            loss_limit_hit = portfolio_pnl <= -(ProductionConfig.BASE_CAPITAL * ProductionConfig.DAILY_LOSS_LIMIT)
+            if loss_limit_hit:
+                exits = dict.fromkeys(self.book.trade_ids, "DAILY_LOSS_LIMIT")
+            closing = [(trade_id, reason, self.trades[trade_id], float(pnl[self.book.trade_ids.index(trade_id)]))
+                       for trade_id, reason in exits.items()]
+            
+            if started - self.last_handoff >= ProductionConfig.DASHBOARD_REFRESH_RATE:
+                self.last_handoff = started
+                self.greeks.update(self.book.snapshot(), self.spot)
+        latency_recorder.record("risk.evaluate", (time.time() - started) * 1000)
+        
+        for trade_id, reason, trade, current_pnl in closing:
+            if reason == "STOP_LOSS_MAX_RISK":
+                logger.critical(f"Max risk breached on {trade_id}: P&L={current_pnl:.2f}, Limit={trade.max_spread_loss:.2f}")
+            elif reason == "STOP_LOSS_PREMIUM":
+                logger.critical(f"Stop loss hit on {trade_id}: P&L={current_pnl:.2f}, Threshold={trade.net_premium * ProductionConfig.STOP_LOSS_PCT:.2f}")
+            elif reason == "TARGET_PROFIT":
+                logger.info(f"Target profit reached on {trade_id}: P&L={current_pnl:.2f}, Target={trade.net_premium * ProductionConfig.TARGET_PROFIT_PCT:.2f}")
+            elif reason == "DAILY_LOSS_LIMIT":
+                logger.critical(f"Portfolio daily loss limit breached: P&L={portfolio_pnl:.2f} - closing {trade_id}")
+            self._close(trade_id, reason)
+        
+        # Trips the breaker (alerts are synchronous) only once every close is under way
+        if loss_limit_hit:
+            circuit_breaker.check_daily_loss_limit(portfolio_pnl)
+    
+    def _close(self, trade_id: str, reason: str, wait: bool = False):
+        """Take a trade out of the book and flatten it on its own thread (or this one when wait), leaving the rest monitored"""
+        with self.lock:
+            trade = self.trades.pop(trade_id, None)
+            if trade is None:
+                return
+            code = self.book.trade_ids.index(trade_id)
+            mark_pnl = float(self.book.trade_pnl()[code])
+            self.book.stamp(trade_id, trade.legs)
+            self.book.remove(trade_id)
+            # The server-side exit closes every tagged position, so it is only safe for the last open trade and only
+            # while no other trade is being closed leg by leg (a multi-trade close such as the loss limit goes leg by leg)
+            atomic = not self.trades and not self.flattening
+            self.flattening += 1
+            self._resubscribe()
+        
+        if wait:
+            self._flatten(trade, reason, atomic, mark_pnl)
+        else:
+            threading.Thread(target=self._flatten, args=(trade, reason, atomic, mark_pnl), daemon=True, name=f"Flatten-{trade_id}").start()
+    
+    def _flatten(self, trade: RiskManager, reason: str, atomic: bool, mark_pnl: float):
+        try:
+            final_pnl = trade.flatten_all(reason, atomic=atomic, mark_pnl=mark_pnl)
+        except Exception as e:
+            logger.critical(f"Flatten failed for {trade.trade_id}: {e}")
+            telegram.send(f"❌ Flatten failed for {trade.trade_id}: {e}", "CRITICAL")
+            return
+        finally:
+            with self.lock:
+                self.flattening -= 1
+        with self.lock:
+            if date.today() != self.realized_day:
+                self.realized, self.realized_day = self._realized_today(), date.today()
+            self.realized += final_pnl
+    
+    def _run(self):
+        greeks_stop = self.greeks.start()
+        try:
+            if ProductionConfig.RISK_PRICE_SOURCE == "STREAM":
+                self._run_stream()
+            else:
+                self._run_poll()
+        finally:
+            greeks_stop.set()
+            logger.info("Risk supervisor idle - no open trades")
+    
+    def _run_poll(self):
+        """REST LTP for every instrument each POLL_INTERVAL"""
+        market_api = upstox_client.MarketQuoteV3Api(self.api_client)
+        consecutive_errors = 0
+        max_consecutive_errors = 10
+        
+        while self._keep_running():
+            try:
+                self._dte_exits()
+                with self.lock:
+                    keys = self._price_keys()
+                if not self.trades:
+                    continue
+                
+                prices = self._fetch_ltp(market_api, keys)
+                if prices is None:
+                    consecutive_errors += 1
+                    if consecutive_errors >= max_consecutive_errors:
+                        logger.critical(f"Price feed failed {consecutive_errors} times - flattening for safety")
+                        self.flatten_all("PRICE_FEED_FAILURE")
+                    time.sleep(ProductionConfig.POLL_INTERVAL)
+                    continue
+                
+                consecutive_errors = 0
+                self._evaluate(prices, time.time())
+                time.sleep(ProductionConfig.POLL_INTERVAL)
+            
+            except KeyboardInterrupt:
+                logger.info("Risk monitor interrupted by user")
+                with self.lock:
+                    self.running = False
+                return
             
-            total_pnl = 0.0
-            for position in response.data:
-                if hasattr(position, 'pnl'):
-                    total_pnl += float(position.pnl)
+            except Exception as e:
+                logger.error(f"Risk monitor error: {e}")
+                traceback.print_exc()
+                consecutive_errors += 1
+                if consecutive_errors >= max_consecutive_errors:
+                    logger.critical("Too many errors in risk monitor - emergency exit")
+                    self.flatten_all("MONITOR_ERROR")
+                time.sleep(5)
+    
+    def _run_stream(self):
+        """Exit rules re-checked on every tick, marking only the instruments that ticked. ltpc only pushes on trades, so a
+        quiet instrument keeps its last price (tick or REST) until it is PRICE_STALENESS_THRESHOLD old, then is re-priced
+        over REST. Every instrument is priced over REST while the socket is down, or when the feed has delivered no tick
+        at all for PRICE_STALENESS_THRESHOLD (a half-open socket still reporting connected). One batched REST call and
+        the DTE exits run at most once per POLL_INTERVAL. Subscriptions follow the book through add() and _close()."""
+        market_api = upstox_client.MarketQuoteV3Api(self.api_client)
+        feed = self.feed
+        rest_priced: Dict[str, float] = {}
+        last_tick = time.time()
+        last_rest = 0.0
+        consecutive_errors = 0
+        max_consecutive_errors = 10
+        
+        while self._keep_running():
+            try:
+                self.ticked.wait(ProductionConfig.RISK_TICK_WAIT if feed.connected else ProductionConfig.POLL_INTERVAL)
+                self.ticked.clear()
+                started = time.time()
+                prices = feed.drain()
+                
+                if started - last_rest >= ProductionConfig.POLL_INTERVAL:
+                    last_rest = started
+                    self._dte_exits()
+                    quotes = feed.snapshot()
+                    if quotes:
+                        last_tick = max(last_tick, max(q.received_at for q in quotes.values()))
+                    limit = ProductionConfig.PRICE_STALENESS_THRESHOLD
+                    down = not feed.connected or started - last_tick > limit
+                    rest_priced = {k: t for k, t in rest_priced.items() if k in feed.keys}
+                    stale = [k for k in feed.keys if down or started - max(
+                        quotes[k].received_at if k in quotes else 0.0, rest_priced.get(k, 0.0)) > limit]
+                    if stale:
+                        data = self._fetch_ltp(market_api, stale)
+                        if data is not None:
+                            consecutive_errors = 0
+                            rest_priced.update(dict.fromkeys(stale, started))
+                            prices.update(data)
+                        elif down:
+                            consecutive_errors += 1
+                            if consecutive_errors >= max_consecutive_errors:
+                                logger.critical(f"Price feed failed {consecutive_errors} times - flattening for safety")
+                                self.flatten_all("PRICE_FEED_FAILURE")
+                                continue
+                if prices:
+                    self._evaluate(prices, started)
             
-            return total_pnl
+            except KeyboardInterrupt:
+                logger.info("Risk monitor interrupted by user")
+                with self.lock:
+                    self.running = False
+                return
             
-        except Exception as e:
-            logger.error(f"Error getting final P&L: {e}")
-            return 0.0
+            except Exception as e:
+                logger.error(f"Risk monitor error: {e}")
+                traceback.print_exc()
+                consecutive_errors += 1
+                if consecutive_errors >= max_consecutive_errors:
+                    logger.critical("Too many errors in risk monitor - emergency exit")
+                    self.flatten_all("MONITOR_ERROR")
+                time.sleep(ProductionConfig.POLL_INTERVAL)
 
 # ==========================================
 # STARTUP RECONCILIATION (PRODUCTION HARDENED)
@@ -2963,6 +5465,228 @@ class ProcessManager:
 
 process_manager = ProcessManager()
 
+# ==========================================
+# SHARED MEMORY BLOCKS
+# ==========================================
+class SharedArrayBlock:
+    """Named numpy arrays packed into one shared-memory segment; only the small header crosses a queue"""
+    ALIGN = 64
+    
+    def __init__(self, shm: shared_memory.SharedMemory, header: Dict):
+        self.shm = shm
+        self.header = header
+        self.arrays = {
+            name: np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf, offset=offset)
+            for name, dtype, shape, offset in header['layout']
+        }
+    
+    @classmethod
+    def create(cls, arrays: Dict[str, np.ndarray]) -> 'SharedArrayBlock':
+        layout, offset = [], 0
+        for name, values in arrays.items():
+            values = np.asarray(values)
+            if values.dtype.hasobject:
+                raise TypeError(f"{name}: object arrays cannot be placed in shared memory")
+            layout.append((name, values.dtype.str, values.shape, offset))
+            offset += -(-values.nbytes // cls.ALIGN) * cls.ALIGN
+        
+        shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+        block = cls(shm, {'name': shm.name, 'layout': layout})
+        for name, values in arrays.items():
+            block.arrays[name][...] = values
+        return block
+    
+    @classmethod
+    def attach(cls, header: Dict) -> 'SharedArrayBlock':
+        return cls(shared_memory.SharedMemory(name=header['name']), header)
+    
+    def close(self) -> bool:
+        """Drop this process's mapping; False while views handed out from it are still referenced"""
+        self.arrays = {}
+        try:
+            self.shm.close()
+            return True
+        except BufferError:
+            return False
+    
+    def unlink(self):
+        """Remove the segment name; memory is freed once every mapping is closed"""
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+# ==========================================
+# ANALYTICS WORKER (PERSISTENT PROCESS)
+# ==========================================
+class AnalyticsWorker:
+    """Long-lived analytics process that stays warm between cycles"""
+    CHAIN_KEYS = ('weekly_chain', 'monthly_chain')
+    
+    def __init__(self):
+        self.command_queue = None
+        self.result_queue = None
+        self.process = None
+        self.request_counter = 0
+        self.lock = threading.Lock()
+        self.retired_blocks = []
+    
+    @staticmethod
+    def _serve(command_queue: Queue, result_queue: Queue):
+        """Worker loop: one AnalyticsEngine (and ApiClient) for the process lifetime"""
+        # Shutdown is driven by the parent; never run its signal handlers here
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        
+        engine = AnalyticsEngine()
+        logger.info(f"Analytics worker ready: PID={os.getpid()}")
+        
+        while True:
+            try:
+                command = command_queue.get()
+            except (EOFError, OSError):
+                break
+            
+            if command[0] == 'shutdown':
+                break
+            
+            if command[0] == 'run':
+                _, request_id, config = command
+                status, payload = engine.execute(config)
+                if status == 'success':
+                    payload = AnalyticsWorker._share_chains(payload)
+                result_queue.put((request_id, status, payload))
+        
+        logger.info("Analytics worker stopped")
+    
+    @staticmethod
+    def _share_chains(result: Dict) -> Dict:
+        """Move chain columns into one shared-memory block so only its header is pickled"""
+        arrays = {}
+        for key in AnalyticsWorker.CHAIN_KEYS:
+            for column, values in OptionChain.from_frame(result[key]).to_arrays().items():
+                arrays[f"{key}/{column}"] = values
+        
+        try:
+            block = SharedArrayBlock.create(arrays)
+        except OSError as e:
+            logger.warning(f"Shared memory unavailable ({e}) - sending chains through the queue")
+            return result
+        
+        # The parent attaches, owns and unlinks the segment from here on
+        shared = dict(result, shared_block=block.header)
+        for key in AnalyticsWorker.CHAIN_KEYS:
+            shared[key] = None
+        block.close()
+        return shared
+    
+    def _receive_chains(self, result: Dict) -> Dict:
+        """Replace chains in a worker result with OptionChain views (zero-copy when shared memory was used)"""
+        header = result.pop('shared_block', None)
+        if header is None:
+            for key in self.CHAIN_KEYS:
+                result[key] = OptionChain.from_frame(result[key])
+            return result
+        
+        block = SharedArrayBlock.attach(header)
+        for key in self.CHAIN_KEYS:
+            result[key] = OptionChain.from_arrays(
+                {column: block.arrays[f"{key}/{column}"] for column in OptionChain.COLUMNS}
+            )
+        block.unlink()
+        self.retired_blocks.append(block)
+        self._close_retired(keep=block)
+        return result
+    
+    def _close_retired(self, keep: Optional[SharedArrayBlock] = None):
+        """Unmap earlier result blocks once nothing references their views any more"""
+        still_open = []
+        for block in self.retired_blocks:
+            if block is not keep and not block.close():
+                still_open.append(block)
+        self.retired_blocks = still_open + ([keep] if keep is not None else [])
+    
+    def is_alive(self) -> bool:
+        return self.process is not None and self.process.is_alive()
+    
+    def start(self):
+        """Spawn the worker with fresh queues"""
+        # Worker and parent must share one tracker, or the worker's exit would unlink segments we still use
+        resource_tracker.ensure_running()
+        self.command_queue = Queue()
+        self.result_queue = Queue()
+        self.process = Process(
+            target=AnalyticsWorker._serve,
+            args=(self.command_queue, self.result_queue),
+            daemon=True,
+            name="Analytics-Worker"
+        )
+        self.process.start()
+        process_manager.register_process(self.process)
+        logger.info(f"Analytics worker started: PID={self.process.pid}")
+    
+    def request(self, config: Dict, timeout: float) -> Tuple[str, Any]:
+        """Submit one analysis and wait for its result; raises queue.Empty on timeout"""
+        with self.lock:
+            if not self.is_alive():
+                if self.process is not None:
+                    logger.warning(f"Analytics worker died (exitcode={self.process.exitcode}) - restarting")
+                self.start()
+            
+            self.request_counter += 1
+            request_id = self.request_counter
+            self.command_queue.put(('run', request_id, config))
+            
+            deadline = time.time() + timeout
+            while True:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise queue.Empty
+                
+                got_id, status, payload = self.result_queue.get(timeout=remaining)
+                if got_id != request_id:
+                    logger.warning(f"Discarding stale analytics result #{got_id}")
+                    if status == 'success' and 'shared_block' in payload:
+                        stale = SharedArrayBlock.attach(payload['shared_block'])
+                        stale.unlink()
+                        stale.close()
+                    continue
+                if status == 'success':
+                    payload = self._receive_chains(payload)
+                return status, payload
+    
+    def kill(self):
+        """Hard stop (used on timeout); the next request respawns the worker"""
+        if self.process is None:
+            return
+        
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join(timeout=2)
+            if self.process.exitcode is None:
+                self.process.kill()
+                self.process.join(timeout=1)
+        
+        logger.warning(f"Analytics worker killed: PID={self.process.pid}")
+        self.process = None
+    
+    def shutdown(self):
+        """Graceful stop, escalating to kill"""
+        self._close_retired()
+        if not self.is_alive():
+            return
+        
+        try:
+            self.command_queue.put(('shutdown',))
+            self.process.join(timeout=5)
+        except Exception as e:
+            logger.error(f"Analytics worker shutdown error: {e}")
+        
+        if self.process.is_alive():
+            self.kill()
+        else:
+            self.process = None
+
 # ==========================================
 # HEARTBEAT MONITOR
 # ==========================================
@@ -3003,18 +5727,18 @@ class TradingOrchestrator:
         self.configuration.access_token = ProductionConfig.UPSTOX_ACCESS_TOKEN
         self.api_client = upstox_client.ApiClient(self.configuration)
         
-        self.analytics_queue = Queue()
-        self.analytics_process = None
+        self.analytics_worker = AnalyticsWorker()
         
         self.regime_engine = RegimeEngine()
         self.strategy_factory = StrategyFactory(self.api_client)
-        self.execution_engine = ExecutionEngine(self.api_client)
+        self.execution_engine = ExecutionEngine.shared(self.api_client)
         self.session_manager = SessionManager(self.api_client)
         self.reconciliation = StartupReconciliation(self.api_client)
         
         self.last_analysis = None
         self.current_trade_id = None
-        self.current_risk_manager = None
+        self.risk_supervisor = RiskSupervisor(self.api_client)
+        latency_recorder.restore()
         
         # Setup cleanup handlers
         atexit.register(self._cleanup_handler)
@@ -3025,6 +5749,7 @@ class TradingOrchestrator:
         """Cleanup on exit"""
         logger.info("Cleanup handler triggered")
         heartbeat.stop()
+        self.analytics_worker.shutdown()
         process_manager.terminate_all()
         db_writer.shutdown()
     
@@ -3034,53 +5759,32 @@ class TradingOrchestrator:
         telegram.send(f"System shutdown signal received: {signum}", "CRITICAL")
         
         # Emergency flatten if positions exist
-        if self.current_risk_manager and self.current_risk_manager.running:
+        if self.risk_supervisor.open_trades:
             logger.critical("Emergency position exit on shutdown")
-            self.current_risk_manager.flatten_all("SYSTEM_SHUTDOWN")
+            self.risk_supervisor.flatten_all("SYSTEM_SHUTDOWN")
         
         self._cleanup_handler()
         sys.exit(0)
     
     def run_analysis(self) -> Optional[Dict]:
-        """Run market analysis in separate process with production-grade error handling"""
-        logger.info("Starting market analysis process...")
+        """Run market analysis on the persistent analytics worker with production-grade error handling"""
+        logger.info("Requesting market analysis from worker...")
         
         # Cleanup any existing processes
         process_manager.cleanup_zombies()
         
-        # Terminate existing analytics process if running
-        if self.analytics_process and self.analytics_process.is_alive():
-            logger.warning("Terminating existing analytics process")
-            self.analytics_process.terminate()
-            self.analytics_process.join(timeout=5)
-            if self.analytics_process.exitcode is None:
-                self.analytics_process.kill()
-        
-        # Clear queue
-        while not self.analytics_queue.empty():
-            try:
-                self.analytics_queue.get_nowait()
-            except:
-                break
-        
-        # Start new analytics process
-        config = {'access_token': ProductionConfig.UPSTOX_ACCESS_TOKEN}
-        self.analytics_process = Process(
-            target=AnalyticsEngine(self.analytics_queue).run,
-            args=(config,),
-            daemon=True,
-            name="Analytics-Process"
-        )
-        self.analytics_process.start()
-        process_manager.register_process(self.analytics_process)
-        
-        logger.info(f"Analytics process started: PID={self.analytics_process.pid}")
+        # Token may have been refreshed by the session manager since the worker started
+        config = {'access_token': self.configuration.access_token}
         
         # Wait for result with timeout
         try:
-            status, result = self.analytics_queue.get(timeout=ProductionConfig.ANALYTICS_PROCESS_TIMEOUT)
+            with latency_recorder.stage("analysis.worker"):
+                status, result = self.analytics_worker.request(config, ProductionConfig.ANALYTICS_PROCESS_TIMEOUT)
             
             if status == 'success':
+                latency_recorder.merge(result.pop('stage_latency', {}))
+                scoring_started = time.perf_counter()
+                
                 # Generate mandates
                 weekly_mandate = self.regime_engine.generate_mandate(
                     self.regime_engine.calculate_scores(
@@ -3119,6 +5823,8 @@ class TradingOrchestrator:
                     result['time_metrics'].monthly_exp,
                     result['time_metrics'].dte_monthly
                 )
+                latency_recorder.record("scoring.mandates", (time.perf_counter() - scoring_started) * 1000)
+                latency_recorder.persist()
                 
                 self.last_analysis = {
                     'timestamp': datetime.now(),
@@ -3147,11 +5853,7 @@ class TradingOrchestrator:
         except queue.Empty:
             logger.error("Analytics process timeout")
             telegram.send("Analysis timeout - process killed", "ERROR")
-            if self.analytics_process.is_alive():
-                self.analytics_process.terminate()
-                self.analytics_process.join(timeout=2)
-                if self.analytics_process.exitcode is None:
-                    self.analytics_process.kill()
+            self.analytics_worker.kill()
             return None
         
         except Exception as e:
@@ -3164,9 +5866,14 @@ class TradingOrchestrator:
         weekly_mandate = analysis['weekly_mandate']
         monthly_mandate = analysis['monthly_mandate']
         
-        # Choose best mandate
-        mandate = weekly_mandate if weekly_mandate.score.composite > monthly_mandate.score.composite else monthly_mandate
-        chain = analysis['weekly_chain'] if mandate == weekly_mandate else analysis['monthly_chain']
+        # Choose best mandate among expiries without an open trade (monthly wins a tie)
+        open_expiries = self.risk_supervisor.open_expiries()
+        candidates = [m for m in (monthly_mandate, weekly_mandate) if m.expiry_date not in open_expiries]
+        if not candidates:
+            logger.info("Both expiries already have an open trade - no trade executed")
+            return None
+        mandate = max(candidates, key=lambda m: m.score.composite)
+        chain = analysis['weekly_chain'] if mandate is weekly_mandate else analysis['monthly_chain']
         vol_metrics = analysis['vol_metrics']
         
         logger.info(f"Selected mandate: {mandate.expiry_type} {mandate.regime_name} (Score: {mandate.score.composite:.2f})")
@@ -3197,7 +5904,8 @@ class TradingOrchestrator:
             mandate.max_lots = int(deployable / mandate.risk_per_lot) if mandate.risk_per_lot > 0 else 0
         
         # Generate strategy legs
-        legs = self.strategy_factory.generate(mandate, chain, analysis['lot_size'], vol_metrics, vol_metrics.spot)
+        with latency_recorder.stage("strategy.generate"):
+            legs = self.strategy_factory.generate(mandate, chain, analysis['lot_size'], vol_metrics, vol_metrics.spot)
         if not legs:
             logger.error("Failed to generate valid strategy legs")
             telegram.send("Strategy generation failed", "ERROR")
@@ -3206,7 +5914,8 @@ class TradingOrchestrator:
         logger.info(f"Generated {len(legs)} legs for {mandate.suggested_structure}")
         
         # Execute strategy
-        filled_legs = self.execution_engine.execute_strategy(legs)
+        with latency_recorder.stage("execution.strategy"):
+            filled_legs = self.execution_engine.execute_strategy(legs)
         if not filled_legs:
             logger.error("Strategy execution failed")
             telegram.send("Execution failed - no position opened", "ERROR")
@@ -3263,21 +5972,14 @@ class TradingOrchestrator:
         else:
             logger.info("📄 Dry run - skipping GTT setup")
         
-        # Start risk manager
-        self.current_risk_manager = RiskManager(
+        # Hand the trade to the risk supervisor
+        self.risk_supervisor.add(RiskManager(
             self.api_client,
             filled_legs,
             mandate.expiry_date,
             trade_id,
             gtt_ids
-        )
-        
-        risk_thread = threading.Thread(
-            target=self.current_risk_manager.monitor,
-            daemon=True,
-            name="Risk-Manager"
-        )
-        risk_thread.start()
+        ))
         
         logger.info(f"✅ Trade {trade_id} opened successfully with {len(gtt_ids)} GTT orders")
         
@@ -3313,21 +6015,14 @@ class TradingOrchestrator:
             common_expiry = existing_positions[0].get('common_expiry', date.today())
             trade_id = f"RECONCILED_{int(time.time())}"
             
-            # Create risk manager for existing positions (no GTTs)
-            self.current_risk_manager = RiskManager(
+            # Monitor existing positions (no GTTs)
+            self.risk_supervisor.add(RiskManager(
                 self.api_client,
                 existing_positions,
                 common_expiry,
                 trade_id,
                 []  # No GTTs for reconciled positions
-            )
-            
-            risk_thread = threading.Thread(
-                target=self.current_risk_manager.monitor,
-                daemon=True,
-                name="Risk-Manager-Reconciled"
-            )
-            risk_thread.start()
+            ))
             
             logger.info("Risk manager attached to existing positions")
         
@@ -3357,17 +6052,16 @@ class TradingOrchestrator:
                     logger.debug("Running periodic position reconciliation...")
                     if not ProductionConfig.DRY_RUN_MODE:
                         reconciled = self.reconciliation.reconcile()
-                        if reconciled and not self.current_risk_manager:
+                        if reconciled and not self.risk_supervisor.open_trades:
                             logger.warning("Found untracked positions - attaching risk manager")
                             common_expiry = reconciled[0].get('common_expiry', date.today())
-                            self.current_risk_manager = RiskManager(
+                            self.risk_supervisor.add(RiskManager(
                                 self.api_client,
                                 reconciled,
                                 common_expiry,
                                 f"RECONCILED_{int(time.time())}",
                                 []
-                            )
-                            threading.Thread(target=self.current_risk_manager.monitor, daemon=True).start()
+                            ))
                 
                 # Weekend check
                 now = datetime.now()
@@ -3385,32 +6079,40 @@ class TradingOrchestrator:
                     continue
                 
                 # Check for open positions
-                portfolio_api = PortfolioApi(self.api_client)
-                pos_response = None
-                
-                for attempt in range(3):
-                    try:
-                        pos_response = portfolio_api.get_positions()
-                        if pos_response and pos_response.status == 'success':
-                            break
-                    except Exception as e:
-                        logger.error(f"Position check failed (attempt {attempt+1}): {e}")
-                        time.sleep(1)
-                
-                has_open_positions = False
-                if pos_response and pos_response.status == 'success' and pos_response.data:
-                    for p in pos_response.data:
-                        qty = int(p.quantity) if hasattr(p, 'quantity') else 0
-                        if qty != 0:
-                            has_open_positions = True
-                            break
-                
-                if has_open_positions:
+                if self.risk_supervisor.open_trades >= ProductionConfig.MAX_CONCURRENT_TRADES:
                     if loop_count % 60 == 0:
-                        logger.debug("Positions already open - monitoring active")
+                        logger.debug(f"{self.risk_supervisor.open_trades} trade(s) open - monitoring active")
                     time.sleep(60)
                     continue
                 
+                # Nothing tracked: any broker position is untracked or still closing, so no new entries
+                if not self.risk_supervisor.open_trades:
+                    portfolio_api = PortfolioApi(self.api_client)
+                    pos_response = None
+                    
+                    for attempt in range(3):
+                        try:
+                            pos_response = portfolio_api.get_positions()
+                            if pos_response and pos_response.status == 'success':
+                                break
+                        except Exception as e:
+                            logger.error(f"Position check failed (attempt {attempt+1}): {e}")
+                            time.sleep(1)
+                    
+                    has_open_positions = False
+                    if pos_response and pos_response.status == 'success' and pos_response.data:
+                        for p in pos_response.data:
+                            qty = int(p.quantity) if hasattr(p, 'quantity') else 0
+                            if qty != 0:
+                                has_open_positions = True
+                                break
+                    
+                    if has_open_positions:
+                        if loop_count % 60 == 0:
+                            logger.debug("Positions already open - monitoring active")
+                        time.sleep(60)
+                        continue
+                
                 # Check if analysis is fresh
                 if self.last_analysis:
                     age = (datetime.now() - self.last_analysis['timestamp']).total_seconds()
@@ -3431,44 +6133,10 @@ class TradingOrchestrator:
                 
                 # Execute trade
                 trade_id = self.execute_best_mandate(analysis)
+                latency_recorder.persist()
                 
                 if trade_id:
                     logger.info(f"Trade {trade_id} opened - monitoring active")
-                    
-                    # Wait for position to close before next cycle
-                    position_closed = False
-                    wait_start = time.time()
-                    max_wait = 86400  # 24 hours max
-                    
-                    while not position_closed and (time.time() - wait_start) < max_wait:
-                        heartbeat.beat()
-                        
-                        pos_response = None
-                        for attempt in range(3):
-                            try:
-                                pos_response = portfolio_api.get_positions()
-                                if pos_response and pos_response.status == 'success':
-                                    break
-                            except:
-                                time.sleep(1)
-                        
-                        all_closed = True
-                        if pos_response and pos_response.status == 'success' and pos_response.data:
-                            for p in pos_response.data:
-                                qty = int(p.quantity) if hasattr(p, 'quantity') else 0
-                                if qty != 0:
-                                    all_closed = False
-                                    break
-                        
-                        if all_closed:
-                            position_closed = True
-                            logger.info("Position closed - ready for next trade")
-                            break
-                        
-                        time.sleep(60)
-                    
-                    if not position_closed:
-                        logger.warning("Position still open after 24h - continuing anyway")
                 else:
                     logger.info("No trade executed - waiting for next analysis cycle")
                     time.sleep(ProductionConfig.ANALYSIS_INTERVAL)
@@ -3495,15 +6163,596 @@ class TradingOrchestrator:
         logger.info("Auto-trading loop exited")
         self._cleanup_handler()
 
+# ==========================================
+# BACKTEST (DAILY REPLAY)
+# ==========================================
+class ReplayGarchForecaster:
+    """GarchForecaster stand-in for replays: refit every BACKTEST_GARCH_REFIT_DAYS calls, fixed params filtered forward in between"""
+    
+    def __init__(self, refit_every: int = ProductionConfig.BACKTEST_GARCH_REFIT_DAYS):
+        self.refit_every = refit_every
+        self.params = None
+        self.calls = 0
+    
+    def forecast(self, returns: pd.Series, horizons: Tuple[int, ...] = (7, 28)) -> Dict[int, float]:
+        if len(returns) < 100:
+            return {h: 0 for h in horizons}
+        if self.params is None or self.calls % self.refit_every == 0:
+            params = GarchForecaster.fit_params(returns)
+            if params is not None:
+                self.params = params
+        self.calls += 1
+        if self.params is None:
+            return {h: 0 for h in horizons}
+        path = GarchForecaster.variance_path(returns.to_numpy(), self.params, horizons)
+        return {h: float(path[h][-1]) for h in horizons}
+
+@dataclass
+class BacktestSession:
+    """Precomputed inputs for one replayed trading day"""
+    day: date
+    taken_at: datetime
+    lot_size: int
+    expiries: Dict[str, Optional[date]]
+    time: TimeMetrics
+    vol: VolMetrics
+    struct_weekly: StructMetrics
+    struct_monthly: StructMetrics
+    edge: EdgeMetrics
+    external: ExternalMetrics
+
+class BacktestDataset:
+    """Replay inputs loaded once from the local stores. Candles and chain snapshots are kept as flat arrays (shareable
+    across processes); featurize() runs the live AnalyticsEngine metric code once per session."""
+    CANDLE_COLUMNS = ('timestamp', 'open', 'high', 'low', 'close')
+    EXPIRY_KINDS = ('weekly', 'monthly', 'next_weekly')
+    
+    def __init__(self, market: Dict[str, np.ndarray], snapshots: List[Dict], participants: Dict[date, Dict[str, ParticipantData]]):
+        self.market = market
+        self.snapshots = snapshots
+        self.participants = participants
+        self.chain_rows = {
+            (int(day), int(expiry)): (int(start), int(stop))
+            for day, expiry, start, stop in zip(market['chain_day'], market['chain_expiry'], market['chain_start'], market['chain_stop'])
+        }
+        self.sessions: List[BacktestSession] = []
+        self.observations = pd.DataFrame()
+        self.use_surface: Optional[bool] = None
+    
+    @classmethod
+    def load(cls, start: Optional[date] = None, end: Optional[date] = None) -> 'BacktestDataset':
+        """Daily candles, chain snapshots and participant OI from disk; no network access"""
+        market = {}
+        candles = CandleStore()
+        for series, key in (('nifty', ProductionConfig.NIFTY_KEY), ('vix', ProductionConfig.VIX_KEY)):
+            arrays = candles.arrays(key)
+            for col in cls.CANDLE_COLUMNS:
+                market[f'{series}_{col}'] = np.array(arrays[col])
+        
+        store = ChainSnapshotStore()
+        snapshots, table = [], []
+        pieces = {name: [] for name in OptionChain.COLUMNS}
+        rows = 0
+        for day in store.dates():
+            if (start and day < start) or (end and day > end):
+                continue
+            meta = store.meta(day)
+            if meta is None:
+                continue
+            for name in meta['chains']:
+                expiry = date.fromisoformat(name)
+                chain = store.get(day, expiry)
+                if chain is None or chain.empty:
+                    continue
+                arrays = chain.to_arrays()
+                for col in OptionChain.COLUMNS:
+                    pieces[col].append(arrays[col])
+                table.append((day.toordinal(), expiry.toordinal(), rows, rows + len(chain)))
+                rows += len(chain)
+            snapshots.append({**meta, 'day': day.isoformat()})
+        
+        for col, parts in pieces.items():
+            empty = np.empty(0, dtype=str if col in OptionChain.KEY_COLUMNS else np.float64)
+            market[f'chain_{col}'] = np.concatenate(parts) if parts else empty
+        table = np.asarray(table, dtype=np.int64).reshape(-1, 4)
+        for i, name in enumerate(('chain_day', 'chain_expiry', 'chain_start', 'chain_stop')):
+            market[name] = np.ascontiguousarray(table[:, i])
+        
+        cache = ParticipantDataCache()
+        participants = {}
+        for day in cache.dates():
+            data = cache.get(day)
+            if data:
+                participants[day] = data
+        
+        logger.info(f"Backtest data: {len(snapshots)} sessions, {len(table)} chains, {len(market['nifty_close'])} Nifty bars")
+        return cls(market, snapshots, participants)
+    
+    def chain(self, day: date, expiry: date) -> Optional[OptionChain]:
+        """Zero-copy view of one stored chain"""
+        rows = self.chain_rows.get((day.toordinal(), expiry.toordinal()))
+        if rows is None:
+            return None
+        start, stop = rows
+        return OptionChain.from_arrays({name: self.market[f'chain_{name}'][start:stop] for name in OptionChain.COLUMNS})
+    
+    def candles(self, series: str) -> pd.DataFrame:
+        """Same shape as CandleStore.frame"""
+        ts = self.market[f'{series}_timestamp']
+        index = pd.DatetimeIndex(ts.view('datetime64[ns]'), name='timestamp').tz_localize('UTC').tz_convert('Asia/Kolkata')
+        return pd.DataFrame({col: self.market[f'{series}_{col}'] for col in self.CANDLE_COLUMNS[1:]}, index=index)
+    
+    def featurize(self, use_surface: bool = True) -> 'BacktestDataset':
+        """Per-session metrics and the columnar RegimeEngine observations (two rows per session: WEEKLY, MONTHLY)"""
+        engine = AnalyticsEngine()
+        engine.rolling_vol = RollingVolEngine(state_path=None)
+        engine.garch = ReplayGarchForecaster()
+        
+        nifty, vix = self.candles('nifty'), self.candles('vix')
+        nifty_days = np.array([d.toordinal() for d in nifty.index.date], dtype=np.int64)
+        vix_days = np.array([d.toordinal() for d in vix.index.date], dtype=np.int64)
+        participant_days = sorted(self.participants)
+        sessions, rows = [], []
+        
+        for meta in self.snapshots:
+            day = date.fromisoformat(meta['day'])
+            taken_at = datetime.fromisoformat(meta['taken_at'])
+            expiries = {kind: date.fromisoformat(meta[kind]) if meta.get(kind) else None for kind in self.EXPIRY_KINDS}
+            lot_size = int(meta['lot_size'])
+            
+            # History as the live fetch sees it: completed daily bars before the session, within the lookback
+            first = (day - timedelta(days=ProductionConfig.ANALYTICS_LOOKBACK_DAYS)).toordinal()
+            nifty_hist = nifty.iloc[np.searchsorted(nifty_days, first):np.searchsorted(nifty_days, day.toordinal())]
+            vix_hist = vix.iloc[np.searchsorted(vix_days, first):np.searchsorted(vix_days, day.toordinal())]
+            if len(nifty_hist) < 2 or vix_hist.empty:
+                logger.debug(f"Backtest: no history before {day} - session skipped")
+                continue
+            
+            vol = engine.vol_metrics_from(nifty_hist, vix_hist, meta['spot'], meta['vix'])
+            chains = {kind: self.chain(day, expiry) if expiry else None for kind, expiry in expiries.items()}
+            frames = {kind: chain.to_frame() if chain is not None else pd.DataFrame() for kind, chain in chains.items()}
+            
+            smiles = {kind: None for kind in self.EXPIRY_KINDS}
+            if use_surface:
+                for kind in ('weekly', 'monthly'):
+                    smiles[kind] = engine.vol_surface.update(expiries[kind], chains[kind], vol.spot, taken_at)
+                if expiries['next_weekly'] not in (expiries['weekly'], expiries['monthly']):
+                    engine.vol_surface.update(expiries['next_weekly'], chains['next_weekly'], vol.spot, taken_at)
+            
+            time_metrics = engine.get_time_metrics(expiries['weekly'], expiries['monthly'], expiries['next_weekly'], today=day)
+            struct_weekly = engine.get_struct_metrics(frames['weekly'], vol.spot, lot_size, smiles['weekly'])
+            struct_monthly = engine.get_struct_metrics(frames['monthly'], vol.spot, lot_size, smiles['monthly'])
+            edge = engine.get_edge_metrics(frames['weekly'], frames['monthly'], vol.spot, vol, smiles['weekly'], smiles['monthly'])
+            
+            # NSE publishes participant OI after the close, so a session sees the two files before it
+            p = bisect.bisect_left(participant_days, day)
+            today_oi = participant_days[p - 1] if p >= 1 else day
+            yest_oi = participant_days[p - 2] if p >= 2 else None
+            external = engine.get_external_metrics(nifty_hist, *engine._build_participant_data(
+                today_oi, self.participants.get(today_oi), self.participants.get(yest_oi)
+            ))
+            
+            for expiry_type, struct, kind, dte in (
+                ("WEEKLY", struct_weekly, 'weekly', time_metrics.dte_weekly),
+                ("MONTHLY", struct_monthly, 'monthly', time_metrics.dte_monthly)
+            ):
+                rows.append({
+                    'session': len(sessions),
+                    **RegimeEngine.observation(vol, struct, edge, external, time_metrics, expiry_type, dte),
+                    'gex_ratio': struct.gex_ratio,
+                    'chain_rows': len(frames[kind])
+                })
+            sessions.append(BacktestSession(
+                day, taken_at, lot_size, expiries, time_metrics, vol, struct_weekly, struct_monthly, edge, external
+            ))
+        
+        self.sessions = sessions
+        self.observations = pd.DataFrame(rows)
+        self.use_surface = use_surface
+        logger.info(f"Backtest features: {len(sessions)} sessions")
+        return self
+
+@dataclass
+class BacktestResult:
+    ledger: pd.DataFrame
+    equity: pd.Series
+    
+    @property
+    def stats(self) -> Dict[str, float]:
+        pnl = self.ledger['net_pnl'] if not self.ledger.empty else pd.Series(dtype=np.float64)
+        returns = self.equity.pct_change().dropna()
+        drawdown = self.equity / self.equity.cummax() - 1
+        gains, losses = pnl[pnl > 0].sum(), -pnl[pnl < 0].sum()
+        return {
+            'trades': int(len(pnl)),
+            'net_pnl': float(pnl.sum()),
+            'win_rate': float((pnl > 0).mean() * 100) if len(pnl) else 0.0,
+            'profit_factor': float(gains / losses) if losses > 0 else (float('inf') if gains > 0 else 0.0),
+            'max_drawdown_pct': float(-drawdown.min() * 100) if len(drawdown) else 0.0,
+            'sharpe': float(returns.mean() / returns.std() * np.sqrt(252)) if len(returns) > 1 and returns.std() > 0 else 0.0,
+            'final_equity': float(self.equity.iloc[-1]) if len(self.equity) else float(ProductionConfig.BASE_CAPITAL)
+        }
+
+class BacktestEngine:
+    """Replays a featurised dataset through batch regime scoring, StrategyFactory legs and the RiskManager exit rules.
+    One position at a time, filled at snapshot LTPs and marked at every later session's snapshot."""
+    
+    def __init__(self, dataset: BacktestDataset):
+        self.dataset = dataset
+        self.regime_engine = RegimeEngine()
+        self.strategy_factory = StrategyFactory(None)
+        self.nifty_close = dict(zip(
+            (d.toordinal() for d in dataset.candles('nifty').index.date), dataset.market['nifty_close'].tolist()
+        ))
+    
+    def best_mandates(self) -> pd.DataFrame:
+        """Higher-scoring of the weekly and monthly mandate per session, under the current ProductionConfig"""
+        obs = self.dataset.observations.copy()
+        if obs.empty:
+            return obs
+        # GEX regime is re-derived so GEX_STICKY_RATIO can vary between runs
+        ratio = obs['gex_ratio'].to_numpy()
+        derived = np.select(
+            [ratio > ProductionConfig.GEX_STICKY_RATIO, ratio < ProductionConfig.GEX_STICKY_RATIO * 0.5], ["STICKY", "SLIPPERY"], "NEUTRAL"
+        )
+        obs['gex_regime'] = np.where(obs['chain_rows'] > 0, derived, obs['gex_regime'])
+        
+        scores = self.regime_engine.calculate_scores_batch(obs)
+        table = pd.concat([obs[['session', 'expiry_type', 'dte']], scores, self.regime_engine.generate_mandates_batch(obs, scores)], axis=1)
+        weekly = table[table['expiry_type'] == "WEEKLY"].set_index('session')
+        monthly = table[table['expiry_type'] == "MONTHLY"].set_index('session')
+        pick_weekly = weekly['composite'] > monthly['composite']
+        return pd.concat([weekly[pick_weekly], monthly[~pick_weekly]]).sort_index()
+    
+    def _mandate(self, row, session: BacktestSession) -> TradingMandate:
+        expiry = session.expiries['weekly' if row.expiry_type == "WEEKLY" else 'monthly']
+        score = RegimeScore(row.vol_score, row.struct_score, row.edge_score, row.risk_score, row.composite, row.confidence)
+        mandate = TradingMandate(
+            row.expiry_type, expiry, int(row.dte), row.regime_name, row.strategy_type,
+            float(row.allocation_pct), int(row.max_lots), float(row.risk_per_lot), score, [], [], row.suggested_structure
+        )
+        # Same capital cap as execute_best_mandate
+        deployable = ProductionConfig.BASE_CAPITAL * (mandate.allocation_pct / 100.0)
+        if deployable > ProductionConfig.MAX_CAPITAL_PER_TRADE:
+            mandate.max_lots = int(ProductionConfig.MAX_CAPITAL_PER_TRADE / mandate.risk_per_lot) if mandate.risk_per_lot > 0 else 0
+        return mandate
+    
+    def _enter(self, row, session: BacktestSession) -> Optional[Dict]:
+        mandate = self._mandate(row, session)
+        if mandate.max_lots == 0 or mandate.expiry_date is None:
+            return None
+        chain = self.dataset.chain(session.day, mandate.expiry_date)
+        if chain is None:
+            return None
+        
+        legs = self.strategy_factory.generate(mandate, chain, session.lot_size, session.vol, session.vol.spot, now=session.taken_at)
+        if not legs or ExecutionEngine.pretrade_violation(legs):
+            return None
+        
+        # Entry IVs let later sessions model a mark when a leg is missing from the snapshot
+        t = OptionPricer.time_to_expiry(mandate.expiry_date, session.taken_at)
+        entry_iv = OptionPricer.implied_vol(
+            [l['ltp'] for l in legs], session.vol.spot, [l['strike'] for l in legs], t, [l['type'] == 'CE' for l in legs]
+        )
+        for leg, iv in zip(legs, entry_iv):
+            leg.update(entry_price=leg['ltp'], filled_qty=leg['qty'], entry_iv=float(iv), mark=leg['ltp'])
+        
+        net_premium = sum(l['entry_price'] * l['filled_qty'] for l in legs if l['side'] == 'SELL') - \
+                      sum(l['entry_price'] * l['filled_qty'] for l in legs if l['side'] == 'BUY')
+        return {
+            'entry_day': session.day, 'expiry': mandate.expiry_date, 'expiry_type': mandate.expiry_type,
+            'regime': mandate.regime_name, 'structure': mandate.suggested_structure, 'score': mandate.score.composite,
+            'lots': mandate.max_lots, 'legs': legs, 'net_premium': net_premium,
+            'max_spread_loss': RiskManager.max_spread_loss_for(legs, net_premium),
+            'costs': ProductionConfig.BACKTEST_COST_PER_ORDER * len(legs)
+        }
+    
+    def _mark(self, position: Dict, session: BacktestSession):
+        """Leg marks from the session's snapshot of the position's expiry; missing legs are repriced at their entry IV"""
+        chain = self.dataset.chain(session.day, position['expiry'])
+        t = OptionPricer.time_to_expiry(position['expiry'], session.taken_at)
+        for leg in position['legs']:
+            prefix = leg['type'].lower()
+            rows = np.flatnonzero(chain[f'{prefix}_key'] == leg['key']) if chain is not None else []
+            if len(rows) and chain[f'{prefix}_ltp'][rows[0]] > 0:
+                leg['mark'] = float(chain[f'{prefix}_ltp'][rows[0]])
+            elif np.isfinite(leg['entry_iv']):
+                leg['mark'] = float(OptionPricer.price(session.vol.spot, leg['strike'], t, leg['entry_iv'], leg['type'] == 'CE'))
+    
+    @staticmethod
+    def _pnl(position: Dict) -> float:
+        """Same leg arithmetic as PositionBook.leg_pnl"""
+        return sum(
+            (l['entry_price'] - l['mark']) * l['filled_qty'] if l['side'] == 'SELL' else (l['mark'] - l['entry_price']) * l['filled_qty']
+            for l in position['legs']
+        )
+    
+    def _exit_reason(self, position: Dict, session: BacktestSession) -> Optional[str]:
+        """RiskSupervisor order: expiry/DTE first, then the P&L rules"""
+        days_to_expiry = (position['expiry'] - session.day).days
+        if days_to_expiry < 0:
+            settle = self.nifty_close.get(position['expiry'].toordinal(), session.vol.spot)
+            for leg in position['legs']:
+                leg['mark'] = max(settle - leg['strike'], 0.0) if leg['type'] == 'CE' else max(leg['strike'] - settle, 0.0)
+            return "EXPIRED"
+        if days_to_expiry <= ProductionConfig.EXIT_DTE:
+            return "DTE_EXIT"
+        return RiskManager.exit_reason(self._pnl(position), position['net_premium'], position['max_spread_loss'])
+    
+    def _close(self, position: Dict, session: BacktestSession, reason: str) -> Dict:
+        pnl = self._pnl(position)
+        costs = position['costs'] + ProductionConfig.BACKTEST_COST_PER_ORDER * len(position['legs'])
+        strikes = "/".join(f"{l['side'][0]}{l['strike']:.0f}{l['type']}" for l in position['legs'])
+        return {
+            'entry_day': position['entry_day'], 'exit_day': session.day, 'expiry': position['expiry'],
+            'expiry_type': position['expiry_type'], 'regime': position['regime'], 'structure': position['structure'],
+            'score': position['score'], 'lots': position['lots'], 'legs': strikes,
+            'net_premium': position['net_premium'], 'max_loss': position['max_spread_loss'],
+            'exit_reason': reason, 'pnl': pnl, 'costs': costs, 'net_pnl': pnl - costs,
+            'days_held': (session.day - position['entry_day']).days
+        }
+    
+    def run(self) -> BacktestResult:
+        sessions = self.dataset.sessions
+        mandates = self.best_mandates()
+        ledger, equity = [], []
+        realized = 0.0
+        position = None
+        
+        for i, session in enumerate(sessions):
+            if position is not None:
+                self._mark(position, session)
+                reason = self._exit_reason(position, session)
+                if reason:
+                    trade = self._close(position, session, reason)
+                    ledger.append(trade)
+                    realized += trade['net_pnl']
+                    position = None
+            
+            if position is None and i in mandates.index:
+                position = self._enter(mandates.loc[i], session)
+                # The live monitor starts right after the fill, so the DTE rule can close a fresh position
+                if position is not None and (position['expiry'] - session.day).days <= ProductionConfig.EXIT_DTE:
+                    trade = self._close(position, session, "DTE_EXIT")
+                    ledger.append(trade)
+                    realized += trade['net_pnl']
+                    position = None
+            
+            unrealized = self._pnl(position) - position['costs'] if position is not None else 0.0
+            equity.append(ProductionConfig.BASE_CAPITAL + realized + unrealized)
+        
+        return BacktestResult(
+            pd.DataFrame(ledger),
+            pd.Series(equity, index=pd.Index([s.day for s in sessions], name='day'), name='equity', dtype=np.float64)
+        )
+
+# ==========================================
+# PARAMETER SWEEP (PROCESS POOL)
+# ==========================================
+class ParameterSweep:
+    """Backtests over a grid or random sample of ProductionConfig thresholds, one process per core. Market arrays are
+    shared once through SharedArrayBlock and every finished run is appended to a JSONL file, so rerunning the same
+    sweep after an interruption only evaluates what is missing. Run ids include a fingerprint of the replay window,
+    surface mode and Volguard.py, so a changed dataset or code never resumes from or ranks alongside old records."""
+    # Parameter spec: a list of values, or {'min', 'max'} (uniform) with an optional 'step' (grid points / quantised draws)
+    DEFAULT_SPACE = {
+        'WEIGHT_VOL': {'min': 0.2, 'max': 0.6},
+        'WEIGHT_STRUCT': {'min': 0.1, 'max': 0.5},
+        'WEIGHT_EDGE': {'min': 0.1, 'max': 0.4},
+        'WEIGHT_RISK': {'min': 0.05, 'max': 0.25},
+        'VOV_CRASH_ZSCORE': {'min': 2.0, 'max': 3.5},
+        'HIGH_VOL_IVP': {'min': 60.0, 'max': 90.0},
+        'GEX_STICKY_RATIO': {'min': 0.01, 'max': 0.06},
+        'IRON_FLY_MIN_WING_WIDTH': {'min': 50, 'max': 200, 'step': 50},
+        'IRON_FLY_MAX_WING_WIDTH': {'min': 250, 'max': 600, 'step': 50},
+        'TARGET_PROFIT_PCT': {'min': 0.3, 'max': 0.8},
+        'STOP_LOSS_PCT': {'min': 0.5, 'max': 2.0}
+    }
+    WEIGHTS = ('WEIGHT_VOL', 'WEIGHT_STRUCT', 'WEIGHT_EDGE', 'WEIGHT_RISK')
+    LOWER_IS_BETTER = ('max_drawdown_pct',)
+    _worker_dataset: Optional[BacktestDataset] = None
+    _worker_block: Optional[SharedArrayBlock] = None
+    
+    def __init__(self, dataset: BacktestDataset):
+        self.dataset = dataset
+        self.fingerprint = self.dataset_fingerprint(dataset)
+    
+    @staticmethod
+    def dataset_fingerprint(dataset: BacktestDataset) -> str:
+        with open(os.path.abspath(__file__), 'rb') as f:
+            code = hashlib.sha1(f.read()).hexdigest()
+        days = [session.day for session in dataset.sessions]
+        basis = {
+            'first': str(min(days)) if days else None, 'last': str(max(days)) if days else None,
+            'sessions': len(days), 'surface': dataset.use_surface, 'code': code
+        }
+        return hashlib.sha1(json.dumps(basis, sort_keys=True).encode()).hexdigest()[:12]
+    
+    @staticmethod
+    def _check(space: Dict) -> Dict:
+        for name in space:
+            if not name.isupper() or not hasattr(ProductionConfig, name):
+                raise ValueError(f"Unknown ProductionConfig parameter: {name}")
+        return space
+    
+    @staticmethod
+    def _points(spec) -> List:
+        if isinstance(spec, list):
+            return spec
+        if 'step' not in spec:
+            raise ValueError(f"Grid parameters need a value list or a step: {spec}")
+        return np.arange(spec['min'], spec['max'] + spec['step'] / 2, spec['step']).tolist()
+    
+    @classmethod
+    def _normalise(cls, params: Dict) -> Dict:
+        """Composite thresholds assume the four weights sum to 1, so swept weights are rescaled together"""
+        if not any(name in params for name in cls.WEIGHTS):
+            return params
+        weights = {name: params.get(name, getattr(ProductionConfig, name)) for name in cls.WEIGHTS}
+        total = sum(weights.values())
+        return {**params, **{name: round(value / total, 4) for name, value in weights.items()}}
+    
+    @classmethod
+    def grid(cls, space: Dict) -> List[Dict]:
+        names = list(cls._check(space))
+        combos = [[]]
+        for name in names:
+            combos = [combo + [value] for combo in combos for value in cls._points(space[name])]
+        return [cls._normalise(dict(zip(names, combo))) for combo in combos]
+    
+    @classmethod
+    def random(cls, space: Dict, samples: int, seed: int = 0) -> List[Dict]:
+        """Seeded, so the same spec regenerates the same sets when a sweep is resumed"""
+        rng = np.random.default_rng(seed)
+        sets = []
+        for _ in range(samples):
+            params = {}
+            for name, spec in cls._check(space).items():
+                if isinstance(spec, list) or 'step' in spec:
+                    points = cls._points(spec)
+                    params[name] = points[int(rng.integers(len(points)))]
+                else:
+                    params[name] = round(float(rng.uniform(spec['min'], spec['max'])), 4)
+            sets.append(cls._normalise(params))
+        return sets
+    
+    @staticmethod
+    def run_id(params: Dict, fingerprint: str) -> str:
+        return hashlib.sha1(json.dumps({'params': params, 'dataset': fingerprint}, sort_keys=True).encode()).hexdigest()[:12]
+    
+    @staticmethod
+    def load_results(path: str) -> Dict[str, Dict]:
+        """Completed runs by id; a torn last line from an interrupted write is ignored"""
+        results = {}
+        try:
+            with open(path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    results[record['id']] = record
+        except FileNotFoundError:
+            pass
+        return results
+    
+    @classmethod
+    def ranked(cls, path: str, rank_by: str = 'sharpe', fingerprint: Optional[str] = None) -> pd.DataFrame:
+        """One row per successful run (params then stats), best first; only runs on this dataset when fingerprint is given"""
+        rows = [
+            {'id': r['id'], **r['params'], **r['stats'], 'seconds': r['seconds']}
+            for r in cls.load_results(path).values()
+            if not r.get('error') and (fingerprint is None or r.get('dataset') == fingerprint)
+        ]
+        if not rows:
+            return pd.DataFrame()
+        table = pd.DataFrame(rows)
+        if rank_by not in table.columns:
+            return table
+        return table.sort_values(rank_by, ascending=rank_by in cls.LOWER_IS_BETTER, kind='stable').reset_index(drop=True)
+    
+    @staticmethod
+    def _init_worker(header: Dict, sessions: List[BacktestSession], observations: pd.DataFrame):
+        # Interrupts are handled by the parent, which lets in-flight runs finish and be saved
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        # Per-trade leg construction logs from every worker would flood the log file
+        logger.setLevel(logging.WARNING)
+        
+        block = SharedArrayBlock.attach(header)
+        dataset = BacktestDataset(block.arrays, [], {})
+        dataset.sessions, dataset.observations = sessions, observations
+        ParameterSweep._worker_block, ParameterSweep._worker_dataset = block, dataset
+    
+    @staticmethod
+    def _run_one(run_id: str, fingerprint: str, params: Dict) -> Dict:
+        for name, value in params.items():
+            setattr(ProductionConfig, name, value)
+        started = time.perf_counter()
+        try:
+            stats, error = BacktestEngine(ParameterSweep._worker_dataset).run().stats, None
+        except Exception as e:
+            stats, error = {}, f"{type(e).__name__}: {e}"
+        return {
+            'id': run_id, 'dataset': fingerprint, 'params': params, 'stats': stats, 'error': error,
+            'seconds': round(time.perf_counter() - started, 3)
+        }
+    
+    def run(self, param_sets: List[Dict], path: str = ProductionConfig.SWEEP_RESULTS_PATH, workers: int = 0) -> int:
+        """Evaluate every set not already in the results file; returns the number of runs completed now"""
+        workers = workers or ProductionConfig.SWEEP_WORKERS or os.cpu_count() or 1
+        done = self.load_results(path)
+        pending = {}
+        for params in param_sets:
+            run_id = self.run_id(params, self.fingerprint)
+            if run_id not in done:
+                pending[run_id] = params
+        logger.info(f"Sweep: {len(param_sets)} parameter sets, {len(param_sets) - len(pending)} already done, {workers} workers")
+        if not pending:
+            return 0
+        
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # Workers and parent must share one tracker, or a worker exiting would unlink the market block
+        resource_tracker.ensure_running()
+        block = SharedArrayBlock.create(self.dataset.market)
+        pool = concurrent.futures.ProcessPoolExecutor(
+            max_workers=min(workers, len(pending)),
+            initializer=ParameterSweep._init_worker,
+            initargs=(block.header, self.dataset.sessions, self.dataset.observations)
+        )
+        recorded = set()
+        
+        def save(f, future):
+            record = future.result()
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+            recorded.add(future)
+            if record['error']:
+                logger.warning(f"Sweep run {record['id']} failed: {record['error']}")
+        
+        try:
+            futures = [pool.submit(ParameterSweep._run_one, run_id, self.fingerprint, params) for run_id, params in pending.items()]
+            with open(path, "a") as f:
+                try:
+                    for future in concurrent.futures.as_completed(futures):
+                        save(f, future)
+                        if len(recorded) % max(1, len(pending) // 20) == 0:
+                            logger.info(f"Sweep progress: {len(recorded)}/{len(pending)}")
+                except KeyboardInterrupt:
+                    # Queued runs are dropped; runs already in a worker are waited for and saved
+                    for future in futures:
+                        future.cancel()
+                    for future in futures:
+                        if not future.cancelled() and future not in recorded:
+                            save(f, future)
+                    logger.warning(f"Sweep interrupted after {len(recorded)}/{len(pending)} runs - rerun the same sweep to resume")
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+            block.close()
+            block.unlink()
+        return len(recorded)
+
 # ==========================================
 # MAIN ENTRY POINT
 # ==========================================
 def main():
     import argparse
     parser = argparse.ArgumentParser(description="VOLGUARD 3.0 - Production Hardened")
-    parser.add_argument('--mode', choices=['analysis', 'auto'], default='analysis', help='Run mode')
+    parser.add_argument('--mode', choices=['analysis', 'auto', 'backtest', 'sweep'], default='analysis', help='Run mode')
     parser.add_argument('--skip-confirm', action='store_true', help='Skip confirmation for auto mode')
     parser.add_argument('--export-journal', type=str, help='Export trade journal to directory')
+    parser.add_argument('--backfill-participants', type=int, metavar='DAYS', help='Cache NSE participant OI for the last DAYS days')
+    parser.add_argument('--latency', action='store_true', help='Print persisted per-stage latency percentiles')
+    parser.add_argument('--start', type=date.fromisoformat, help='Backtest start date (YYYY-MM-DD)')
+    parser.add_argument('--end', type=date.fromisoformat, help='Backtest end date (YYYY-MM-DD)')
+    parser.add_argument('--no-surface', action='store_true', help='Backtest with chain-scan IVs instead of the SVI surface')
+    parser.add_argument('--backtest-out', type=str, metavar='DIR', help='Write backtest ledger and equity curve CSVs to DIR')
+    parser.add_argument('--sweep-spec', type=str, metavar='FILE', help='Sweep spec JSON: {"mode": "grid"|"random", "samples", "seed", "space"}')
+    parser.add_argument('--sweep-out', type=str, default=ProductionConfig.SWEEP_RESULTS_PATH, metavar='FILE', help='Sweep results JSONL (resumed if present)')
+    parser.add_argument('--workers', type=int, default=0, help='Sweep worker processes (default: VG_SWEEP_WORKERS or CPU count)')
+    parser.add_argument('--rank-by', type=str, default='sharpe', help='Sweep ranking statistic')
+    parser.add_argument('--top', type=int, default=20, help='Sweep results to print')
     args = parser.parse_args()
     
     # Banner
@@ -3523,6 +6772,68 @@ def main():
             print("❌ Export failed")
         return
     
+    if args.latency:
+        state = LatencyRecorder.load()
+        if not state or not state.get('stages'):
+            print("No stage latency recorded yet")
+            return
+        print(f"Stage latency (ms) | last {state['window']} samples per stage | updated {state['updated_at']}")
+        print(f"{'stage':<28} {'count':>7} {'p50':>10} {'p95':>10} {'p99':>10} {'max':>10} {'last':>10}")
+        for name, st in state['stages'].items():
+            print(f"{name:<28} {st['count']:>7} {st['p50']:>10.2f} {st['p95']:>10.2f} {st['p99']:>10.2f} {st['max']:>10.2f} {st['last']:>10.2f}")
+        return
+    
+    if args.backfill_participants:
+        stored = AnalyticsEngine().backfill_participant_data(args.backfill_participants)
+        print(f"✅ Cached participant OI for {stored} new trading days")
+        return
+    
+    if args.mode == 'backtest':
+        started = time.perf_counter()
+        dataset = BacktestDataset.load(args.start, args.end).featurize(use_surface=not args.no_surface)
+        result = BacktestEngine(dataset).run()
+        stats = result.stats
+        print(f"\n📈 BACKTEST {dataset.sessions[0].day if dataset.sessions else '-'} → {dataset.sessions[-1].day if dataset.sessions else '-'}"
+              f" | {len(dataset.sessions)} sessions | {time.perf_counter() - started:.1f}s")
+        print(f"Trades: {stats['trades']} | Win rate: {stats['win_rate']:.1f}% | Profit factor: {stats['profit_factor']:.2f}")
+        print(f"Net P&L: ₹{stats['net_pnl']:,.0f} | Max DD: {stats['max_drawdown_pct']:.1f}% | Sharpe: {stats['sharpe']:.2f}")
+        if args.backtest_out:
+            os.makedirs(args.backtest_out, exist_ok=True)
+            result.ledger.to_csv(os.path.join(args.backtest_out, "ledger.csv"), index=False)
+            result.equity.to_csv(os.path.join(args.backtest_out, "equity.csv"))
+            print(f"✅ Ledger and equity curve written to {args.backtest_out}")
+        return
+    
+    if args.mode == 'sweep':
+        spec = {}
+        if args.sweep_spec:
+            with open(args.sweep_spec) as f:
+                spec = json.load(f)
+        space = spec.get('space', ParameterSweep.DEFAULT_SPACE)
+        try:
+            param_sets = ParameterSweep.grid(space) if spec.get('mode') == 'grid' else \
+                         ParameterSweep.random(space, int(spec.get('samples', 100)), int(spec.get('seed', 0)))
+        except ValueError as e:
+            print(f"❌ Invalid sweep spec: {e}")
+            sys.exit(1)
+        
+        dataset = BacktestDataset.load(args.start, args.end).featurize(use_surface=not args.no_surface)
+        sweep = ParameterSweep(dataset)
+        sweep.run(param_sets, args.sweep_out, args.workers)
+        table = ParameterSweep.ranked(args.sweep_out, args.rank_by, sweep.fingerprint)
+        if table.empty:
+            print("❌ No completed sweep runs")
+            return
+        if args.rank_by not in table.columns:
+            print(f"❌ Unknown ranking statistic: {args.rank_by}")
+            sys.exit(1)
+        ranked_path = os.path.splitext(args.sweep_out)[0] + "_ranked.csv"
+        table.to_csv(ranked_path, index=False)
+        with pd.option_context('display.width', 200, 'display.max_columns', None):
+            print(table.head(args.top).to_string(index=False, float_format=lambda x: f"{x:.4g}"))
+        print(f"✅ {len(table)} runs ranked by {args.rank_by} → {ranked_path}")
+        return
+    
     # Validate configuration
     try:
         ProductionConfig.validate()
@@ -0,0 +1,249 @@
+"""
+Benchmarks for the analytics and strategy hot paths on synthetic data.
+
+    python benchmarks/bench_hot_paths.py                       # run, compare with benchmarks/baseline.json if present
+    python benchmarks/bench_hot_paths.py --save-baseline       # run and store the result as the new baseline
+    python benchmarks/bench_hot_paths.py --filter generate     # only cases whose name contains "generate"
+
+Each case is timed over --repeat calls after warm-up (median / p95 / min in ms), then run once more under
+tracemalloc for its peak allocation. A case is a regression when its median exceeds the baseline by more than
+--tolerance; the exit status is 1 if any case regressed, so the script can gate a deploy.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import logging
+import tempfile
+import tracemalloc
+from datetime import date, datetime, timedelta
+from types import SimpleNamespace
+
+# Never touch a trading box's database, logs or persisted model state
+_SCRATCH = tempfile.mkdtemp(prefix="volguard-bench-")
+for _name, _path in (
+    ("VG_LOG_DIR", "logs"), ("VG_DB_PATH", "bench.db"), ("VG_GARCH_STATE_PATH", "garch_state.json"),
+    ("VG_ROLLING_VOL_STATE_PATH", "rolling_vol.json"), ("VG_KILL_SWITCH_FILE", "KILL_SWITCH"),
+    ("VG_CANDLE_STORE_DIR", "candles"), ("VG_PARTICIPANT_CACHE_DIR", "participant_oi"), ("VG_CHAIN_SNAPSHOT_DIR", "chain_snapshots")
+):
+    os.environ[_name] = os.path.join(_SCRATCH, _path)
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy as np
+import pandas as pd
+
+import Volguard as vg
+
+vg.logger.setLevel(logging.CRITICAL)
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+STRIKE_COUNTS = (50, 150, 400)
+HISTORY_DAYS = (252, 400, 1000)
+SPOT = 24500.0
+
+
+# ==========================================
+# SYNTHETIC DATA
+# ==========================================
+def synthetic_history(days: int, seed: int = 1):
+    """Nifty and VIX daily candles shaped like CandleStore.frame: IST index, OHLC + volume/oi floats"""
+    rng = np.random.default_rng(seed)
+    index = pd.bdate_range(end=date.today() - timedelta(days=1), periods=days, tz="Asia/Kolkata", name="timestamp")
+    vix = np.empty(days)
+    vix[0] = 14.0
+    for i in range(1, days):
+        vix[i] = max(9.0, vix[i - 1] + 0.1 * (14.0 - vix[i - 1]) + rng.normal(0, 0.8))
+    close = SPOT * np.exp(np.cumsum(rng.normal(0, vix / 100 / np.sqrt(252))))
+    close *= SPOT / close[-1]
+
+    def frame(c):
+        noise = np.abs(rng.normal(0, 0.004, days))
+        return pd.DataFrame({
+            "open": c * (1 + rng.normal(0, 0.002, days)), "high": c * (1 + noise), "low": c * (1 - noise),
+            "close": c, "volume": np.zeros(days), "oi": np.zeros(days)
+        }, index=index)
+    return frame(close), frame(vix)
+
+
+def synthetic_chain(strikes: int, expiry: date, spot: float = SPOT, seed: int = 2) -> pd.DataFrame:
+    """Black-76 priced chain with a skewed smile, 50-point strikes centred on spot, in the parsed-chain layout"""
+    rng = np.random.default_rng(seed)
+    strike = np.round(spot / 50) * 50 + (np.arange(strikes) - strikes // 2) * 50.0
+    t = vg.OptionPricer.time_to_expiry(expiry)
+    moneyness = np.log(strike / spot)
+    columns = {"strike": strike}
+    for prefix, is_call in (("ce", True), ("pe", False)):
+        vol = 0.14 * (1 - 0.6 * moneyness + 6.0 * moneyness ** 2)
+        ltp = np.maximum(vg.OptionPricer.price(spot, strike, t, vol, is_call), 0.05)
+        greeks = vg.OptionPricer.greeks(spot, strike, t, vol, is_call)
+        columns.update({
+            f"{prefix}_iv": greeks["iv"], f"{prefix}_delta": greeks["delta"], f"{prefix}_gamma": greeks["gamma"],
+            f"{prefix}_oi": rng.integers(1_000, 200_000, strikes).astype(float), f"{prefix}_ltp": ltp,
+            f"{prefix}_bid": ltp * 0.995, f"{prefix}_ask": ltp * 1.005,
+            f"{prefix}_key": [f"NSE_FO|{int(k)}{prefix.upper()}" for k in strike]
+        })
+    return pd.DataFrame(columns)[list(vg.OptionChain.COLUMNS)]
+
+
+def synthetic_payload(chain: pd.DataFrame) -> list:
+    """The same chain as the raw option/chain REST payload (response.json()['data'])"""
+    def side(row, prefix):
+        return {
+            "instrument_key": row[f"{prefix}_key"],
+            "market_data": {"ltp": row[f"{prefix}_ltp"], "oi": row[f"{prefix}_oi"],
+                            "bid_price": row[f"{prefix}_bid"], "ask_price": row[f"{prefix}_ask"]},
+            "option_greeks": {"iv": row[f"{prefix}_iv"], "delta": row[f"{prefix}_delta"], "gamma": row[f"{prefix}_gamma"]}
+        }
+    return [{"strike_price": row["strike"], "call_options": side(row, "ce"), "put_options": side(row, "pe")}
+            for row in chain.to_dict("records")]
+
+
+def next_thursday(today: date, weeks: int = 0) -> date:
+    return today + timedelta(days=(3 - today.weekday()) % 7 or 7) + timedelta(weeks=weeks)
+
+
+# ==========================================
+# CASES
+# ==========================================
+def cold_vol_metrics(nifty_hist, vix_hist, live):
+    """get_vol_metrics on a fresh engine: full rolling-vol rebuild over the whole history and a GARCH fit with no warm start"""
+    engine = vg.AnalyticsEngine()
+    engine.rolling_vol = vg.RollingVolEngine(state_path=None)
+    engine.garch.state = {}
+    return engine.get_vol_metrics(nifty_hist, vix_hist, live)
+
+
+def build_cases(engine: vg.AnalyticsEngine):
+    """(name, params, callable) for every benchmarked path and size"""
+    cases = []
+    today = date.today()
+    weekly, next_weekly, monthly = next_thursday(today), next_thursday(today, 1), next_thursday(today, 3)
+    live = SimpleNamespace(data={
+        vg.ProductionConfig.NIFTY_KEY: SimpleNamespace(last_price=SPOT), vg.ProductionConfig.VIX_KEY: SimpleNamespace(last_price=14.0)
+    })
+
+    # The shared engine is warm after the first call (rolling vol in sync, GARCH warm-started): the per-cycle cost.
+    # The cold case rebuilds everything each call, so it scales with history length.
+    for days in HISTORY_DAYS:
+        nifty_hist, vix_hist = synthetic_history(days)
+        cases.append(("get_vol_metrics", {"days": days}, lambda n=nifty_hist, v=vix_hist: engine.get_vol_metrics(n, v, live)))
+        cases.append(("get_vol_metrics_cold", {"days": days}, lambda n=nifty_hist, v=vix_hist: cold_vol_metrics(n, v, live)))
+
+    nifty_hist, vix_hist = synthetic_history(400)
+    vol = engine.get_vol_metrics(nifty_hist, vix_hist, live)
+    time_metrics = engine.get_time_metrics(weekly, monthly, next_weekly)
+    external = engine.get_external_metrics(nifty_hist, None, None, 0.0, today.strftime("%d-%b-%Y"))
+    factory = vg.StrategyFactory(None)
+    regime = vg.RegimeEngine()
+
+    # Scoring works on scalar metrics only, so one case covers it
+    weekly_chain, monthly_chain = synthetic_chain(150, weekly), synthetic_chain(150, monthly, seed=3)
+    struct = engine.get_struct_metrics(weekly_chain, SPOT, 75)
+    edge = engine.get_edge_metrics(weekly_chain, monthly_chain, SPOT, vol)
+    cases.append(("calculate_scores", {}, lambda: regime.calculate_scores(vol, struct, edge, external, time_metrics, "WEEKLY")))
+
+    for strikes in STRIKE_COUNTS:
+        weekly_chain, monthly_chain = synthetic_chain(strikes, weekly), synthetic_chain(strikes, monthly, seed=3)
+        payload = synthetic_payload(weekly_chain)
+
+        cases.append(("parse_chain_json", {"strikes": strikes}, lambda p=payload: vg.OptionChain.from_json(p)))
+        cases.append(("parse_chain_frame", {"strikes": strikes}, lambda c=weekly_chain: vg.OptionChain.from_frame(c).to_frame()))
+        cases.append(("get_struct_metrics", {"strikes": strikes}, lambda c=weekly_chain: engine.get_struct_metrics(c, SPOT, 75)))
+        cases.append(("get_edge_metrics", {"strikes": strikes},
+                      lambda w=weekly_chain, m=monthly_chain: engine.get_edge_metrics(w, m, SPOT, vol)))
+
+        for structure in ("IRON_CONDOR", "IRON_FLY", "CREDIT_SPREAD"):
+            score = vg.RegimeScore(7.0, 7.0, 7.0, 7.0, 7.0, "HIGH")
+            mandate = vg.TradingMandate("WEEKLY", weekly, (weekly - today).days, "MODERATE_SHORT", "MODERATE_SHORT",
+                                        40.0, 2, float(vg.ProductionConfig.MARGIN_SELL_BASE), score, [], [], structure)
+            for selection in ("FIXED", "RANKED"):
+                def generate(c=weekly_chain, m=mandate, s=selection):
+                    vg.ProductionConfig.STRATEGY_SELECTION = s
+                    return factory.generate(m, c, 75, vol, SPOT)
+                cases.append(("generate", {"structure": structure, "selection": selection, "strikes": strikes}, generate))
+    return cases
+
+
+def case_name(name: str, params: dict) -> str:
+    if not params:
+        return name
+    return f"{name}[{','.join(f'{k}={v}' for k, v in params.items())}]"
+
+
+def measure(fn, repeat: int, warmup: int) -> dict:
+    for _ in range(warmup):
+        fn()
+    samples = np.empty(repeat)
+    for i in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples[i] = (time.perf_counter() - started) * 1000
+
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "median_ms": float(np.median(samples)), "p95_ms": float(np.percentile(samples, 95)),
+        "min_ms": float(samples.min()), "peak_kb": peak / 1024
+    }
+
+
+# ==========================================
+# MAIN
+# ==========================================
+def main():
+    parser = argparse.ArgumentParser(description="VOLGUARD hot-path benchmarks")
+    parser.add_argument("--repeat", type=int, default=20, help="Timed calls per case")
+    parser.add_argument("--warmup", type=int, default=2, help="Untimed calls per case")
+    parser.add_argument("--filter", type=str, default="", help="Only run cases whose name contains this")
+    parser.add_argument("--baseline", type=str, default=DEFAULT_BASELINE, help="Baseline JSON to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="Write this run to --baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed median slowdown before a case counts as regressed")
+    parser.add_argument("--json", type=str, help="Also write this run's results to a JSON file")
+    args = parser.parse_args()
+
+    engine = vg.AnalyticsEngine()
+    baseline = {}
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+
+    results, regressions = {}, []
+    print(f"{'case':<62} {'median':>9} {'p95':>9} {'min':>9} {'peak KB':>9} {'vs base':>8}")
+    for name, params, fn in build_cases(engine):
+        label = case_name(name, params)
+        if args.filter not in label:
+            continue
+        stats = measure(fn, args.repeat, args.warmup)
+        results[label] = stats
+
+        change = ""
+        if label in baseline:
+            ratio = stats["median_ms"] / baseline[label]["median_ms"] - 1
+            change = f"{ratio:+.0%}"
+            if ratio > args.tolerance:
+                regressions.append(label)
+                change += " !"
+        print(f"{label:<62} {stats['median_ms']:>9.3f} {stats['p95_ms']:>9.3f} {stats['min_ms']:>9.3f} {stats['peak_kb']:>9.1f} {change:>8}")
+
+    run = {
+        "taken_at": datetime.now().isoformat(timespec="seconds"), "python": sys.version.split()[0],
+        "numpy": np.__version__, "pandas": pd.__version__, "repeat": args.repeat, "results": results
+    }
+    for path in filter(None, (args.baseline if args.save_baseline else None, args.json)):
+        with open(path, "w") as f:
+            json.dump(run, f, indent=2)
+        print(f"Results written to {path}")
+
+    if regressions:
+        print(f"\n{len(regressions)} case(s) slower than baseline by more than {args.tolerance:.0%}:")
+        for label in regressions:
+            print(f"  {label}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()